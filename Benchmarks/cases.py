@@ -0,0 +1,141 @@
+'''
+    This module defines the benchmark cases: the pipeline's hot paths, run
+    on synthetic data (see Utils/synthetic_data) generated once per size.
+
+    The grouper output that compare_multiple_probes and the tariff columns
+    work on comes from fake_grouper, so no real grouper is needed.
+'''
+from os import makedirs, path
+from typing import Callable
+import pandas as pd
+from Benchmarks.harness import BenchmarkCase
+from Plugins.combination_row import CombinationRowPlugin
+from Probe_classes.sex import Sex
+from Probes.probe_base import add_probe_rows, compare_multiple_probes
+from Probe_classes.grouper_file_type import GrouperFileType
+from Utils.grouper_data_import import (read_data, import_zl_data,
+                                       get_grouper_output_file_by_type)
+from Utils.grouper_df_utils import write_output
+from Utils.grouper_file_columns import parse_definition_file, fce_file_additional_cols
+from Utils.synthetic_data import generate_apc_data
+from tariff_kv_store import add_tariff_key, add_tariff_value
+from fake_grouper import group_file
+import Utils.constants as const
+
+BENCHMARK_SEED = 2024
+BENCHMARK_RDF_FILE = path.join(const.DATA_FILE_FOLDER, const.BASE_RDF_FILE)
+BENCHMARK_INPUT_FOLDER = path.join(const.BENCHMARK_FILE_FOLDER, "inputs")
+# The probe whose rows are added and compared, it has few values so the
+# grouped file is about the benchmark size
+BENCHMARK_PROBE = Sex
+
+
+def get_input_file(size: int, file_format: str) -> str:
+    '''
+    Returns the synthetic data file of size rows, generating it the first time.
+    '''
+    extension = const.DEFAULT_FILE_EXTENSION if file_format == 'raw' else '.txt'
+    input_file = path.join(BENCHMARK_INPUT_FOLDER,
+                           f"synthetic_{file_format}_{size}_{BENCHMARK_SEED}{extension}")
+    if not path.exists(input_file):
+        makedirs(BENCHMARK_INPUT_FOLDER, exist_ok=True)
+        definition_file = BENCHMARK_RDF_FILE if file_format == 'raw' else None
+        generate_apc_data(input_file, size, file_format, definition_file, seed=BENCHMARK_SEED)
+    return input_file
+
+def read_input(size: int) -> pd.DataFrame:
+    '''
+    Reads the raw synthetic data file of size rows.
+    '''
+    delimiter, column_mappings = parse_definition_file(BENCHMARK_RDF_FILE)
+    return read_data(get_input_file(size, 'raw'), column_mappings, delimiter)
+
+def get_grouped_probe_rows(size: int) -> pd.DataFrame:
+    '''
+    Returns the fake grouper's FCE output for base rows plus their probe
+    rows, about size rows in all, grouping them the first time.
+    '''
+    output_file = path.join(BENCHMARK_INPUT_FOLDER,
+                            f"grouped_probes_{size}_{BENCHMARK_SEED}{const.DEFAULT_FILE_EXTENSION}")
+    fce_file = get_grouper_output_file_by_type(output_file, GrouperFileType.FCE)
+    delimiter, column_mappings = parse_definition_file(BENCHMARK_RDF_FILE)
+
+    if not path.exists(fce_file):
+        base_rows = max(size // (len(BENCHMARK_PROBE) + 1), 1)
+        df = add_probe_rows(BENCHMARK_PROBE, read_input(size).iloc[:base_rows])
+        input_file = get_grouper_output_file_by_type(output_file, GrouperFileType.INPUT)
+        write_output(df, input_file, delimiter)
+        group_file(input_file, output_file, BENCHMARK_RDF_FILE)
+
+    return read_data(fce_file, fce_file_additional_cols(column_mappings), delimiter)
+
+def setup_read_data(size: int) -> Callable[[], tuple]:
+    '''
+    read_data on the raw synthetic file.
+    '''
+    delimiter, column_mappings = parse_definition_file(BENCHMARK_RDF_FILE)
+    input_file = get_input_file(size, 'raw')
+    return lambda: (input_file, column_mappings, delimiter)
+
+def setup_import_zl_data(size: int) -> Callable[[], tuple]:
+    '''
+    import_zl_data on the zl synthetic file.
+    '''
+    input_file = get_input_file(size, 'zl')
+    definition_file = path.join(const.DATA_FILE_FOLDER, const.DEFAULT_RDF_FILE)
+    return lambda: (input_file, '|', definition_file)
+
+def setup_combination_row(size: int) -> Callable[[], tuple]:
+    '''
+    CombinationRowPlugin on the raw synthetic rows.
+    '''
+    df = read_input(size)
+    return lambda: (df.copy(),)
+
+def run_combination_row(df: pd.DataFrame) -> None:
+    '''
+    CombinationRowPlugin, keeping the original rows as create_base_df does.
+    '''
+    CombinationRowPlugin().transform(df)
+
+def setup_add_probe_rows(size: int) -> Callable[[], tuple]:
+    '''
+    add_probe_rows on the raw synthetic rows.
+    '''
+    df = read_input(size)
+    return lambda: (BENCHMARK_PROBE, df)
+
+def setup_compare_multiple_probes(size: int) -> Callable[[], tuple]:
+    '''
+    compare_multiple_probes on the grouped probe rows.
+    '''
+    df = get_grouped_probe_rows(size)
+    return lambda: (df.copy(),)
+
+def setup_add_tariff_columns(size: int) -> Callable[[], tuple]:
+    '''
+    The tariff columns for the grouped probe rows. The tariff workbook
+    isn't in the repo, so the tariff values come from a made up store
+    with a value for every key.
+    '''
+    df = get_grouped_probe_rows(size)
+    keys = add_tariff_key(df.copy())['TariffKey'].unique()
+    kv_store = {key: 1000 + number for number, key in enumerate(keys)}
+    return lambda: (df.copy(), kv_store)
+
+def run_add_tariff_columns(df: pd.DataFrame, kv_store: dict) -> None:
+    '''
+    add_tariff_columns, with the kv store passed in.
+    '''
+    add_tariff_value(add_tariff_key(df), kv_store)
+
+
+BENCHMARK_CASES = [
+    BenchmarkCase('read_data', setup_read_data, read_data),
+    BenchmarkCase('import_zl_data', setup_import_zl_data, import_zl_data),
+    BenchmarkCase('CombinationRowPlugin', setup_combination_row, run_combination_row),
+    BenchmarkCase('add_probe_rows', setup_add_probe_rows, add_probe_rows),
+    BenchmarkCase('compare_multiple_probes', setup_compare_multiple_probes,
+                  compare_multiple_probes),
+    BenchmarkCase('add_tariff_columns', setup_add_tariff_columns, run_add_tariff_columns),
+]
@@ -0,0 +1,249 @@
+'''
+    This module times benchmark cases, records the results in a JSON
+    history file and flags results that are slower, or use more memory,
+    than the recent runs on the same machine.
+'''
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from json import dump, load
+from os import path
+from typing import Callable
+import numpy as np
+import pandas as pd
+
+# Differences below these are noise, however large they are relatively
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_BYTES = 1024 ** 2
+# Times of fewer runs than this are too noisy to flag, only memory is compared
+MIN_REGRESSION_REPEAT = 3
+# The baseline for each case and size is the median of this many recent results
+BASELINE_RUNS = 5
+# Times that look like regressions are measured again with this many times
+# the repeats before they're flagged
+CONFIRM_REPEAT_FACTOR = 3
+
+
+class BenchmarkCase:
+    '''
+    A hot path to benchmark. setup(size) prepares the inputs for a run over
+    size rows, once per size, and returns a function that gives the
+    arguments for each run, e.g. a fresh copy of a DataFrame the run
+    changes. run(*arguments) is the part that's timed.
+    '''
+
+    def __init__(self, name: str, setup: Callable[[int], Callable[[], tuple]],
+                 run: Callable):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+
+def measure(case: BenchmarkCase, size: int, repeat: int = 3) -> dict:
+    '''
+    Times case over size rows repeat times and keeps the fastest. The
+    peak memory is measured by one more run with tracemalloc, as tracing
+    slows the run down. tracemalloc doesn't see Arrow's allocations.
+    '''
+    arguments = case.setup(size)
+
+    times = []
+    for _ in range(repeat):
+        run_arguments = arguments()
+        start = time.perf_counter()
+        case.run(*run_arguments)
+        times.append(time.perf_counter() - start)
+
+    run_arguments = arguments()
+    tracemalloc.start()
+    try:
+        case.run(*run_arguments)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        'name': case.name,
+        'rows': size,
+        'seconds': seconds,
+        'peak_memory_bytes': peak_memory,
+        'rows_per_second': size / seconds if seconds > 0 else None,
+        'repeat': repeat,
+    }
+
+def run_benchmarks(cases: list[BenchmarkCase], sizes: list[int], repeat: int = 3) -> list[dict]:
+    '''
+    Measures every case at every size, smallest first, printing each result.
+    '''
+    results = []
+    for case in cases:
+        for size in sorted(sizes):
+            result = measure(case, size, repeat)
+            print(f"  {case.name} @ {size}: {result['seconds']:.3f}s", flush=True)
+            results.append(result)
+    return results
+
+def machine_info() -> dict:
+    '''
+    Identifies the machine and versions the benchmarks ran on, as results
+    are only comparable between runs on the same machine.
+    '''
+    return {
+        'machine': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+    }
+
+def load_history(history_file: str) -> dict:
+    '''
+    Returns the benchmark history, or an empty one if there's no file yet.
+    '''
+    if not path.exists(history_file):
+        return {'runs': []}
+    with open(history_file, 'r', encoding='utf-8') as f:
+        return load(f)
+
+def baseline_results(history: dict, machine: str, runs: int = BASELINE_RUNS) -> dict:
+    '''
+    Returns the baseline for each case and size from the given machine,
+    keyed by (name, rows): the median time and peak memory of its latest
+    results (up to runs of them), so one noisy run doesn't set the bar.
+    Times from runs with fewer than MIN_REGRESSION_REPEAT repeats are left
+    out. Runs of only some of the cases don't hide the results of the others.
+    '''
+    recent = {}
+    for run in history['runs']:
+        if run['machine']['machine'] != machine:
+            continue
+        for result in run['results']:
+            recent.setdefault((result['name'], result['rows']), []).append(
+                dict(result, timestamp=run['timestamp']))
+
+    baseline = {}
+    for key, results in recent.items():
+        results = results[-runs:]
+        timed = [result['seconds'] for result in results
+                 if result.get('repeat', 1) >= MIN_REGRESSION_REPEAT]
+        memory = [result['peak_memory_bytes'] for result in results
+                  if result['peak_memory_bytes'] is not None]
+        baseline[key] = {
+            'seconds': float(np.median(timed)) if timed else None,
+            'peak_memory_bytes': float(np.median(memory)) if memory else None,
+            'runs': len(results),
+            'timestamp': results[-1]['timestamp'],
+        }
+    return baseline
+
+def find_regressions(results: list[dict], baseline: dict,
+                     time_threshold: float = 0.2,
+                     memory_threshold: float = 0.2) -> list[dict]:
+    '''
+    Compares each result to the same case and size in the baseline (see
+    baseline_results). A result regresses if it's more than time_threshold
+    (a fraction) slower, or uses more than memory_threshold more peak
+    memory, and the difference is more than noise. Times are only compared
+    if the result ran at least MIN_REGRESSION_REPEAT times.
+    '''
+    regressions = []
+    for result in results:
+        before = baseline.get((result['name'], result['rows']))
+        if before is None:
+            continue
+        for metric, threshold, minimum in (
+                ('seconds', time_threshold, MIN_REGRESSION_SECONDS),
+                ('peak_memory_bytes', memory_threshold, MIN_REGRESSION_BYTES)):
+            if before[metric] is None or result[metric] is None:
+                continue
+            if metric == 'seconds' and result.get('repeat', 1) < MIN_REGRESSION_REPEAT:
+                continue
+            change = result[metric] - before[metric]
+            if change > minimum and result[metric] > before[metric] * (1 + threshold):
+                regressions.append({
+                    'name': result['name'],
+                    'rows': result['rows'],
+                    'metric': metric,
+                    'baseline': before[metric],
+                    'value': result[metric],
+                    'change': change / before[metric] if before[metric] else None,
+                    'baseline_runs': before['runs'],
+                    'baseline_timestamp': before['timestamp'],
+                })
+    return regressions
+
+def confirm_regressions(cases: list[BenchmarkCase], results: list[dict], baseline: dict,
+                        time_threshold: float = 0.2, memory_threshold: float = 0.2
+                        ) -> list[dict]:
+    '''
+    Finds the regressions (see find_regressions), measuring each case and
+    size whose time regressed again with CONFIRM_REPEAT_FACTOR times the
+    repeats and keeping the fastest of all its runs, as one slow patch of
+    a busy machine can make every run of a case slow.
+    The results are updated in place.
+    '''
+    regressions = find_regressions(results, baseline, time_threshold, memory_threshold)
+    slower = {(regression['name'], regression['rows']) for regression in regressions
+              if regression['metric'] == 'seconds'}
+    if not slower:
+        return regressions
+
+    cases_by_name = {case.name: case for case in cases}
+    for result in results:
+        if (result['name'], result['rows']) not in slower:
+            continue
+        repeat = result['repeat'] * CONFIRM_REPEAT_FACTOR
+        print(f"  Measuring {result['name']} @ {result['rows']} again, {repeat} times",
+              flush=True)
+        again = measure(cases_by_name[result['name']], result['rows'], repeat)
+        result['seconds'] = min(result['seconds'], again['seconds'])
+        result['rows_per_second'] = (result['rows'] / result['seconds']
+                                     if result['seconds'] > 0 else None)
+        result['repeat'] += repeat
+
+    return find_regressions(results, baseline, time_threshold, memory_threshold)
+
+def record_run(history_file: str, history: dict, results: list[dict],
+               regressions: list[dict], machine: dict) -> None:
+    '''
+    Appends the run to the history and writes the history file.
+    '''
+    history['runs'].append({
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'machine': machine,
+        'results': results,
+        'regressions': regressions,
+    })
+    with open(history_file, 'w', encoding='utf-8') as f:
+        dump(history, f, indent=4)
+
+def print_report(results: list[dict], regressions: list[dict], baseline: dict) -> None:
+    '''
+    Prints each result and any regressions against the baseline.
+    '''
+    print("\n--- Benchmark Results ---")
+    for result in results:
+        rate = result['rows_per_second']
+        rate = f"{rate:,.0f} rows/s" if rate is not None else "-"
+        print(f"  {result['name']:<28} {result['rows']:>9,} rows  "
+              f"{result['seconds']:>9.3f}s  {rate:>16}  "
+              f"{result['peak_memory_bytes'] / 1024 ** 2:>9.1f} MB peak")
+
+    if not any((result['name'], result['rows']) in baseline for result in results):
+        print("\nNo previous results on this machine to compare against.")
+        return
+
+    print("\n--- Regressions against the median of recent results ---")
+    if any(result.get('repeat', 1) < MIN_REGRESSION_REPEAT for result in results):
+        print(f"  Times of fewer than {MIN_REGRESSION_REPEAT} repeats aren't compared")
+    if not regressions:
+        print("  None")
+    for regression in regressions:
+        change = regression['change']
+        change = f"+{change:.0%}" if change is not None else "new"
+        print(f"  {regression['name']} @ {regression['rows']:,} rows: {regression['metric']} "
+              f"{regression['baseline']:.4g} -> {regression['value']:.4g} ({change}) "
+              f"against {regression['baseline_runs']} runs up to "
+              f"{regression['baseline_timestamp']}")
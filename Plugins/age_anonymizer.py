@@ -15,7 +15,7 @@ class AgeAnonymizerPlugin(BasePlugin):
     '''
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         if 'STARTAGE' in df.columns:
-            mask = (df['STARTAGE'] > 25) & (df['STARTAGE'] < 40)
+            mask = ((df['STARTAGE'] > 25) & (df['STARTAGE'] < 40)).fillna(False).astype(bool)
 
             df.loc[mask, 'STARTAGE'] = [
                 random.randint(25, 40) for _ in range(mask.sum())
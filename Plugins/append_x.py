@@ -4,6 +4,7 @@ in the grouper input data.
 '''
 import pandas as pd
 from Utils.constants import DIAGNOSIS_PREFIX
+from Utils.data_types import transform_strings
 from Plugins.base_plugin import BasePlugin
 
 class AppendXPlugin(BasePlugin):
@@ -12,6 +13,7 @@ class AppendXPlugin(BasePlugin):
     The grouper requires that short diagnosis codes be 4 characters long and
     X is the specified filler character.
     '''
+    partition_safe = True
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         # Identify column names starting with 'DIAG' or 'OPER'
@@ -21,9 +23,14 @@ class AppendXPlugin(BasePlugin):
                 columns_to_update.append(column)
 
         for column in columns_to_update:
-            # Append 'X' to short diagnosis code (3 characters)
-            df[column] = df[column].apply(
-                lambda code: code + 'X' if isinstance(code,str) and len(code) == 3 else code
-                )
+            df[column] = transform_strings(df[column], append_x)
 
         return df
+
+
+def append_x(codes: pd.Series) -> pd.Series:
+    '''
+    Append 'X' to short diagnosis codes (3 characters), keeping the dtype.
+    '''
+    short = codes.str.len().eq(3).fillna(False).astype(bool)
+    return codes.mask(short, codes[short] + 'X')
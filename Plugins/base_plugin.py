@@ -11,7 +11,14 @@ class BasePlugin:
 
     Each plugin should have a "transform(dataframe)" method that
     takes a pandas dataframe and returns a transformed dataframe.
+
+    Plugins that give the same rows run separately on groups of whole
+    spells as on the whole dataframe set partition_safe, so that
+    apply_plugins_parallel can run them on partitions of the data in
+    parallel.
     '''
+    partition_safe = False
+
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         '''
             This method should be overridden by subclasses to provide
@@ -28,3 +35,17 @@ class BasePlugin:
                 The transformed DataFrame.
         '''
         raise NotImplementedError("Plugins must implement a transform method.")
+
+    def for_partition(self) -> 'BasePlugin':
+        '''
+            Returns the plugin to run on one partition of the data in
+            apply_plugins_parallel. Each partition gets its own copy.
+        '''
+        return self
+
+    def merge_partitions(self, partition_plugins: list) -> None:
+        '''
+            Called by apply_plugins_parallel once the plugin has run on every
+            partition, with the copies that ran, so that any state they
+            gathered can be combined. Does nothing by default.
+        '''
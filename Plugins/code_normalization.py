@@ -0,0 +1,122 @@
+'''
+This plugin normalizes the diagnosis and procedure codes in the grouper
+input data in one pass, replacing PeriodStripPlugin, NcStripPlugin and
+AppendXPlugin (and the shift_diags_left C utility).
+'''
+import numpy as np
+import pandas as pd
+from Utils.constants import DIAGNOSIS_PREFIX, PROCEDURE_PREFIX
+from Utils.data_types import restore_dtypes
+from Plugins.base_plugin import BasePlugin
+
+class CodeNormalizationPlugin(BasePlugin):
+    '''
+    Plugin that applies, in order:
+      1. strip_periods: strips periods from DIAG and OPER codes
+      2. strip_nc: strips #NC placeholders from DIAG codes
+      3. append_x: appends an 'X' to DIAG codes that are 3 characters long
+      4. shift_left: moves DIAG codes left to fill empty DIAG columns
+    Each step can be turned off. With the defaults the output is the same
+    as PeriodStripPlugin, NcStripPlugin and AppendXPlugin run in sequence.
+
+    All the code cells are gathered once and each distinct code is
+    normalized once, rather than every column being processed separately.
+    '''
+    partition_safe = True
+
+    def __init__(self, strip_periods: bool = True, strip_nc: bool = True,
+                 append_x: bool = True, shift_left: bool = False):
+        '''
+        :param strip_periods: Strip periods from DIAG and OPER codes.
+        :param strip_nc: Strip #NC (no code placeholder) from DIAG codes.
+        :param append_x: Append 'X' to 3 character DIAG codes.
+        :param shift_left: Close gaps in the DIAG columns by moving codes left.
+        '''
+        self.strip_periods = strip_periods
+        self.strip_nc = strip_nc
+        self.append_x = append_x
+        self.shift_left = shift_left
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        diag_columns = [column for column in df.columns if column.startswith(DIAGNOSIS_PREFIX)]
+        oper_columns = [column for column in df.columns if column.startswith(PROCEDURE_PREFIX)]
+        # Columns with no codes at all are left alone, except for DIAG gaps
+        # that codes need to be moved into
+        filled = [df[column].notna().any() for column in diag_columns]
+        if self.shift_left:
+            last_filled = max((position for position, fill in enumerate(filled) if fill), default=-1)
+            filled = [position <= last_filled for position in range(len(diag_columns))]
+        diag_columns = [column for column, fill in zip(diag_columns, filled) if fill]
+        oper_columns = [column for column in oper_columns if df[column].notna().any()]
+        columns = diag_columns + oper_columns
+        if not columns:
+            return df
+
+        # Every code cell, DIAG columns first
+        values = df[columns].to_numpy(dtype=object, copy=True)
+        is_diag = np.arange(len(columns)) < len(diag_columns)
+        present = pd.notna(values)
+        changed = np.zeros(values.shape, dtype=bool)
+
+        for diag in (True, False):
+            cells = present & (is_diag == diag)[None, :]
+            if cells.any():
+                values[cells], changed[cells] = self._normalize(values[cells], diag)
+
+        if self.shift_left and diag_columns:
+            diags, moved = shift_codes_left(values[:, :len(diag_columns)])
+            values[:, :len(diag_columns)] = diags
+            changed[:, :len(diag_columns)] |= moved
+
+        # Only write back the columns that changed, most code columns are
+        # empty and rebuilding them is most of the cost
+        changed = changed.any(axis=0)
+        changed_columns = [column for column, change in zip(columns, changed) if change]
+        if not changed_columns:
+            return df
+
+        normalized = pd.DataFrame({column: values[:, position]
+                                   for position, column in enumerate(columns)
+                                   if changed[position]}, index=df.index)
+        # Typed frames keep their code dtypes
+        df[changed_columns] = restore_dtypes(normalized, df[changed_columns].dtypes)
+
+        return df
+
+    def _normalize(self, codes: np.ndarray, diag: bool) -> tuple:
+        '''
+        Applies the enabled steps to the codes. Each distinct code is only
+        transformed once.
+        Returns the normalized codes and which of them changed.
+        '''
+        positions, distinct = pd.factorize(codes)
+        original = pd.Series(distinct, dtype=object)
+        distinct = original
+
+        if self.strip_periods:
+            distinct = distinct.str.replace('.', '', regex=False)
+        if diag and self.strip_nc:
+            distinct = distinct.str.replace('#NC', '', regex=False)
+        if diag and self.append_x:
+            short = distinct.str.len().eq(3).fillna(False).astype(bool)
+            distinct = distinct.mask(short, distinct[short] + 'X')
+
+        changed = ~distinct.eq(original).fillna(False).to_numpy(dtype=bool)
+        return distinct.to_numpy(dtype=object)[positions], changed[positions]
+
+
+def shift_codes_left(values: np.ndarray) -> tuple:
+    '''
+    Moves the codes in each row of a 2D array left, keeping their order,
+    so that the empty cells (missing or '') are all at the end. Empty
+    cells come back as NaN.
+    Returns the shifted codes and which cells changed.
+    '''
+    empty = pd.isna(values) | (pd.Series(values.ravel(), dtype=object) == '').to_numpy(
+        dtype=bool).reshape(values.shape)
+    order = np.argsort(empty, axis=1, kind='stable')
+    shifted = np.take_along_axis(values, order, axis=1)
+    now_empty = np.take_along_axis(empty, order, axis=1)
+    shifted[now_empty] = np.nan
+    moved = (order != np.arange(values.shape[1])[None, :]) | (now_empty & ~pd.isna(values))
+    return shifted, moved
@@ -26,6 +26,8 @@ class ColumnExtenderPlugin(BasePlugin):
     want to maximize the fields available to avoid dropping codes when the combined
     list might otherwise exceed the length of the original number of code fields.
     '''
+    partition_safe = True
+
     def __init__(self, prefix: str, maximum: int):
         '''
         :param prefix: The prefix, e.g. 'DIAG_' or 'OPER_'.
@@ -77,4 +79,12 @@ class ColumnExtenderPlugin(BasePlugin):
         # Reindex the DataFrame to include these new columns
         df = df.reindex(columns=column_list)
 
+        # Typed frames keep their code dtype, reindex would add float columns
+        code_dtype = df[last_column_name].dtype
+        if code_dtype != object:
+            if isinstance(code_dtype, pd.CategoricalDtype):
+                code_dtype = 'category'
+            new_columns = column_list[last_column_position + 1:new_column_position + 1]
+            df[new_columns] = df[new_columns].astype(code_dtype)
+
         return df
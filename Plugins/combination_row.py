@@ -6,8 +6,12 @@
 import pandas as pd
 import numpy as np
 from Utils.constants import DIAGNOSIS_PREFIX, PROCEDURE_PREFIX
+from Utils.data_types import restore_dtypes
 from Plugins.base_plugin import BasePlugin
 
+# Added to the PROVSPNO of a combination row
+COMBINATION_SUFFIX = "_C"
+
 
 class CombinationRowPlugin(BasePlugin):
     '''
@@ -23,6 +27,7 @@ class CombinationRowPlugin(BasePlugin):
       - OPER_01..OPER_99: deduplicated set of codes from the group
     Other columns are copied from the last row of the group.
     '''
+    partition_safe = True
 
     def __init__(self, replace_rows: bool = False):
         '''
@@ -45,92 +50,148 @@ class CombinationRowPlugin(BasePlugin):
         diag_columns = [column for column in df.columns if column.startswith(DIAGNOSIS_PREFIX)]
         oper_columns = [column for column in df.columns if column.startswith(PROCEDURE_PREFIX)]
 
-        # We’ll build a list of new rows (in dict form) as we go
-        processed_rows = []
-        unique_spells = df['PROVSPNO'].unique()
-
-        for spell in unique_spells:
-            # Skip any spells that have already been combined.
-            if isinstance(spell, str) and spell.endswith("_C"):
-                # Append original rows unchanged
-                for index in df[df['PROVSPNO'] == spell].index:
-                    row_dict = df.loc[index].to_dict()
-                    processed_rows.append(row_dict)
-                continue
-
-            # Subset of rows for this PROVSPNO
-            spell_df = df[df['PROVSPNO'] == spell]
-
-            # Check if all rows in spell_df share identical values for the columns in check_cols
-            consistent = self._core_values_identical(spell_df, check_columns)
-
-            # Add the original rows to new_rows in their current order
-            # We'll do it one by one, so we know where the last row is
-            if not self.replace_rows:
-                for index in spell_df.index:
-                    row_dict = df.loc[index].to_dict()
-                    processed_rows.append(row_dict)
-
-            # If consistent, we add a combination row right after the last row
-            if consistent:
-                # We'll base the new row mostly on the last row in this group
-                last_idx = spell_df.index[-1]
-                combo_row = df.loc[last_idx].to_dict()
-
-                combo_row['PROVSPNO'] = str(combo_row['PROVSPNO']) + "_C"
-                combo_row['EPIORDER'] = 1
-                combo_row['EPIDUR'] = str(pd.to_numeric(spell_df['EPIDUR'], errors='coerce').sum())
-
-                # For DIAG_* and OPER_* columns, gather distinct codes and place them in the new row
-                combo_row = self._deduplicate_and_fill(spell_df, combo_row, diag_columns)
-                combo_row = self._deduplicate_and_fill(spell_df, combo_row, oper_columns)
-
-                # Insert the new row (dict) right after the last row
-                processed_rows.append(combo_row)
-
-        # Now convert new_rows back into a DataFrame
-        result_df = pd.DataFrame(processed_rows, columns=df.columns)
+        # Number the spells in order of first appearance. Rows are output
+        # spell by spell in that order, so a spell's rows end up together.
+        spell_codes, spells = pd.factorize(df['PROVSPNO'], use_na_sentinel=False)
+        spells = np.asarray(spells, dtype=object)
+        spell_sizes = np.bincount(spell_codes, minlength=len(spells))
+
+        # Skip any spells that have already been combined, and spells with
+        # no PROVSPNO as there's nothing to tie their rows together
+        already_combined = np.fromiter(
+            (isinstance(spell, str) and spell.endswith(COMBINATION_SUFFIX) for spell in spells),
+            dtype=bool, count=len(spells))
+        consistent = self._core_values_identical(df, spell_codes, check_columns)
+        combine = ((spell_sizes > 1) & consistent & ~already_combined
+                   & ~pd.isna(spells).astype(bool))
+
+        # Each spell's row positions, in their current order
+        spell_order = np.argsort(spell_codes, kind='stable')
+        spell_ends = np.cumsum(spell_sizes)
+
+        # Keep the original rows unless they're being replaced
+        keep_original = already_combined | (not self.replace_rows)
+        original_rows = np.flatnonzero(keep_original[spell_codes])
+        combined_spells = np.flatnonzero(combine)
+
+        combo_df = self._combination_rows(df, combined_spells, spell_codes, spell_order,
+                                          spell_ends, diag_columns, oper_columns)
+
+        # Put each combination row right after the last row of its spell
+        parts = [part for part in (df.iloc[original_rows], combo_df) if len(part)]
+        if not parts:
+            return pd.DataFrame(columns=df.columns)
+        spell_keys = np.concatenate((spell_codes[original_rows] * 2, combined_spells * 2 + 1))
+        result_df = pd.concat(parts, ignore_index=True)
+        result_df = result_df.iloc[np.argsort(spell_keys, kind='stable')].reset_index(drop=True)
+
+        # Rows built from Python values lose any compact dtypes the data was loaded with
+        result_df = restore_dtypes(result_df, df.dtypes)
 
         return result_df
 
-    def _core_values_identical(self, spell_df: pd.DataFrame, columns: list) -> bool:
+    def _core_values_identical(self, df: pd.DataFrame, spell_codes: np.ndarray,
+                               columns: list) -> np.ndarray:
         '''
-        Returns True if for all columns, the spell's rows have the same value.
+        Returns True for each spell whose rows have at most one distinct
+        non-null value in every column.
         '''
-        # If there's only one row, we can't combine it with anything
-        if len(spell_df) == 1:
-            return False
-
-        for column in columns:
-            unique_vals = spell_df[column].dropna().unique()
-            if len(unique_vals) > 1:
-                return False
-
-        return True
+        distinct = df[columns].groupby(spell_codes).nunique(dropna=True)
+        return (distinct.max(axis=1) <= 1).to_numpy()
 
-    def _deduplicate_and_fill(self, spell_df: pd.DataFrame, combo_row: dict, columns: list) -> dict:
+    def _combination_rows(self, df: pd.DataFrame, combined_spells: np.ndarray,
+                          spell_codes: np.ndarray, spell_order: np.ndarray,
+                          spell_ends: np.ndarray, diag_columns: list,
+                          oper_columns: list) -> pd.DataFrame:
+        '''
+        Builds the combination row for each of the combined spells, based on
+        the last row of the spell.
+        '''
+        # The rows of the combined spells, spell by spell
+        combined = np.zeros(len(spell_ends), dtype=bool)
+        combined[combined_spells] = True
+        member_rows = spell_order[combined[spell_codes[spell_order]]]
+        combo_numbers = np.cumsum(combined) - 1
+        member_combos = combo_numbers[spell_codes[member_rows]]
+
+        last_rows = spell_order[spell_ends[combined_spells] - 1]
+        combo_df = df.iloc[last_rows].reset_index(drop=True)
+
+        columns = {
+            'PROVSPNO': combo_df['PROVSPNO'].astype(str) + COMBINATION_SUFFIX,
+            'EPIORDER': np.ones(len(combo_df), dtype=np.int64),
+            'EPIDUR': self._summed_durations(df['EPIDUR'], member_rows, member_combos,
+                                             len(combined_spells)),
+        }
+        # For DIAG_* and OPER_* columns, gather distinct codes and place them in the new row
+        for code_columns in (diag_columns, oper_columns):
+            codes = self._deduplicate_and_fill(df, code_columns, member_rows, member_combos,
+                                               len(combined_spells))
+            columns.update(zip(code_columns, codes.T))
+
+        return combo_df.assign(**columns)
+
+    def _summed_durations(self, durations: pd.Series, member_rows: np.ndarray,
+                          member_combos: np.ndarray, combo_count: int) -> np.ndarray:
         '''
-        Gathers distinct non-null values from all rows in "spell_df" for each column.
-        Deduplicates them and add them to combo_row.
-        Any leftover column positions get cleared.
+        Sums EPIDUR over each combined spell, formatted as str() of the sum
+        of the spell's EPIDUR converted with pd.to_numeric: an integer if all
+        of them are, otherwise a float.
         '''
-        # Gather all distinct values from the group
-        all_codes = set()
-        for column in columns:
-            if column in spell_df.columns:
-                column_vals = spell_df[column].dropna().unique()
-                if column_vals.size > 0:
-                    all_codes.update(column_vals)
+        values = durations.iloc[member_rows]
+        numbers = pd.to_numeric(values, errors='coerce')
+        totals = numbers.groupby(member_combos).sum().reindex(range(combo_count), fill_value=0)
+
+        if pd.api.types.is_integer_dtype(numbers.dtype):
+            whole = np.ones(combo_count, dtype=bool)
+        else:
+            # Plain digit strings always convert to integers; anything else
+            # is converted spell by spell below, exactly as before
+            plain = values.astype(str).str.fullmatch(r'-?\d{1,18}').to_numpy(dtype=bool)
+            whole = np.bincount(member_combos, weights=~plain, minlength=combo_count) == 0
+
+        summed = np.empty(combo_count, dtype=object)
+        summed[whole] = [str(int(total)) for total in totals.to_numpy()[whole]]
+
+        starts = np.searchsorted(member_combos, np.arange(combo_count))
+        ends = np.searchsorted(member_combos, np.arange(combo_count), side='right')
+        for combo in np.flatnonzero(~whole):
+            spell_values = values.iloc[starts[combo]:ends[combo]]
+            summed[combo] = str(pd.to_numeric(spell_values, errors='coerce').sum())
+
+        return summed
+
+    def _deduplicate_and_fill(self, df: pd.DataFrame, columns: list, member_rows: np.ndarray,
+                              member_combos: np.ndarray, combo_count: int) -> np.ndarray:
+        '''
+        Gathers distinct non-null values from all rows of each combined spell
+        across the columns, one combination row per row of the result.
+        Codes are added to a set column by column, in row order within each
+        column, so the codes come out in the same order as they always have.
+        Any leftover column positions are NaN.
+        '''
+        codes = np.full((combo_count, len(columns)), np.nan, dtype=object)
+        if not columns or not combo_count:
+            return codes
 
-        # Deduplicate - could probably just use a set but that might scramble the order
-        deduped_codes = list(all_codes)
+        values = df[columns].iloc[member_rows].to_numpy(dtype=object)
+        member, column = np.nonzero(pd.notna(values))
+        order = np.lexsort((member, column, member_combos[member]))
+        member, column = member[order], column[order]
 
-        # Now place them into the new row
-        for index, column in enumerate(columns):
-            if index < len(deduped_codes):
-                combo_row[column] = deduped_codes[index]
-            else:
-                # Clear out unused columns
-                combo_row[column] = np.nan
+        sequence = values[member, column]
+        bounds = np.searchsorted(member_combos[member], np.arange(combo_count + 1))
 
-        return combo_row
+        # Deduplicate - could probably just use a set but that might scramble the order
+        deduped_codes = [list(set(sequence[start:end]))[:len(columns)]
+                         for start, end in zip(bounds[:-1], bounds[1:])]
+
+        lengths = np.fromiter((len(spell_codes) for spell_codes in deduped_codes),
+                              dtype=np.int64, count=combo_count)
+        rows = np.repeat(np.arange(combo_count), lengths)
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        flat_codes = np.empty(lengths.sum(), dtype=object)
+        flat_codes[:] = [code for spell_codes in deduped_codes for code in spell_codes]
+        codes[rows, positions] = flat_codes
+
+        return codes
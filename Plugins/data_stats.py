@@ -1,7 +1,9 @@
 '''
     This module provides a data stats plugin that prints out statistics about the DataFrame.
 '''
-from typing import List
+from json import dump
+from typing import Optional
+import numpy as np
 import pandas as pd
 from Utils.constants import DIAGNOSIS_PREFIX, PROCEDURE_PREFIX
 from Plugins.base_plugin import BasePlugin
@@ -20,14 +22,29 @@ class DataStatsPlugin(BasePlugin):
           (i.e., > 1 row and consistent across key columns)
         - Count of single-episode spells
         - Count of inconsistent spells, plus how many had inconsistentcy on a given column.
+
+    The stats are also kept in self.stats as a dict of plain values, and
+    written as JSON to output_file if one is given.
     '''
+    partition_safe = True
 
-    def __init__(self):
+    def __init__(self, output_file: Optional[str] = None, silent: bool = False,
+                 accumulate: bool = False):
         '''
         Initialize the plugin with the prefixes for DIAG and OPER columns,
+        :param output_file: If set, the stats are written to this JSON file.
+        :param silent: If True, the stats aren't printed.
+        :param accumulate: If True, each transform adds to the stats of the
+                           frames seen before (e.g. the chunks of a file) and
+                           nothing is printed or written until report is called.
         '''
         self.diag_prefix = DIAGNOSIS_PREFIX
         self.oper_prefix = PROCEDURE_PREFIX
+        self.output_file = output_file
+        self.silent = silent
+        self.accumulate = accumulate
+        self.counts = None
+        self.stats = None
 
         # The columns that must match for a spell to be considered "consistent"
         self.check_columns = [
@@ -36,185 +53,362 @@ class DataStatsPlugin(BasePlugin):
         ]
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
-        # We won't modify df at all—we'll just print stats and return the same DataFrame.
+        # We won't modify df at all—we'll just gather stats and return the same DataFrame.
+        counts = self.collect_counts(df)
+        if self.accumulate and self.counts is not None:
+            counts = merge_counts(self.counts, counts)
+        self.counts = counts
+        self.stats = self.summarise(counts)
+
+        if not self.accumulate:
+            self.report()
+
+        return df
+
+    def for_partition(self) -> 'DataStatsPlugin':
+        '''
+        A copy that only collects counts, so each partition doesn't print
+        its own stats. merge_partitions combines them.
+        '''
+        return DataStatsPlugin(accumulate=True)
+
+    def merge_partitions(self, partition_plugins: list) -> None:
+        '''
+        Adds the counts of the partitions together, as if this plugin had
+        run on all of the data at once.
+        '''
+        counts = self.counts if self.accumulate else None
+        for plugin in partition_plugins:
+            if plugin.counts is not None:
+                counts = plugin.counts if counts is None else merge_counts(counts, plugin.counts)
+        if counts is None:
+            return
+
+        self.counts = counts
+        self.stats = self.summarise(counts)
+
+        if not self.accumulate:
+            self.report()
+
+    def report(self) -> None:
+        '''
+        Prints the stats and writes them to output_file, as set up.
+        '''
+        if not self.silent:
+            self.print_stats(self.stats)
+
+        if self.output_file is not None:
+            self.write_stats(self.output_file)
+
+    def compute_stats(self, df: pd.DataFrame) -> dict:
+        '''
+        Returns the stats for the DataFrame as a dict that can be written to JSON.
+        '''
+        return self.summarise(self.collect_counts(df))
+
+    def collect_counts(self, df: pd.DataFrame) -> dict:
+        '''
+        Returns the counts the stats are worked out from. Counts of
+        different frames can be added together with merge_counts.
+        '''
+        diag_columns = [column for column in df.columns if column.startswith(self.diag_prefix)]
+        oper_columns = [column for column in df.columns if column.startswith(self.oper_prefix)]
+        skip = set(diag_columns + oper_columns)
+
+        return {
+            'rows': len(df),
+            'columns': {column: self.column_counts(df[column])
+                        for column in df.columns if column not in skip},
+            'codes': {
+                'DIAG': self.code_counts(df, diag_columns),
+                'OPER': self.code_counts(df, oper_columns),
+            },
+            'spells': self.spell_counts(df),
+        }
+
+    def summarise(self, counts: dict) -> dict:
+        '''
+        Returns the stats for the counts as a dict that can be written to JSON.
+        '''
+        return {
+            'rows': counts['rows'],
+            'columns': {column: self.column_stats(column_counts)
+                        for column, column_counts in counts['columns'].items()},
+            'codes': {group: self.code_stats(code_counts)
+                      for group, code_counts in counts['codes'].items()},
+            'spells': self.spell_stats(counts['spells']),
+        }
+
+    def write_stats(self, output_file: str) -> None:
+        '''
+        Writes the stats from the last transform to a JSON file.
+        '''
+        with open(output_file, 'w', encoding='utf-8') as f:
+            dump(self.stats, f, indent=4)
+
+    def print_stats(self, stats: dict) -> None:
+        '''
+        Prints the stats from compute_stats.
+        '''
         print("\n===== Data Stats Plugin  =====")
 
         # 1. Per-column Stats
-        self.print_column_stats(df)
+        self.print_column_stats(stats['columns'])
 
         # 2. DIAG / OPER Groups
-        self.print_diag_oper_stats(df)
+        self.print_diag_oper_stats(stats['codes'])
 
         # 3. Spell Stats
-        self.print_spell_stats(df)
+        self.print_spell_stats(stats['spells'])
 
         print("===== Done with Data Stats Plugin =====\n")
 
-        return df
-
     # ----------------------------------------------------------------------
     # 1. Column-Level Stats
     # ----------------------------------------------------------------------
-    def print_column_stats(self, df: pd.DataFrame):
+    def column_counts(self, series: pd.Series) -> dict:
+        '''
+        Counts of each distinct value in one column (other than DIAG_*, OPER_*).
+        '''
+        # Categoricals count their unused categories too
+        counts = series.value_counts(dropna=True)
+        counts = counts[counts > 0]
+        counts.index = counts.index.astype(object)
+
+        # Integer or float as converting the whole column would give,
+        # which depends on the dtype and any gaps as well as the values
+        distinct = pd.to_numeric(series.drop_duplicates(), downcast='integer', errors='coerce')
+
+        return {
+            'length': len(series),
+            'counts': counts,
+            'integer': pd.api.types.is_integer_dtype(distinct.dtype),
+        }
+
+    def column_stats(self, column_counts: dict) -> dict:
+        '''
+        Stats for one column. Numeric columns get range, mean and mode,
+        others a distinct count and top 5 values.
+        '''
+        # Work on the distinct values rather than every row, there are few of them
+        counts = sort_counts(column_counts['counts'])
+
+        # Attempt to treat column as numeric
+        numbers = pd.to_numeric(counts.index.to_series(index=range(len(counts))),
+                                errors='coerce').to_numpy(dtype=float)
+        valid = ~np.isnan(numbers)
+        number_counts = counts.to_numpy()[valid]
+        numbers = numbers[valid]
+        non_null_count = int(number_counts.sum())
+
+        # Threshold to decide if it's "really" numeric
+        if non_null_count > 0.8 * column_counts['length']:
+            # Different strings can be the same number ("1", "01")
+            number_counts = pd.Series(number_counts).groupby(numbers).sum()
+            convert = int if column_counts['integer'] else float
+
+            # Nievely taking the first mode
+            modes = number_counts.index[number_counts.to_numpy() == number_counts.max()]
+
+            return {
+                'type': 'numeric',
+                'min': convert(number_counts.index.min()),
+                'max': convert(number_counts.index.max()),
+                'mean': float((number_counts.index * number_counts).sum() / non_null_count),
+                'mode': convert(modes.min()),
+            }
+
+        # Handle non-numeric columns
+        return {
+            'type': 'text',
+            'distinct': len(counts),
+            'top_5': {str(value): int(freq) for value, freq in counts.head(5).items()},
+        }
+
+    def print_column_stats(self, column_stats: dict):
         '''Print stats about each column in the DataFrame (except DIAG_*, OPER_*).'''
-        diag_columns = [c for c in df.columns if c.startswith(self.diag_prefix)]
-        oper_columns = [c for c in df.columns if c.startswith(self.oper_prefix)]
-        skip = set(diag_columns + oper_columns)
-
         print("\n--- Per-Column Stats ---")
-        for column in df.columns:
-            if column in skip:
-                continue
-
-            # Attempt to treat column as numeric
-            numeric_column = pd.to_numeric(df[column], downcast='integer', errors='coerce')
-            non_null_count = numeric_column.notna().sum()
-            # Threshold to decide if it's "really" numeric
-            if non_null_count > 0.8 * len(numeric_column):
-                column_min = numeric_column.min()
-                column_max = numeric_column.max()
-                column_mean = numeric_column.mean()
-                # Nievely taking the first mode
-                column_mode = numeric_column.mode(dropna=True)
-                column_mode_str = column_mode.iloc[0] if not column_mode.empty else "No mode"
-
-                print(f"\nColumn: {column}")
-                print(f"  Range: {column_min} .. {column_max}")
-                print(f"  Mean: {column_mean:.2f}")
-                print(f"  Mode: {column_mode_str}")
+        for column, stats in column_stats.items():
+            print(f"\nColumn: {column}")
+            if stats['type'] == 'numeric':
+                print(f"  Range: {stats['min']} .. {stats['max']}")
+                print(f"  Mean: {stats['mean']:.2f}")
+                print(f"  Mode: {stats['mode']}")
                 continue
 
-            # Handle non-numeric columns
-            distinct_count = df[column].nunique(dropna=True)
-            top_5 = df[column].value_counts(dropna=True).head(5)
-
-            print(f"\nColumn: {column}")
-            print(f"  Distinct count: {distinct_count}")
+            print(f"  Distinct count: {stats['distinct']}")
             print("  Top 5 values:")
-            for val, freq in top_5.items():
+            for val, freq in stats['top_5'].items():
                 print(f"    {val} => {freq}")
 
     # ----------------------------------------------------------------------
     # 2. DIAG / OPER Group Stats
     # ----------------------------------------------------------------------
-    def print_diag_oper_stats(self, df: pd.DataFrame):
-        '''Consider all DIAG columns as one group, and all OPER columns as one group.'''
-        diag_columns = [column for column in df.columns if column.startswith(self.diag_prefix)]
-        oper_columns = [column for column in df.columns if column.startswith(self.oper_prefix)]
+    def code_counts(self, df: pd.DataFrame, columns: list) -> dict:
+        '''
+        Consider all the columns as one group: counts of every non-null code,
+        column by column.
+        '''
+        codes = df[columns].to_numpy(dtype=object).ravel(order='F')
+        codes = pd.Series(codes[pd.notna(codes)], dtype=str)
+
+        return {
+            'columns': len(columns),
+            'counts': codes.value_counts().astype('int64'),
+        }
+
+    def code_stats(self, code_counts: dict) -> dict:
+        '''
+        Stats for a group of code columns.
+        '''
+        counts = sort_counts(code_counts['counts'])
+        top_10 = counts.head(10)
 
-        all_diag_vals = []
-        for column in diag_columns:
-            all_diag_vals.extend(df[column].dropna().tolist())
-
-        diag_series = pd.Series(all_diag_vals, dtype=str)
-        diag_distinct_count = diag_series.nunique()
-        diag_top_10 = diag_series.value_counts().head(10)
-
-        print("\n--- DIAG Group Stats ---")
-        print(f"  Number of DIAG columns: {len(diag_columns)}")
-        print(f"  Total codes: {len(all_diag_vals)}")
-        print(f"  Distinct codes: {diag_distinct_count}")
-        print("  Top 10 most common codes:")
-        for val, freq in diag_top_10.items():
-            print(f"    {val} => {freq}")
-
-        all_oper_vals = []
-        for column in oper_columns:
-            all_oper_vals.extend(df[column].dropna().tolist())
-
-        oper_series = pd.Series(all_oper_vals, dtype=str)
-        oper_distinct_count = oper_series.nunique()
-        oper_top_10 = oper_series.value_counts().head(10)
-
-        print("\n--- OPER Group Stats ---")
-        print(f"  Number of OPER columns: {len(oper_columns)}")
-        print(f"  Total codes: {len(all_oper_vals)}")
-        print(f"  Distinct codes: {oper_distinct_count}")
-        print("  Top 10 most common codes:")
-        for val, freq in oper_top_10.items():
-            print(f"    {val} => {freq}")
+        return {
+            'columns': code_counts['columns'],
+            'total': int(counts.sum()),
+            'distinct': len(counts),
+            'top_10': {str(value): int(freq) for value, freq in top_10.items()},
+        }
+
+    def print_diag_oper_stats(self, code_stats: dict):
+        '''Consider all DIAG columns as one group, and all OPER columns as one group.'''
+        for group, stats in code_stats.items():
+            print(f"\n--- {group} Group Stats ---")
+            print(f"  Number of {group} columns: {stats['columns']}")
+            print(f"  Total codes: {stats['total']}")
+            print(f"  Distinct codes: {stats['distinct']}")
+            print("  Top 10 most common codes:")
+            for val, freq in stats['top_10'].items():
+                print(f"    {val} => {freq}")
 
     # ----------------------------------------------------------------------
     # 3. Spell-Level Stats
     # ----------------------------------------------------------------------
-    def print_spell_stats(self, df: pd.DataFrame):
+    def spell_counts(self, df: pd.DataFrame) -> Optional[dict]:
         '''
         - # of spells
-        - Avg episodes per spell
+        - # of episodes in them
         - Count of spells that qualify for combination
         - Count of single-episode spells
         - Count of inconsistent spells
         - Count of those inconsistencies by column
+        None if there's no PROVSPNO column.
         '''
+        if 'PROVSPNO' not in df.columns:
+            return None
+
+        # If a column doesn't exist, treat it as "identical"
+        columns = [column for column in self.check_columns if column in df.columns]
+        spells = df.groupby('PROVSPNO', observed=True)
+        spell_sizes = spells.size().to_numpy()  # number of rows per spell
+
+        # One row per spell, True where the spell has more than 1 distinct
+        # non-null value in the column
+        multi_episode = spell_sizes > 1
+        inconsistent = (spells[columns].nunique(dropna=True).to_numpy() > 1) & multi_episode[:, None]
+        inconsistent_spells = inconsistent.any(axis=1)
+
+        # Track how many spells were inconsistent in each key column
+        inconsistent_per_column = dict.fromkeys(self.check_columns, 0)
+        inconsistent_per_column.update(zip(columns, inconsistent.sum(axis=0).tolist()))
+
+        return {
+            'total': len(spell_sizes),
+            'episodes': int(spell_sizes.sum()),
+            'qualify_for_combination': int((multi_episode & ~inconsistent_spells).sum()),
+            'single_episode': int((~multi_episode).sum()),
+            'inconsistent': int(inconsistent_spells.sum()),
+            'inconsistent_by_column': inconsistent_per_column,
+        }
+
+    def spell_stats(self, spell_counts: Optional[dict]) -> Optional[dict]:
+        '''
+        The spell counts, with the average episodes per spell in place of
+        the episode count.
+        '''
+        if spell_counts is None:
+            return None
+
+        stats = {key: value for key, value in spell_counts.items() if key != 'episodes'}
+        total = spell_counts['total']
+        stats['average_episodes'] = spell_counts['episodes'] / total if total > 0 else 0.0
+        return stats
 
+    def print_spell_stats(self, spell_stats: Optional[dict]):
+        '''Print the spell-level stats.'''
         print("\n--- Spell-Level Stats ---")
-        if 'PROVSPNO' not in df.columns:
+        if spell_stats is None:
             print("  No 'PROVSPNO' column found. Can't compute spell-level stats.")
             return
 
-        spells = df.groupby('PROVSPNO')
-        spell_sizes = spells.size()  # number of rows per spell
-        num_spells = len(spell_sizes)
-        avg_episodes = spell_sizes.mean() if num_spells > 0 else 0
+        print(f"  Total spells (distinct PROVSPNO): {spell_stats['total']}")
+        print(f"  Average episodes per spell: {spell_stats['average_episodes']:.2f}")
+        print(f"  Spells that qualify for combination: {spell_stats['qualify_for_combination']}")
+        print(f"  Single-episode spells (only 1 row): {spell_stats['single_episode']}")
+        print(f"  Inconsistent spells: {spell_stats['inconsistent']}")
+        print("\n  Inconsistency counts by column:")
+        for column, count in spell_stats['inconsistent_by_column'].items():
+            print(f"    {column} => {count}")
 
-        qualifies_count = 0
-        single_episode_count = 0
-        inconsistent_count = 0
 
-        # Track how many spells were inconsistent in each key column
-        inconsistent_per_column = {column: 0 for column in self.check_columns}
-
-        for _, spell_df in spells:
-            size = len(spell_df)
-            if size == 1:
-                single_episode_count += 1
-            else:
-                # Check if consistent
-                if self._all_values_identical(spell_df, self.check_columns):
-                    qualifies_count += 1
-                else:
-                    # It's inconsistent
-                    inconsistent_count += 1
-                    # Figure out which columns are inconsistent
-                    inc_columns = self._get_inconsistent_columns(spell_df, self.check_columns)
-                    for column in inc_columns:
-                        inconsistent_per_column[column] += 1
-
-        print(f"  Total spells (distinct PROVSPNO): {num_spells}")
-        print(f"  Average episodes per spell: {avg_episodes:.2f}")
-        print(f"  Spells that qualify for combination: {qualifies_count}")
-        print(f"  Single-episode spells (only 1 row): {single_episode_count}")
-        print(f"  Inconsistent spells: {inconsistent_count}")
-        print("\n  Inconsistency counts by column:")
-        for column in self.check_columns:
-            print(f"    {column} => {inconsistent_per_column[column]}")
+def merge_counts(counts: dict, other: dict) -> dict:
+    '''
+    Adds together the counts (from DataStatsPlugin.collect_counts) of two
+    frames, e.g. two chunks of the same file. Spells are assumed not to be
+    split between the frames.
+    '''
+    columns = dict(counts['columns'])
+    for column, column_counts in other['columns'].items():
+        if column not in columns:
+            columns[column] = column_counts
+            continue
+        columns[column] = {
+            'length': columns[column]['length'] + column_counts['length'],
+            'counts': add_value_counts(columns[column]['counts'], column_counts['counts']),
+            'integer': columns[column]['integer'] and column_counts['integer'],
+        }
+
+    codes = {group: {
+        'columns': max(code_counts['columns'], other['codes'][group]['columns']),
+        'counts': add_value_counts(code_counts['counts'], other['codes'][group]['counts']),
+    } for group, code_counts in counts['codes'].items()}
+
+    spells = counts['spells']
+    if spells is None or other['spells'] is None:
+        spells = spells or other['spells']
+    else:
+        spells = {key: (add_dicts(value, other['spells'][key]) if isinstance(value, dict)
+                        else value + other['spells'][key])
+                  for key, value in spells.items()}
+
+    return {
+        'rows': counts['rows'] + other['rows'],
+        'columns': columns,
+        'codes': codes,
+        'spells': spells,
+    }
+
+
+def add_value_counts(counts: pd.Series, other: pd.Series) -> pd.Series:
+    '''
+    Adds two value counts.
+    '''
+    return pd.concat([counts, other]).groupby(level=0, sort=False).sum()
 
-    # ----------------------------------------------------------------------
-    # Helpers
-    # ----------------------------------------------------------------------
-    def _all_values_identical(self, df_subset: pd.DataFrame, columns: List[str]) -> bool:
-        '''
-        Returns True if for all columns in cols, the subset's rows
-        have at most 1 distinct non-null value.
-        '''
-        for column in columns:
-            if column not in df_subset.columns:
-                # If the column doesn't exist, let's treat that as "identical" or skip
-                continue
-            unique_vals = df_subset[column].dropna().unique()
-            if len(unique_vals) > 1:
-                return False
-        return True
 
-    def _get_inconsistent_columns(self, df_subset: pd.DataFrame, columns: List[str]) -> List[str]:
-        '''
-        Return a list of columns that have more than 1 distinct non-null value.
-        '''
-        inconsistent_columns = []
-        for column in columns:
-            if column not in df_subset.columns:
-                continue
-            unique_vals = df_subset[column].dropna().unique()
-            if len(unique_vals) > 1:
-                inconsistent_columns.append(column)
-        return inconsistent_columns
+def sort_counts(counts: pd.Series) -> pd.Series:
+    '''
+    Sorts value counts from most to least common. Values with the same
+    count are in value order, which doesn't depend on how the data was
+    split up (into chunks or partitions) when it was counted.
+    '''
+    counts = counts.sort_index(key=lambda values: values.astype(str))
+    return counts.sort_values(ascending=False, kind='stable')
+
+
+def add_dicts(counts: dict, other: dict) -> dict:
+    '''
+    Adds two dicts of counts key by key.
+    '''
+    return {key: counts.get(key, 0) + other.get(key, 0) for key in {**counts, **other}}
@@ -4,12 +4,14 @@ codes in the grouper input data.
 '''
 import pandas as pd
 from Utils.constants import DIAGNOSIS_PREFIX
+from Utils.data_types import transform_strings
 from Plugins.base_plugin import BasePlugin
 
 class NcStripPlugin(BasePlugin):
     '''
     Plugin that strips #NC placeholders from any columns whose names start with DIAG.
     '''
+    partition_safe = True
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         # Identify column names starting with 'DIAG' or 'OPER'
@@ -19,6 +21,6 @@ class NcStripPlugin(BasePlugin):
                 columns_to_strip.append(column)
 
         for column in columns_to_strip:
-            df[column] = df[column].str.replace('#NC', '')
+            df[column] = transform_strings(df[column], lambda codes: codes.str.replace('#NC', ''))
 
         return df
@@ -17,8 +17,13 @@ class OnlyInpatientPlugin(BasePlugin):
     - 3: Regular day attender
     - 4: Regular night attender
     '''
+    partition_safe = True
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = df[df['CLASSPAT'].isin(['1', '2', '3', '4'])]
+        # CLASSPAT is a string unless the data was loaded typed
+        if pd.api.types.is_numeric_dtype(df['CLASSPAT']):
+            df = df[df['CLASSPAT'].isin([1, 2, 3, 4])]
+        else:
+            df = df[df['CLASSPAT'].isin(['1', '2', '3', '4'])]
 
         return df
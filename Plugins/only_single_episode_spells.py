@@ -13,6 +13,8 @@ class OnlySingleEpisodeSpellsPlugin(BasePlugin):
         so that we don't have to account for cross-episode interaction
         within the grouper (which is known to occur)
     '''
+    partition_safe = True
+
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         '''
         Filters the input DataFrame to remove any rows where EPIORDER is greater than 1.
@@ -31,7 +33,8 @@ class OnlySingleEpisodeSpellsPlugin(BasePlugin):
             raise ValueError("The input DataFrame must contain an 'EPIORDER' column.")
 
         # Identify the indices of rows where EPIORDER is greater than 1
-        rows_to_drop = df.index[df['EPIORDER'] > 1]
+        # A missing typed EPIORDER compares as NA rather than False
+        rows_to_drop = df.index[df['EPIORDER'].gt(1).fillna(False).astype(bool)]
 
         df.drop(index=rows_to_drop, inplace=True)
 
@@ -4,6 +4,7 @@ codes in the grouper input data.
 '''
 import pandas as pd
 from Utils.constants import DIAGNOSIS_PREFIX, PROCEDURE_PREFIX
+from Utils.data_types import transform_strings
 from Plugins.base_plugin import BasePlugin
 
 class PeriodStripPlugin(BasePlugin):
@@ -12,6 +13,7 @@ class PeriodStripPlugin(BasePlugin):
     The codesets use periods in the codes but the grouper requires they be removed.
     The number of procedure and diagnosis columns is configurable.
     '''
+    partition_safe = True
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         # Identify column names starting with 'DIAG' or 'OPER'
@@ -21,6 +23,6 @@ class PeriodStripPlugin(BasePlugin):
                 columns_to_strip.append(column)
 
         for column in columns_to_strip:
-            df[column] = df[column].str.replace('.', '')
+            df[column] = transform_strings(df[column], lambda codes: codes.str.replace('.', ''))
 
         return df
@@ -11,6 +11,7 @@ class ProcodetNullFillerPlugin(BasePlugin):
     This field is required by the grouper but the content of it doesn't matter.
     ZZZ is what's used in the example data.
     '''
+    partition_safe = True
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         if 'PROCODET' in df.columns:
@@ -2,11 +2,17 @@
     Class for Code Drop(ping).
 '''
 import itertools
+from functools import lru_cache
+from typing import Iterator, Optional
+import numpy as np
 import pandas as pd
 from tqdm import tqdm  # Add this import
 
 from Utils.constants import (DEFAULT_DELIMITER,
-                             DIAGNOSIS_PREFIX) #,PROCEDURE_PREFIX)
+                             DIAGNOSIS_PREFIX, #,PROCEDURE_PREFIX)
+                             CODE_DROP_MAX_COMBO_DIAGS,
+                             CODE_DROP_ROW_BUDGET,
+                             CODE_DROP_BLOCK_ROWS)
 
 class CodeDrop:
     '''
@@ -60,110 +66,108 @@ class CodeDrop:
         return new_rows
 
     @staticmethod
-    def generate_new_rows_vectorized_(df: pd.DataFrame) -> pd.DataFrame:
+    def generate_new_row_blocks(df: pd.DataFrame,
+                                max_combo_diags: int = CODE_DROP_MAX_COMBO_DIAGS,
+                                row_budget: Optional[int] = CODE_DROP_ROW_BUDGET,
+                                block_rows: int = CODE_DROP_BLOCK_ROWS,
+                                ) -> Iterator[pd.DataFrame]:
         """
-        Fully vectorized approach using bitmasking to generate all combinations of diagnosis codes for all rows.
+        Yields the code drop combination rows in blocks of at most block_rows
+        rows (or one bitmask's worth of rows if that's more), so they can be
+        written out without holding them all in memory.
+
+        Rows are grouped by their number of secondary diagnoses (n), then
+        the number kept (k), then each bitmask; each block is built with a
+        single broadcast over a mask matrix rather than a DataFrame per
+        bitmask. The PROVSPNO suffix is Combinations|k.
 
         Args:
             df (pd.DataFrame): The original DataFrame.
-
-        Returns:
-            pd.DataFrame: DataFrame with all code drop combinations.
+            max_combo_diags (int): Rows with more secondary diagnoses than this are skipped.
+            row_budget (int): Raise a ValueError rather than generate more rows than this.
+            block_rows (int): The target number of rows per block.
         """
         diag_cols = [col for col in df.columns if col.startswith(DIAGNOSIS_PREFIX)]
-
-        # Remove DIAG_01 from diag_df, keep it for later
-        diag_01_col = diag_cols[0]
         other_diag_cols = diag_cols[1:]
 
-        # Only operate on secondary diagnosis columns, keep other columns for later merge
-        diag_df = df[other_diag_cols].copy()
-        other_cols = [col for col in df.columns if col not in diag_cols]
-
         # Count non-null diagnosis codes per row (excluding DIAG_01)
-        row_ns = diag_df.notna().sum(axis=1)
-        max_n = row_ns.max()
-        if max_n == 0:
-            return pd.DataFrame(columns=df.columns)
-
-        # Bitmask cache
-        bitmask_cache = {}
-        def generate_bitmasks(n, k):
-            """
-            Recursively generate all bitmasks of length n with k bits set.
-            Uses symmetry: bitmasks with k set bits are complements of those with n-k set bits.
-            """
-            if k < 0 or k > n:
-                return []
-            if n == 0:
-                return [0] if k == 0 else []
-            key = (n, k)
-            if key in bitmask_cache:
-                return bitmask_cache[key]
-            if k > n // 2:
-                # Use symmetry: invert bitmasks for n-k
-                masks = generate_bitmasks(n, n - k)
-                full_mask = (1 << n) - 1
-                result = [bm ^ full_mask for bm in masks]
-                bitmask_cache[key] = result
-                return result
-            result = []
-            # Prepend 0: take all bitmasks of length n-1 with k set bits
-            for bm in generate_bitmasks(n-1, k):
-                result.append(bm << 1)
-            # Prepend 1: take all bitmasks of length n-1 with k-1 set bits
-            for bm in generate_bitmasks(n-1, k-1):
-                result.append((bm << 1) | 1)
-            bitmask_cache[key] = result
-            return result
-
-        # Precompute bitmask cache
-        for n in range(1, max_n + 1):
-            for k in range(1, n + 1):
-                bitmask_cache[(n, k)] = generate_bitmasks(n, k)
-
-        all_combinations = []
-        # Wrap the outer loop with tqdm for progress bar
-        for n in tqdm(range(1, max_n + 1), desc="n (non-null secondary diagnoses)", position=0):
-            group = diag_df[row_ns == n]
-            if group.empty:
+        row_ns = df[other_diag_cols].notna().sum(axis=1).to_numpy()
+
+        skipped = row_ns > max_combo_diags
+        if skipped.any():
+            print(f"Skipping {skipped.sum()} rows with more than {max_combo_diags} "
+                  "secondary diagnoses")
+        row_ns = np.where(skipped, 0, row_ns)
+
+        total_rows = int(((1 << row_ns.astype(np.int64)) - 1).sum())
+        if row_budget is not None and total_rows > row_budget:
+            raise ValueError(f"Code drop would generate {total_rows} rows, "
+                             f"over the budget of {row_budget}")
+
+        diag_values = df[other_diag_cols].to_numpy(dtype=object)
+        provspno = df['PROVSPNO'].astype(str).to_numpy(dtype=object)
+
+        for n in tqdm(range(1, int(row_ns.max(initial=0)) + 1),
+                      desc="n (non-null secondary diagnoses)", position=0):
+            positions = np.flatnonzero(row_ns == n)
+            if len(positions) == 0:
                 continue
-            # Wrap the k-loop with tqdm for finer progress if desired
-            for k in tqdm(range(1, n + 1), desc=f"k (combos for n={n})", leave=False, position=1):
-                for bitmask in bitmask_cache[(n, k)]:
-                    # Build mask for columns 0 to n-1 (all secondary diagnoses)
-                    mask = [(bitmask & (1 << i)) != 0 for i in range(n)]
-                    mask_df = pd.DataFrame([mask] * len(group), index=group.index, columns=other_diag_cols[:n])
-                    # Prepare new diagnosis columns
-                    diag_part = group.copy()
-                    diag_part.loc[:, other_diag_cols[:n]] = diag_part.loc[:, other_diag_cols[:n]].where(mask_df, other=pd.NA)
-                    if len(other_diag_cols) > n:
-                        # Assign pd.NA as a scalar to all remaining columns, after casting to object
-                        for col in other_diag_cols[n:]:
-                            diag_part[col] = pd.NA
-                        diag_part = diag_part.astype({col: 'object' for col in other_diag_cols[n:]})
-                    # Add DIAG_01 back
-                    diag_part[diag_01_col] = df.loc[diag_part.index, diag_01_col]
-                    # Build all columns at once to avoid fragmentation
-                    new_data = {}
-                    # Diagnosis columns in correct order
-                    for col in diag_cols:
-                        new_data[col] = diag_part[col] if col in diag_part else df.loc[diag_part.index, col]
-                    # Other columns
-                    for col in other_cols:
-                        new_data[col] = df.loc[diag_part.index, col]
-                    # Update PROVSPNO with unique combination descriptor
-                    new_data['PROVSPNO'] = (
-                        df.loc[diag_part.index, 'PROVSPNO'].astype(str) +
-                        f"{DEFAULT_DELIMITER}Combinations{DEFAULT_DELIMITER}{k}"
-                    )
-                    # Build DataFrame for this combination
-                    temp_df = pd.DataFrame(new_data, index=diag_part.index)
-                    # Ensure column order matches original
-                    temp_df = temp_df[df.columns]
-                    all_combinations.append(temp_df)
+            # The masks cover the first n secondary columns, the rest are cleared
+            group_values = diag_values[positions, :n]
+            masks_per_block = max(1, block_rows // len(positions))
+
+            for k in range(1, n + 1):
+                bitmasks = np.array(combination_bitmasks(n, k), dtype=np.int64)
+                masks = ((bitmasks[:, None] >> np.arange(n)) & 1).astype(bool)
 
-        if all_combinations:
-            return pd.concat(all_combinations, ignore_index=True)
+                for start in range(0, len(masks), masks_per_block):
+                    block_masks = masks[start:start + masks_per_block]
+                    yield CodeDrop._build_combination_block(
+                        df, positions, group_values, block_masks, other_diag_cols,
+                        provspno, f"{DEFAULT_DELIMITER}Combinations{DEFAULT_DELIMITER}{k}")
 
-        return pd.DataFrame(columns=df.columns)
+    @staticmethod
+    def _build_combination_block(df: pd.DataFrame, positions: np.ndarray,
+                                 group_values: np.ndarray, masks: np.ndarray,
+                                 other_diag_cols: list[str], provspno: np.ndarray,
+                                 suffix: str) -> pd.DataFrame:
+        """
+        Build the rows for a set of bitmasks over a group of rows: for each
+        mask (outer) every row of the group (inner), keeping the masked
+        secondary diagnoses.
+        """
+        mask_count, group_size, n = len(masks), len(positions), group_values.shape[1]
+        kept = np.where(masks[:, None, :], group_values[None, :, :], pd.NA)
+
+        diag_block = np.full((mask_count * group_size, len(other_diag_cols)), pd.NA,
+                             dtype=object)
+        diag_block[:, :n] = kept.reshape(mask_count * group_size, n)
+
+        rows = np.tile(positions, mask_count)
+        block = pd.concat([df.drop(columns=other_diag_cols).iloc[rows].reset_index(drop=True),
+                           pd.DataFrame(diag_block, columns=other_diag_cols, dtype=object)],
+                          axis=1)[df.columns]
+        block['PROVSPNO'] = provspno[rows] + suffix
+
+        # Consolidate, blocks with differing internal layouts are very slow to concat
+        return block.copy()
+
+
+@lru_cache(maxsize=None)
+def combination_bitmasks(n: int, k: int) -> tuple[int, ...]:
+    """
+    All bitmasks of length n with k bits set, in a fixed order.
+    Recursive, using symmetry: bitmasks with k set bits are complements of
+    those with n-k set bits.
+    """
+    if k < 0 or k > n:
+        return ()
+    if n == 0:
+        return (0,) if k == 0 else ()
+    if k > n // 2:
+        full_mask = (1 << n) - 1
+        return tuple(bm ^ full_mask for bm in combination_bitmasks(n, n - k))
+    # Prepend 0: take all bitmasks of length n-1 with k set bits,
+    # then prepend 1: take all bitmasks of length n-1 with k-1 set bits
+    return (tuple(bm << 1 for bm in combination_bitmasks(n - 1, k))
+            + tuple((bm << 1) | 1 for bm in combination_bitmasks(n - 1, k - 1)))
@@ -32,3 +32,17 @@ class EpisodeDuration(Probe):
                 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000,
                 10000, 20000, 30000, 40000, 50000, 60000, 70000, 80000, 90000,
                 MAX_EPISODE_DURATION]
+
+    @classmethod
+    def search_range(cls) -> tuple[int, int]:
+        return (0, MAX_EPISODE_DURATION)
+
+    @classmethod
+    def coarse_probe_values(cls) -> list[int]:
+        '''
+        Roughly logarithmic, with every day of the first week as short
+        stays are where most of the splits are.
+        '''
+        return [0, 1, 2, 3, 4, 5, 6, 7, 10, 14, 21, 30, 45, 60, 90,
+                120, 180, 250, 365, 500, 1000, 2000, 5000, 10000,
+                20000, 50000, MAX_EPISODE_DURATION]
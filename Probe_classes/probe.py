@@ -2,6 +2,7 @@
     This module defines the Probe abstract base class.
 '''
 from abc import ABC, abstractmethod
+from typing import Optional
 
 class Probe(ABC):
     '''
@@ -17,3 +18,17 @@ class Probe(ABC):
     @abstractmethod
     def probe_values(cls) -> list:
         """Returns the list of values to probe."""
+
+    @classmethod
+    def search_range(cls) -> Optional[tuple[int, int]]:
+        """
+        Returns the (inclusive) range of integer values that can be
+        bisected by the adaptive boundary search, or None if the probe's
+        values can't be searched.
+        """
+        return None
+
+    @classmethod
+    def coarse_probe_values(cls) -> list:
+        """Returns the sorted values an adaptive boundary search starts from."""
+        return sorted(cls.probe_values())
@@ -31,3 +31,18 @@ class StartAge(Probe):
                 109, 110, 111, 112, 113, 114, 115, 116, 117, 118, 119,
                 120, 121, 122, 123, 124, 125, 126, 127, 128, 129, 130,
                 MAX_START_AGE]
+
+    @classmethod
+    def search_range(cls) -> tuple[int, int]:
+        '''
+        Ages between 130 and the unknown placeholder aren't valid, so only
+        0 to 130 is searched. MAX_START_AGE is still probed on its own.
+        '''
+        return (0, 130)
+
+    @classmethod
+    def coarse_probe_values(cls) -> list[int]:
+        '''
+        Every 5 years, plus the unknown placeholder.
+        '''
+        return list(range(0, 131, 5)) + [MAX_START_AGE]
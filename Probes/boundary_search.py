@@ -0,0 +1,191 @@
+'''
+    This module provides an adaptive search for the values of a numeric
+    probe (e.g. start age, episode duration) at which the HRG changes.
+
+    Rather than grouping every probe value for every row, each row is
+    grouped at a coarse grid of values and then, round by round, only the
+    intervals whose endpoints group to different HRGs are bisected until
+    every change point is found exactly.
+
+    Note: an HRG that changes and changes back between two neighbouring grid
+    values can't be seen, so the coarse grid needs to be finer than the
+    narrowest band expected.
+'''
+from os import path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from Probe_classes.probe import Probe
+import Utils.constants as const
+from Utils.grouper_df_utils import write_output
+from . import probe_base as pb
+
+DEFAULT_MAX_ROUNDS = 32
+
+
+def run_boundary_search(probe_cls, no_cache: bool = False, jobs: int = 1,
+                        grouper_exe: Optional[str] = None,
+                        use_result_cache: bool = False, dedupe: bool = False,
+                        max_rounds: int = DEFAULT_MAX_ROUNDS) -> pd.DataFrame:
+    '''
+    Run an adaptive boundary search for the given Probe subclass over the
+    base rows and save the intervals to the processed folder.
+    Returns the intervals, see search_probe_boundaries.
+    '''
+    delimiter, df_base = pb.create_base_df(no_cache)
+
+    intervals = search_probe_boundaries(probe_cls, df_base, delimiter, max_rounds=max_rounds,
+                                        jobs=jobs, grouper_exe=grouper_exe,
+                                        use_result_cache=use_result_cache, dedupe=dedupe)
+
+    output_delimiter, _ = pb.get_fce_column_mappings()
+    output_file = path.join(const.PROCESSED_FILE_FOLDER,
+                            f"{probe_cls.__name__.lower()}_boundaries{const.DEFAULT_FILE_EXTENSION}")
+    write_output(intervals, output_file, output_delimiter)
+    print(f"Boundary search results saved to {output_file}")
+
+    return intervals
+
+
+def search_probe_boundaries(probe_cls, df_base: pd.DataFrame, delimiter: str,
+                            max_rounds: int = DEFAULT_MAX_ROUNDS,
+                            **group_options) -> pd.DataFrame:
+    '''
+    Find the values of the probe's column at which each base row's SpellHRG
+    changes, using one grouper run per round.
+
+    Parameters:
+    -----------
+    probe_cls : A Probe subclass with a search_range.
+    df_base : The base rows, one per single episode spell.
+    delimiter : The delimiter of the grouper input file.
+    max_rounds : The maximum number of grouper runs.
+    group_options : Passed on to group_probe_rows (jobs, grouper_exe, ...).
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per run of probed values with the same HRG: BasePROVSPNO,
+        Probe, Lower, Upper (the lowest and highest values probed, inclusive)
+        and SpellHRG. Where a change has been bisected to neighbouring
+        values, the next interval's Lower is this interval's Upper + 1.
+        Values probed outside the search range are intervals of their own.
+    '''
+    if not issubclass(probe_cls, Probe) or probe_cls.search_range() is None:
+        raise TypeError(f"{probe_cls.__name__} doesn't support an adaptive search")
+
+    column_name = probe_cls.column_name()
+    probe_name = probe_cls.__name__
+    file_name = f"{probe_name.lower()}_adaptive"
+
+    # Results are matched back to their row by PROVSPNO, so it must be unique
+    df_base = (df_base[df_base['PROVSPNO'].notna()]
+               .drop_duplicates(subset='PROVSPNO')
+               .reset_index(drop=True))
+    base_index = pd.Index(df_base['PROVSPNO'].astype(str))
+
+    coarse_values = np.array(probe_cls.coarse_probe_values(), dtype=np.int64)
+    points = pd.DataFrame({
+        'BasePosition': np.repeat(np.arange(len(df_base)), len(coarse_values)),
+        'Value': np.tile(coarse_values, len(df_base)),
+    })
+
+    results = []
+    rows_grouped = 0
+    rounds = 0
+    while not points.empty and rounds < max_rounds:
+        probe_rows = build_probe_rows(df_base, points, column_name, probe_name)
+        grouped_df = pb.group_probe_rows(probe_rows, delimiter, file_name, no_cache=True,
+                                         **group_options)
+        results.append(read_probe_results(grouped_df, base_index))
+        rows_grouped += len(probe_rows)
+        rounds += 1
+
+        points = next_probe_points(pd.concat(results, ignore_index=True),
+                                   probe_cls.search_range())
+
+    if not points.empty:
+        print(f"Stopped after {max_rounds} rounds with {len(points)} intervals unresolved")
+
+    print(f"{probe_name}: grouped {rows_grouped} rows in {rounds} rounds, "
+          f"probing every value would take {len(probe_cls.probe_values()) * len(df_base)}")
+
+    intervals = collapse_intervals(pd.concat(results, ignore_index=True),
+                                   probe_cls.search_range())
+    intervals.insert(0, 'BasePROVSPNO', df_base['PROVSPNO'].to_numpy()[intervals['BasePosition']])
+    intervals.insert(1, 'Probe', probe_name)
+
+    return intervals.drop(columns='BasePosition')
+
+
+def build_probe_rows(df_base: pd.DataFrame, points: pd.DataFrame,
+                     column_name: str, probe_name: str) -> pd.DataFrame:
+    '''
+    Copy the base row of each point and set the probed column to the
+    point's value, tagging PROVSPNO the same way add_probe_rows does.
+    '''
+    probe_rows = df_base.iloc[points['BasePosition'].to_numpy()].reset_index(drop=True)
+    values = points['Value'].to_numpy()
+    return pb.set_probe_values(probe_rows, column_name, values,
+                               pd.Series(values).astype(str), probe_name)
+
+
+def read_probe_results(grouped_df: pd.DataFrame, base_index: pd.Index) -> pd.DataFrame:
+    '''
+    Get the base row position, probe value and SpellHRG of each grouped row.
+    '''
+    parts = grouped_df['PROVSPNO'].str.split(const.DEFAULT_DELIMITER, n=2, expand=True,
+                                             regex=False)
+    return pd.DataFrame({
+        'BasePosition': base_index.get_indexer(parts[0]),
+        'Value': pd.to_numeric(parts[2]).to_numpy(dtype=np.int64),
+        'SpellHRG': grouped_df['SpellHRG'].to_numpy(),
+    })
+
+
+def next_probe_points(results: pd.DataFrame, search_range: tuple[int, int]) -> pd.DataFrame:
+    '''
+    Get the midpoints of the intervals that still need bisecting: those
+    between neighbouring probed values of a row that group to different
+    HRGs, are more than 1 apart and lie within the search range.
+    '''
+    results = results.sort_values(['BasePosition', 'Value'])
+    base = results['BasePosition'].to_numpy()
+    value = results['Value'].to_numpy()
+    hrg = results['SpellHRG'].fillna('').to_numpy()
+    lowest, highest = search_range
+
+    bisect = ((base[1:] == base[:-1])
+              & (hrg[1:] != hrg[:-1])
+              & (value[1:] - value[:-1] > 1)
+              & (value[:-1] >= lowest)
+              & (value[1:] <= highest))
+
+    return pd.DataFrame({
+        'BasePosition': base[:-1][bisect],
+        'Value': (value[:-1][bisect] + value[1:][bisect]) // 2,
+    })
+
+
+def collapse_intervals(results: pd.DataFrame, search_range: tuple[int, int]) -> pd.DataFrame:
+    '''
+    Collapse each row's probed values into runs of the same HRG.
+    Runs don't cross the edges of the search range: each value outside it
+    (e.g. the 999 start age sentinel) is an interval on its own, as the
+    values between it and the range were never probed.
+    '''
+    results = results.sort_values(['BasePosition', 'Value']).reset_index(drop=True)
+    hrg = results['SpellHRG'].fillna('')
+    lowest, highest = search_range
+    outside = (results['Value'] < lowest) | (results['Value'] > highest)
+    new_run = ((results['BasePosition'] != results['BasePosition'].shift())
+               | (hrg != hrg.shift())
+               | outside
+               | outside.shift(fill_value=False))
+
+    return (results.groupby(new_run.cumsum(), sort=False)
+            .agg(BasePosition=('BasePosition', 'first'),
+                 Lower=('Value', 'min'),
+                 Upper=('Value', 'max'),
+                 SpellHRG=('SpellHRG', 'first'))
+            .reset_index(drop=True))
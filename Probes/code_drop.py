@@ -4,6 +4,7 @@ procedure codes on the HRG.
 '''
 from Probe_classes.code_drop import CodeDrop
 from . import probe_base as pb
+from . import minimal_code_set as mcs
 
 def probe_code_drop(no_cache: bool = False):
     '''
@@ -24,3 +25,13 @@ def probe_code_drop(no_cache: bool = False):
         A new DataFrame containing both the original and the additional rows.
     '''
     pb.run_probe(CodeDrop, no_cache)
+
+
+def probe_code_drop_minimal(no_cache: bool = False):
+    '''
+    For each row, find a minimal set of secondary diagnoses that still gives
+    the same SpellHRG, using delta debugging rounds rather than grouping
+    every combination of codes.
+    See minimal_code_set.find_minimal_code_sets for the output.
+    '''
+    return mcs.run_minimal_code_set(no_cache)
@@ -11,6 +11,7 @@ This module is used to test the impact of Episode Duration on the HRG.
 
 from Probe_classes.episode_duration import EpisodeDuration
 from . import probe_base as pb
+from . import boundary_search as bs
 
 
 def probe_episode_duration(no_cache: bool = False):
@@ -31,3 +32,13 @@ def probe_episode_duration(no_cache: bool = False):
         A new DataFrame containing both the original and the additional rows.
     '''
     pb.run_probe(EpisodeDuration, no_cache)
+
+
+def probe_episode_duration_adaptive(no_cache: bool = False):
+    '''
+    Find the exact episode durations at which each row's HRG changes (e.g.
+    trim points), starting from a coarse grid of durations and only
+    bisecting where the HRG changed.
+    See boundary_search.search_probe_boundaries for the output.
+    '''
+    return bs.run_boundary_search(EpisodeDuration, no_cache)
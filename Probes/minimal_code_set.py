@@ -0,0 +1,255 @@
+'''
+    This module finds, for each spell, a minimal set of secondary diagnoses
+    that still groups to the spell's original SpellHRG.
+
+    CodeDrop tries every combination of secondary diagnoses (2^n rows per
+    spell). Instead this runs delta debugging (ddmin): the current set is
+    split into chunks and each chunk, and each set with a chunk removed, is
+    grouped; if one of them keeps the HRG the search continues from it,
+    otherwise the chunks are made smaller. Every spell's tests for a round
+    go to the grouper in one run, so the number of grouper runs only
+    depends on the largest spell.
+
+    The result is 1-minimal: removing any single code from it changes the
+    HRG. It isn't necessarily the smallest such set.
+'''
+from os import path
+from typing import Optional
+import numpy as np
+import pandas as pd
+import Utils.constants as const
+from Utils.grouper_df_utils import write_output
+from . import probe_base as pb
+
+PROBE_NAME = "CodeDropMin"
+DEFAULT_MAX_ROUNDS = 64
+
+
+def run_minimal_code_set(no_cache: bool = False, jobs: int = 1,
+                         grouper_exe: Optional[str] = None,
+                         use_result_cache: bool = False, dedupe: bool = False,
+                         max_rounds: int = DEFAULT_MAX_ROUNDS) -> pd.DataFrame:
+    '''
+    Find the minimal secondary diagnosis set of each base row and save the
+    results to the processed folder.
+    Returns the results, see find_minimal_code_sets.
+    '''
+    delimiter, df_base = pb.create_base_df(no_cache)
+
+    results = find_minimal_code_sets(df_base, delimiter, max_rounds=max_rounds,
+                                     jobs=jobs, grouper_exe=grouper_exe,
+                                     use_result_cache=use_result_cache, dedupe=dedupe)
+
+    output_delimiter, _ = pb.get_fce_column_mappings()
+    output_file = path.join(const.PROCESSED_FILE_FOLDER,
+                            f"minimal_code_sets{const.DEFAULT_FILE_EXTENSION}")
+    write_output(results, output_file, output_delimiter)
+    print(f"Minimal code sets saved to {output_file}")
+
+    return results
+
+
+def find_minimal_code_sets(df_base: pd.DataFrame, delimiter: str,
+                           max_rounds: int = DEFAULT_MAX_ROUNDS,
+                           **group_options) -> pd.DataFrame:
+    '''
+    Run ddmin over the secondary diagnoses of every base row, batching each
+    round's tests for all rows into one grouper run.
+
+    Parameters:
+    -----------
+    df_base : The base rows, one per single episode spell.
+    delimiter : The delimiter of the grouper input file.
+    max_rounds : The maximum number of grouper runs.
+    group_options : Passed on to group_probe_rows (jobs, grouper_exe, ...).
+
+    Returns:
+    --------
+    pd.DataFrame
+        One row per base row: BasePROVSPNO, SpellHRG, SecondaryCount,
+        MinimalCount, MinimalDiagnoses (';' separated, in column order)
+        and Resolved (False if max_rounds ran out or the row didn't group).
+    '''
+    # Results are matched back to their row by PROVSPNO, so it must be unique
+    df_base = (df_base[df_base['PROVSPNO'].notna()]
+               .drop_duplicates(subset='PROVSPNO')
+               .reset_index(drop=True))
+    diag_cols = [col for col in df_base.columns if col.startswith(const.DIAGNOSIS_PREFIX)]
+    secondary_cols = diag_cols[1:]
+    secondary_codes = df_base[secondary_cols].to_numpy(dtype=object)
+    present = df_base[secondary_cols].notna().to_numpy()
+
+    # Each search is the base row position, the target HRG, the current set
+    # (as secondary column indices) and the number of chunks to split it into
+    searches = [{'position': position,
+                 'target': None,
+                 'codes': list(np.flatnonzero(present[position])),
+                 'chunks': 2}
+                for position in range(len(df_base))]
+
+    # Round 0 groups each row as is and with no secondary diagnoses
+    tests = []
+    for search in searches:
+        tests.append((search, search['codes']))
+        tests.append((search, []))
+
+    rows_grouped = 0
+    rounds = 0
+    finished = []
+    while tests and rounds < max_rounds:
+        probe_rows = build_test_rows(df_base, secondary_cols, secondary_codes, tests, rounds)
+        grouped_df = pb.group_probe_rows(probe_rows, delimiter, "code_drop_minimal",
+                                         no_cache=True, **group_options)
+        test_hrgs = read_test_results(grouped_df, len(tests))
+        rows_grouped += len(tests)
+
+        if rounds == 0:
+            searches, done = start_searches(searches, test_hrgs)
+        else:
+            searches, done = advance_searches(tests, test_hrgs)
+        finished.extend(done)
+        tests = [test for search in searches for test in ddmin_tests(search)]
+        rounds += 1
+
+    unresolved = searches
+    if unresolved:
+        print(f"Stopped after {max_rounds} rounds with {len(unresolved)} searches unresolved")
+    print(f"{PROBE_NAME}: grouped {rows_grouped} rows in {rounds} rounds")
+
+    return summarise_searches(df_base, secondary_codes, finished, unresolved)
+
+
+def start_searches(searches: list[dict], test_hrgs: np.ndarray) -> tuple[list[dict], list[dict]]:
+    '''
+    Set each search's target from its unchanged row and finish those where
+    dropping every secondary diagnosis keeps the HRG (or there's nothing to
+    search).
+    return: the searches still running and the finished ones.
+    '''
+    running, done = [], []
+    for number, search in enumerate(searches):
+        search['target'] = test_hrgs[2 * number]
+        if pd.isna(search['target']):
+            search['resolved'] = False
+            done.append(search)
+        elif test_hrgs[2 * number + 1] == search['target']:
+            search['codes'] = []
+            done.append(search)
+        elif len(search['codes']) <= 1:
+            done.append(search)
+        else:
+            running.append(search)
+    return running, done
+
+
+def ddmin_tests(search: dict) -> list[tuple[dict, list]]:
+    '''
+    The code sets to try next for a search: each chunk on its own, then the
+    set with each chunk removed (the same as the chunks when there are 2).
+    '''
+    chunk_count = min(search['chunks'], len(search['codes']))
+    chunks = [list(chunk) for chunk in np.array_split(search['codes'], chunk_count)]
+    subsets = [(search, chunk) for chunk in chunks]
+    if chunk_count == 2:
+        return subsets
+
+    complements = [(search, [code for code in search['codes'] if code not in chunk])
+                   for chunk in chunks]
+    return subsets + complements
+
+
+def advance_searches(tests: list[tuple[dict, list]],
+                     test_hrgs: np.ndarray) -> tuple[list[dict], list[dict]]:
+    '''
+    Move each search on from its test results: to the first chunk that kept
+    the HRG, else the first complement that did, else to smaller chunks.
+    A search is finished when its chunks are single codes and none of the
+    tests kept the HRG.
+    return: the searches still running and the finished ones.
+    '''
+    outcomes = {}
+    for (search, codes), hrg in zip(tests, test_hrgs):
+        outcomes.setdefault(id(search), (search, []))[1].append((codes, hrg == search['target']))
+
+    running, done = [], []
+    for search, results in outcomes.values():
+        chunk_count = min(search['chunks'], len(search['codes']))
+        subsets, complements = results[:chunk_count], results[chunk_count:]
+        kept_subset = next((codes for codes, kept in subsets if kept), None)
+        kept_complement = next((codes for codes, kept in complements if kept), None)
+
+        if kept_subset is not None:
+            search['codes'], search['chunks'] = kept_subset, 2
+        elif kept_complement is not None:
+            search['codes'], search['chunks'] = kept_complement, max(chunk_count - 1, 2)
+        elif chunk_count < len(search['codes']):
+            search['chunks'] = min(chunk_count * 2, len(search['codes']))
+        else:
+            done.append(search)
+            continue
+
+        if len(search['codes']) <= 1:
+            done.append(search)
+        else:
+            running.append(search)
+
+    return running, done
+
+
+def build_test_rows(df_base: pd.DataFrame, secondary_cols: list[str],
+                    secondary_codes: np.ndarray, tests: list[tuple[dict, list]],
+                    search_round: int) -> pd.DataFrame:
+    '''
+    Build one row per test: the base row with only the test's secondary
+    diagnoses kept (in their original columns), tagged
+    PROVSPNO|CodeDropMin|round_test.
+    '''
+    positions = np.fromiter((search['position'] for search, _ in tests), dtype=np.int64,
+                            count=len(tests))
+    keep = np.zeros((len(tests), len(secondary_cols)), dtype=bool)
+    for number, (_, codes) in enumerate(tests):
+        keep[number, codes] = True
+
+    probe_rows = df_base.iloc[positions].reset_index(drop=True)
+    kept_codes = np.where(keep, secondary_codes[positions], None)
+    probe_rows[secondary_cols] = pd.DataFrame(kept_codes, columns=secondary_cols)
+    probe_rows['PROVSPNO'] = (probe_rows['PROVSPNO'].astype(str)
+                              + const.DEFAULT_DELIMITER + PROBE_NAME + const.DEFAULT_DELIMITER
+                              + f"{search_round}_" + pd.Series(np.arange(len(tests))).astype(str))
+    return probe_rows
+
+
+def read_test_results(grouped_df: pd.DataFrame, test_count: int) -> np.ndarray:
+    '''
+    Get the SpellHRG of each test, in test order, from the grouper output.
+    '''
+    test_numbers = (grouped_df['PROVSPNO'].str.rsplit('_', n=1).str[1]
+                    .astype(np.int64).to_numpy())
+    test_hrgs = np.full(test_count, np.nan, dtype=object)
+    test_hrgs[test_numbers] = grouped_df['SpellHRG'].to_numpy()
+    return test_hrgs
+
+
+def summarise_searches(df_base: pd.DataFrame, secondary_codes: np.ndarray,
+                       finished: list[dict], unresolved: list[dict]) -> pd.DataFrame:
+    '''
+    One row per search with its minimal set of secondary diagnoses.
+    '''
+    searches = sorted(finished + unresolved, key=lambda search: search['position'])
+    unresolved_ids = {id(search) for search in unresolved}
+
+    rows = []
+    for search in searches:
+        position = search['position']
+        codes = secondary_codes[position, search['codes']]
+        rows.append({
+            'BasePROVSPNO': df_base['PROVSPNO'].iat[position],
+            'SpellHRG': search['target'],
+            'SecondaryCount': int(pd.notna(secondary_codes[position]).sum()),
+            'MinimalCount': len(codes),
+            'MinimalDiagnoses': ';'.join(str(code) for code in codes),
+            'Resolved': search.get('resolved', True) and id(search) not in unresolved_ids,
+        })
+
+    return pd.DataFrame(rows, columns=['BasePROVSPNO', 'SpellHRG', 'SecondaryCount',
+                                       'MinimalCount', 'MinimalDiagnoses', 'Resolved'])
@@ -1,16 +1,27 @@
 '''
     This module provides functions for probing the grouper
 '''
+import re
 from os import path
 from enum import Enum
+from itertools import chain
+from typing import Iterable, Iterator, Optional
+import numpy as np
 import pandas as pd
 from Probe_classes.probe import Probe
 from Probe_classes.grouper_file_type import GrouperFileType
 import Utils.constants as const
 from Utils.grouper_df_utils import write_output, apply_plugins
+from Utils.plugin_profile import PluginProfile, get_profile_file
 from Utils.grouper_file_columns import parse_definition_file, fce_file_additional_cols
-from Utils.grouper_data_import import read_data, get_grouper_output_file_by_type
-from Utils.run_grouper import run_grouper
+from Utils.grouper_data_import import (read_data, read_grouper_output,
+                                       get_grouper_output_file_by_type)
+from Utils.sharded_grouper import run_grouper_sharded
+from Utils.grouper_cache import GrouperResultCache, run_grouper_cached, get_result_cache_tag
+from Utils.row_dedupe import dedupe_grouper_rows, expand_deduped_rows
+from Utils.grouper_input_writer import GrouperInputWriter
+from Utils.frame_cache import read_data_cached
+from Utils.stratified_sampling import hrg_strata, stratified_sample, row_weights
 from Plugins.period_strip import PeriodStripPlugin
 from Plugins.column_extender import ColumnExtenderPlugin
 from Plugins.combination_row import CombinationRowPlugin
@@ -27,7 +38,8 @@ def add_probe_rows(probe_cls, df: pd.DataFrame) -> pd.DataFrame:
 
     Parameters:
     -----------
-    probe_cls: The probe class (Enum, Probe subclass, or custom class with generate_new_rows).
+    probe_cls: The probe class (Enum, Probe subclass, or custom class with
+               generate_new_row_blocks or generate_new_rows).
     df : pd.DataFrame
         The original DataFrame to which new rows will be appended.
 
@@ -36,60 +48,120 @@ def add_probe_rows(probe_cls, df: pd.DataFrame) -> pd.DataFrame:
     pd.DataFrame
         A new DataFrame containing both the original and the additional rows.
     '''
-    new_rows = []
+    return pd.concat([df] + list(iter_probe_row_blocks(probe_cls, df)), ignore_index=True)
 
-    # Prefer vectorized method if available
-    if hasattr(probe_cls, 'generate_new_rows_vectorized'):
-        # Should return a DataFrame of new rows
-        new_rows_df = probe_cls.generate_new_rows_vectorized(df)
-        return pd.concat([df, new_rows_df], ignore_index=True)
 
-    # Handle custom probe classes with generate_new_rows (e.g. code_drop)
+def iter_probe_row_blocks(probe_cls, df: pd.DataFrame,
+                          block_rows: int = const.PROBE_BLOCK_ROWS) -> Iterator[pd.DataFrame]:
+    '''
+    Yields the new probe rows for the given DataFrame in blocks of roughly
+    block_rows rows, in the same order add_probe_rows adds them, so they can
+    be written out without building the whole set of rows at once.
+    '''
+    # Prefer the vectorized block generator if available (e.g. code_drop)
+    if hasattr(probe_cls, 'generate_new_row_blocks'):
+        yield from probe_cls.generate_new_row_blocks(df, block_rows=block_rows)
+        return
+
+    # Handle custom probe classes with only the row-by-row generate_new_rows
     if hasattr(probe_cls, 'generate_new_rows'):
+        new_rows = []
         for _, row in df.iterrows():
             new_rows.extend(probe_cls.generate_new_rows(row))
+            if len(new_rows) >= block_rows:
+                yield pd.DataFrame(new_rows, columns=df.columns)
+                new_rows = []
+        if new_rows:
+            yield pd.DataFrame(new_rows, columns=df.columns)
+        return
+
+    # Enum and Probe classes - e.g. admission_method, start_age
+    column_name, probe_values, value_names, probe_name = get_probe_values(probe_cls)
+    if len(probe_values) == 0:
+        return
+    base_rows_per_block = max(1, block_rows // len(probe_values))
+    for start in range(0, len(df), base_rows_per_block):
+        yield expand_probe_values(df.iloc[start:start + base_rows_per_block], column_name,
+                                  probe_values, value_names, probe_name)
+
+
+def get_probe_values(probe_cls) -> tuple[str, list, list[str], str]:
+    '''
+    Get the column, values, value names and probe name for an Enum or
+    Probe subclass.
+    return: column name, probe values, value names, probe class name
+    '''
+    # Enum type - e.g. admission_method
+    if issubclass(probe_cls, Enum):
+        column_name = probe_cls.column_name()
+        probe_values = [member.value for member in probe_cls]
+        value_names = [member.name for member in probe_cls]
+
+    # Probe class type - e.g. start_age
+    elif issubclass(probe_cls, Probe):
+        column_name = probe_cls.column_name()
+        probe_values = probe_cls.probe_values()
+        value_names = [str(value) for value in probe_values]
+
     else:
-        # Set up variables based on probe_cls type
-        # Enum type - e.g. admission_method
-        if issubclass(probe_cls, Enum):
-            column_name = probe_cls.column_name()
-            probe_values = [member.value for member in probe_cls]
-            value_names = [member.name for member in probe_cls]
-            probe_name = probe_cls.__name__
-
-        # Probe class type - e.g. start_age
-        elif issubclass(probe_cls, Probe):
-            column_name = probe_cls.column_name()
-            probe_values = probe_cls.probe_values()
-            value_names = [str(value) for value in probe_values]
-            probe_name = probe_cls.__name__
-
-        else:
-            raise TypeError("probe_cls must be an Enum, a Probe subclass, \
-                            or have a generate_new_rows method")
-
-        # Single loop to generate new rows
-        for _, row in df.iterrows():
-            for value, value_name in zip(probe_values, value_names):
-                new_row = row.copy()
-                new_row[column_name] = value
-                new_row["PROVSPNO"] = (
-                    f"{row['PROVSPNO']}{const.DEFAULT_DELIMITER}"
-                    f"{probe_name}{const.DEFAULT_DELIMITER}"
-                    f"{value_name}"
-                )
-                new_rows.append(new_row)
+        raise TypeError("probe_cls must be an Enum, a Probe subclass, \
+                        or have a generate_new_row_blocks or generate_new_rows method")
 
-    new_rows_df = pd.DataFrame(new_rows, columns=df.columns)
-    return pd.concat([df, new_rows_df], ignore_index=True)
+    return column_name, probe_values, value_names, probe_cls.__name__
+
+
+def expand_probe_values(df: pd.DataFrame, column_name: str, probe_values: list,
+                        value_names: list[str], probe_name: str) -> pd.DataFrame:
+    '''
+    Cross join the rows of the DataFrame with the probe values.
+    Each row is repeated once per value (row major, so all of a row's probe
+    rows are adjacent) and the PROVSPNO suffixes are built with a single
+    string operation rather than a row.copy() per value.
+
+    Returns only the new rows.
+    '''
+    num_values = len(probe_values)
+    if num_values == 0 or df.empty:
+        return pd.DataFrame(columns=df.columns)
+
+    positions = np.repeat(np.arange(len(df)), num_values)
+    new_rows_df = df.iloc[positions].reset_index(drop=True)
+
+    values = np.empty(num_values, dtype=object)
+    values[:] = probe_values
+    names = pd.Series(np.tile(np.array(value_names, dtype=object), len(df)))
+
+    return set_probe_values(new_rows_df, column_name, np.tile(values, len(df)),
+                            names, probe_name)
+
+
+def set_probe_values(new_rows_df: pd.DataFrame, column_name: str, values,
+                     value_names: pd.Series, probe_name: str) -> pd.DataFrame:
+    '''
+    Overwrite the probed column of already repeated rows with the given
+    values (aligned by position) and tag each PROVSPNO with the probe name
+    and value name.
+    '''
+    # Object values keep the probe's own types (e.g. str enum values)
+    # rather than letting numpy coerce them to a common type
+    new_rows_df[column_name] = pd.Series(values, index=new_rows_df.index).infer_objects()
+    new_rows_df["PROVSPNO"] = (
+        new_rows_df["PROVSPNO"].astype(str) + const.DEFAULT_DELIMITER
+        + probe_name + const.DEFAULT_DELIMITER
+        + value_names.astype(str).to_numpy()
+    )
+    return new_rows_df
 
 
 def create_base_df(no_cache: bool = False,
                    input_rdf = path.join(const.DATA_FILE_FOLDER, const.BASE_RDF_FILE),
                    data_file = const.SAMPLE_DATA_FILE,
-                   output_rdf = None) -> pd.DataFrame:
+                   output_rdf = None,
+                   profile: bool = False) -> pd.DataFrame:
     '''
     Create a base DataFrame for probing purposes.
+    If profile is set each plugin's time, rows and memory are printed and
+    written to a JSON file next to the base file.
     '''
     # Parse the definition file to figure out the delimiter and column info
     if data_file is None:
@@ -102,14 +174,15 @@ def create_base_df(no_cache: bool = False,
     output_delimiter, output_column_mappings = parse_definition_file(output_rdf)
 
     if not no_cache and path.exists(output_file_path):
-        return output_delimiter, read_data(output_file_path,
-                                           output_column_mappings,
-                                           output_delimiter)
+        return output_delimiter, read_data_cached(output_file_path,
+                                                  output_column_mappings,
+                                                  output_delimiter)
 
     input_delimiter, input_column_mappings = parse_definition_file(input_rdf)
 
     # Read in the data
-    df = read_data(data_file_path, input_column_mappings, input_delimiter)
+    reader = read_data if no_cache else read_data_cached
+    df = reader(data_file_path, input_column_mappings, input_delimiter)
 
     # Create a list of plugins
     plugins = [
@@ -123,32 +196,31 @@ def create_base_df(no_cache: bool = False,
 
     # Apply the plugins
     # Note that due to the column extender plugins, these are now in the output_rdf format
-    df_transformed = apply_plugins(df, plugins)
+    plugin_profile = PluginProfile() if profile else None
+    df_transformed = apply_plugins(df, plugins, plugin_profile)
 
     # Write out the file so we don't have to recompute it later
     write_output(df_transformed, output_file_path, output_delimiter)
 
+    if plugin_profile is not None:
+        plugin_profile.report()
+        plugin_profile.write_json(get_profile_file(output_file_path))
+
     return output_delimiter, df_transformed
 
-def run_probe(probe_class, no_cache: bool = False):
+def run_probe(probe_class, no_cache: bool = False, dedupe: bool = False) -> dict:
     '''
     Run a probe for the given enum class.
+    If dedupe is set, rows with identical grouping inputs are only grouped once.
+    Returns the mismatch report from compare_permuted_lines_to_source.
     '''
     delimiter, df = create_base_df(no_cache)
 
-    # Add enum rows to the DataFrame
-    new_df = add_probe_rows(probe_class, df)
-    probe_data_file = get_probe_file_name(probe_class, GrouperFileType.INPUT)
-    write_output(new_df, probe_data_file, delimiter)
-    # Get the output file name
-    grouper_output_base_file = get_probe_file_name(probe_class, GrouperFileType.OUTPUT)
-    if not path.exists(grouper_output_base_file) or no_cache:
-        #Run the grouper
-        _ = run_grouper(probe_data_file, None, grouper_output_base_file)
-
-    processed_df = load_probe_data(probe_class)
-    compare_permuted_lines_to_source(processed_df)
-    #print(f"The data has been processed and saved to {output_file_path}")
+    # Stream the source rows and then the probe rows into the grouper input
+    blocks = chain([df], iter_probe_row_blocks(probe_class, df))
+    processed_df = group_probe_blocks(blocks, delimiter, probe_class, no_cache=no_cache,
+                                      dedupe=dedupe)
+    return compare_permuted_lines_to_source(processed_df)
 
 def get_probe_file_name(probe_class, gf_type: GrouperFileType) -> str:
     '''
@@ -169,7 +241,13 @@ def get_probe_file_name(probe_class, gf_type: GrouperFileType) -> str:
 
     return get_grouper_output_file_by_type(file_base, gf_type)
 
-def run_multiple_probes(probe_classes: list, no_cache=False, data_file=None, rdf_file = None, output_rdf=None) -> None:
+def run_multiple_probes(probe_classes: list, no_cache=False, data_file=None, rdf_file = None,
+                        output_rdf=None, narrow_results: bool = False, jobs: int = 1,
+                        grouper_exe: Optional[str] = None,
+                        use_result_cache: bool = False, dedupe: bool = False,
+                        sample_per_stratum: Optional[int] = None,
+                        sample_seed: Optional[int] = None,
+                        sample_level: str = 'subchapter') -> None:
     '''
     Run multiple probes simultaneously and save the comparison results to a file.
 
@@ -177,48 +255,54 @@ def run_multiple_probes(probe_classes: list, no_cache=False, data_file=None, rdf
     -----------
     probe_classes : List of probe classes to run.
     no_cache : Bypass caching and recompute the base DataFrame and grouper output.
+    narrow_results : Save only the probe rows' key, probe, value and HRG columns.
+    jobs : Number of grouper processes to run the combined input across.
+    grouper_exe : Grouper executable to use instead of the GROUPER_EXE setting.
+    use_result_cache : Only send rows to the grouper that haven't been grouped before.
+    dedupe : Only group one of each set of rows with identical grouping inputs.
+    sample_per_stratum : Only probe this many base rows of each HRG stratum,
+                         see sample_base_df. The results get a SampleWeight column.
+    sample_seed : Seed for picking the sampled rows.
+    sample_level : Strata level, 'chapter', 'subchapter' or 'hrg'.
     '''
     # Create the base DataFrame
     delimiter, df_base = create_base_df(no_cache, data_file=data_file, input_rdf=rdf_file, output_rdf=output_rdf)
 
-    # Generate all probe rows
-    probe_rows_list = []
-    for probe_cls in probe_classes:
-        temp_df = add_probe_rows(probe_cls, df_base)
-        # Extract only the new probe rows (exclude base rows)
-        new_rows_df = temp_df.iloc[len(df_base):]
-        probe_rows_list.append(new_rows_df)
-
-    # Concatenate base DataFrame with all probe rows
-    # Note that the probe rows list is a list of dataframes, one per probe class
-    df_combined = pd.concat([df_base] + probe_rows_list, ignore_index=True)
-
-    # Write combined DataFrame to input HRG file
-    hrg_input_file = get_probe_file_name("multiple_probes",
-                                         GrouperFileType.INPUT)
-    hrg_output_file = get_probe_file_name("multiple_probes",
-                                          GrouperFileType.OUTPUT)
-    # this is just adding the class name to the file name, but we've already done that above, right?
-    #input_file = get_grouper_output_file_by_type(file_base, GrouperFileType.INPUT)
-
-
-    write_output(df_combined, hrg_input_file, delimiter)
+    sample_weights = None
+    if sample_per_stratum is not None:
+        df_base, sample_weights = sample_base_df(df_base, delimiter, sample_per_stratum,
+                                                 seed=sample_seed, level=sample_level,
+                                                 no_cache=no_cache, jobs=jobs,
+                                                 grouper_exe=grouper_exe,
+                                                 use_result_cache=use_result_cache,
+                                                 dedupe=dedupe)
+
+    # Stream the base rows and then each probe's rows into the grouper input,
+    # so the combined rows are never all held in memory
+    blocks = chain([df_base], *(iter_probe_row_blocks(probe_cls, df_base)
+                                for probe_cls in probe_classes))
+
+    # Run the grouper on the combined rows
+    df_grouper_output = group_probe_blocks(blocks, delimiter, "multiple_probes",
+                                           no_cache=no_cache, jobs=jobs, grouper_exe=grouper_exe,
+                                           use_result_cache=use_result_cache, dedupe=dedupe)
+    delimiter, _ = get_fce_column_mappings()
 
-    # Run grouper on the combined DataFrame
-    if not path.exists(hrg_output_file) or no_cache:
-        run_grouper(hrg_input_file, None, hrg_output_file)
-
-
-    grouper_processed_file = get_grouper_output_file_by_type(hrg_output_file, GrouperFileType.FCE)
+    # Perform comparison and collect results
+    comparison_df = compare_multiple_probes(df_grouper_output, narrow=narrow_results)
 
-    # Load grouper output
-    definition_file_path = path.join(const.DATA_FILE_FOLDER, const.DEFAULT_RDF_FILE)
-    delimiter, column_mappings = parse_definition_file(definition_file_path)
-    column_mappings = fce_file_additional_cols(column_mappings)
-    df_grouper_output = read_data(grouper_processed_file, column_mappings, delimiter)
+    if sample_weights is not None:
+        # Source rows have no BasePROVSPNO, their own PROVSPNO is the base one
+        base_provspno = comparison_df["BasePROVSPNO"].fillna(comparison_df["PROVSPNO"])
+        comparison_df["SampleWeight"] = base_provspno.map(
+            sample_weights.set_index("PROVSPNO")["SampleWeight"])
 
-    # Perform comparison and collect results
-    comparison_df = compare_multiple_probes(df_grouper_output)
+        weights_file = path.join(
+            const.PROCESSED_FILE_FOLDER,
+            f"multiple_probes_sample_weights{const.DEFAULT_FILE_EXTENSION}"
+            )
+        write_output(sample_weights, weights_file, delimiter)
+        print(f"Sample weights saved to {weights_file}")
 
     # Save comparison results to a file
     comparison_file = path.join(
@@ -229,109 +313,263 @@ def run_multiple_probes(probe_classes: list, no_cache=False, data_file=None, rdf
     write_output(comparison_df, comparison_file, delimiter)
     print(f"Comparison results saved to {comparison_file}")
 
-def load_probe_data(probe_class) -> pd.DataFrame:
+def sample_base_df(df_base: pd.DataFrame, delimiter: str, per_stratum: int,
+                   seed: Optional[int] = None, level: str = 'subchapter',
+                   **group_options) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Group the base rows once and keep up to per_stratum of them from each
+    stratum of SpellHRG chapter, subchapter or HRG (see level) and
+    GroupingMethodFlag, so the probes cover every stratum with a fraction
+    of the rows. The same seed keeps the same rows.
+
+    Parameters:
+    -----------
+    df_base : The base rows, one per single episode spell.
+    delimiter : The delimiter of the grouper input file.
+    per_stratum : The most rows to keep from each stratum.
+    seed : Seed for picking the rows.
+    level : 'chapter', 'subchapter' or 'hrg'.
+    group_options : Passed on to group_probe_rows (no_cache, jobs, ...).
+
+    Returns:
+    --------
+    The kept base rows, and one row per kept row with its PROVSPNO, Stratum,
+    StratumRows (base rows in the stratum) and SampleWeight (StratumRows
+    over the rows kept from it).
+    '''
+    grouped_df = group_probe_rows(df_base, delimiter, "probe_base_sample", **group_options)
+
+    # Results are matched back to their base row by PROVSPNO
+    results = grouped_df.drop_duplicates(subset="PROVSPNO").set_index("PROVSPNO")
+    provspno = df_base["PROVSPNO"]
+    strata = hrg_strata(provspno.map(results["SpellHRG"]),
+                        provspno.map(results["GroupingMethodFlag"]), level)
+
+    # Sample the row positions and strata rather than copying the wide rows twice
+    df_positions = pd.DataFrame({"Position": np.arange(len(df_base)),
+                                 "Stratum": strata.to_numpy()})
+    df_positions, strata_weights = stratified_sample(df_positions, df_positions["Stratum"],
+                                                     per_stratum, seed)
+    df_sample = df_base.iloc[df_positions["Position"].to_numpy()].reset_index(drop=True)
+    sample_strata = df_positions["Stratum"]
+
+    sample_weights = pd.DataFrame({
+        "PROVSPNO": df_sample["PROVSPNO"],
+        "Stratum": sample_strata,
+        "StratumRows": sample_strata.map(strata_weights.set_index("Stratum")["Rows"]),
+        "SampleWeight": row_weights(sample_strata, strata_weights),
+    })
+    print(f"Sampled {len(df_sample)} of {len(df_base)} base rows "
+          f"from {len(strata_weights)} strata")
+
+    return df_sample, sample_weights
+
+def group_probe_rows(df: pd.DataFrame, delimiter: str, file_name,
+                     no_cache: bool = False, jobs: int = 1,
+                     grouper_exe: Optional[str] = None,
+                     use_result_cache: bool = False,
+                     dedupe: bool = False) -> pd.DataFrame:
+    '''
+    Write the rows to the grouper input file for the given name, run the
+    grouper on them and load the FCE output.
+    See group_probe_blocks.
+    '''
+    return group_probe_blocks([df], delimiter, file_name, no_cache=no_cache, jobs=jobs,
+                              grouper_exe=grouper_exe, use_result_cache=use_result_cache,
+                              dedupe=dedupe)
+
+def group_probe_blocks(blocks: Iterable[pd.DataFrame], delimiter: str, file_name,
+                       no_cache: bool = False, jobs: int = 1,
+                       grouper_exe: Optional[str] = None,
+                       use_result_cache: bool = False,
+                       dedupe: bool = False) -> pd.DataFrame:
+    '''
+    Append each block of rows to the grouper input file for the given name
+    as it's generated, run the grouper on the file and load the FCE output.
+    If the output already exists it's reused unless no_cache is set.
+    If dedupe is set, only one of each set of rows with identical grouping
+    inputs is grouped and the output is expanded back to every row.
+    With use_result_cache the blocks are collected, as the cache needs
+    every row at once.
+    '''
+    hrg_input_file = get_probe_file_name(file_name, GrouperFileType.INPUT)
+    hrg_output_file = get_probe_file_name(file_name, GrouperFileType.OUTPUT)
+    grouper_processed_file = get_grouper_output_file_by_type(hrg_output_file, GrouperFileType.FCE)
+    output_delimiter, column_mappings = get_fce_column_mappings()
+    reuse_output = path.exists(grouper_processed_file) and not no_cache
+
+    if use_result_cache and not reuse_output:
+        df = pd.concat(list(blocks), ignore_index=True)
+        provspno = df['PROVSPNO']
+        if dedupe:
+            df, positions = dedupe_grouper_rows(df)
+        cache = GrouperResultCache(tag=get_result_cache_tag(grouper_exe))
+        grouped_df = run_grouper_cached(df, delimiter, hrg_input_file, hrg_output_file,
+                                        column_mappings, output_delimiter, cache,
+                                        grouper_exe=grouper_exe, jobs=jobs)
+    else:
+        writer = GrouperInputWriter(hrg_input_file, delimiter, dedupe=dedupe)
+        for block in blocks:
+            writer.write(block)
+        provspno, positions = writer.provspno, writer.positions
+        if dedupe:
+            print(f"Deduplicated {writer.rows_in} grouper rows to {writer.rows_written}")
+
+        if not reuse_output:
+            run_grouper_sharded(hrg_input_file, None, hrg_output_file, grouper_exe,
+                                jobs=jobs, delimiter=delimiter)
+        # Only worth caching the parsed output if it's going to be reused
+        reader = read_data if no_cache else read_data_cached
+        grouped_df = reader(grouper_processed_file, column_mappings, output_delimiter)
+
+    if dedupe:
+        return expand_deduped_rows(grouped_df, provspno, positions)
+    return grouped_df
+
+def get_fce_column_mappings() -> tuple[str, list[tuple]]:
+    '''
+    Get the delimiter and column definitions of the grouper FCE output file.
+    '''
+    definition_file = path.join(const.DATA_FILE_FOLDER, const.DEFAULT_RDF_FILE)
+    delimiter, column_mappings = parse_definition_file(definition_file)
+    return delimiter, fce_file_additional_cols(column_mappings)
+
+def load_probe_data(probe_class, include_unbundled: bool = False):
     '''
     Load a probe DataFrame for the given enum class.
+    If include_unbundled is set, returns the DataFrame and a long table of
+    every unbundled HRG (RowNo, Iteration, UnbundledHRGs), rather than
+    only the first one in the UnbundledHRGs column.
     '''
     base_output_file_path = get_probe_file_name(probe_class, GrouperFileType.OUTPUT)
     output_file_path = get_grouper_output_file_by_type(base_output_file_path, GrouperFileType.FCE)
-    definition_file = path.join(const.DATA_FILE_FOLDER, const.DEFAULT_RDF_FILE)
-    delimiter, column_mappings = parse_definition_file(definition_file)
-    column_mappings = fce_file_additional_cols(column_mappings)
-    return read_data(output_file_path, column_mappings, delimiter)
+    delimiter, column_mappings = get_fce_column_mappings()
+    if include_unbundled:
+        return read_grouper_output(output_file_path, column_mappings, delimiter)
+    return read_data_cached(output_file_path, column_mappings, delimiter)
 
 
-def compare_multiple_probes(df: pd.DataFrame) -> pd.DataFrame:
+def compare_multiple_probes(df: pd.DataFrame, narrow: bool = False) -> pd.DataFrame:
     '''
     Compare probe rows to their corresponding source rows and collect the results.
 
     Parameters:
     -----------
-    d_output : pd.DataFrame
+    df : pd.DataFrame
         The DataFrame containing the grouper output with source and probe rows.
+    narrow : bool
+        If True, return only the probe rows with the key, probe, value and
+        HRG columns rather than widening the full grouper output.
     Returns: pd.DataFrame
     --------
     '''
-    source_results = {}
-
-    # First pass: Collect source SpellHRG values
-    for _, row in df.iterrows():
-        provspno = row["PROVSPNO"]
-        if is_source_row(row):
-            source_results[provspno] = row["SpellHRG"]
-
-    # Create new columns initialized with NaN
-    df["BasePROVSPNO"] = pd.NA
-    df["Probe"] = pd.NA
-    df["ProbeValue"] = pd.NA
-    df["SourceSpellHRG"] = pd.NA
-    df["PermutedSpellHRG"] = pd.NA
-    df["Match"] = pd.NA
-
-    # Second pass: Update permuted rows with comparison data
-    for idx, row in df.iterrows():
-        if not is_source_row(row):
-            try:
-                # Parse probe row PROVSPNO
-                base_provspno, probe, probe_value = parse_child_spell(row["PROVSPNO"])
-                source_hrg = source_results.get(base_provspno)
-                permuted_hrg = row["SpellHRG"]
-                match = False if source_hrg is None else (permuted_hrg == source_hrg)
-
-                # Update the row with comparison data
-                df.at[idx, "BasePROVSPNO"] = base_provspno
-                df.at[idx, "Probe"] = probe
-                df.at[idx, "ProbeValue"] = probe_value
-                df.at[idx, "SourceSpellHRG"] = source_hrg
-                df.at[idx, "PermutedSpellHRG"] = permuted_hrg
-                df.at[idx, "Match"] = match
-            except ValueError:
-                # Skip rows with invalid PROVSPNO, leaving them with NaN values
-                continue
-
-    return df
-
-
-def compare_permuted_lines_to_source(df: pd.DataFrame):
+    provspno = df["PROVSPNO"]
+    source_mask = source_row_mask(provspno)
+
+    # Probe rows must split into exactly 3 parts, anything else is skipped
+    # and left with NA values
+    delimiter_count = provspno.str.count(re.escape(const.DEFAULT_DELIMITER))
+    probe_mask = ~source_mask & (delimiter_count == 2)
+
+    parts = provspno[probe_mask].str.split(const.DEFAULT_DELIMITER, n=2, expand=True,
+                                           regex=False)
+    if parts.empty:
+        parts = pd.DataFrame(index=provspno[probe_mask].index, columns=[0, 1, 2])
+
+    # Source SpellHRG values keyed by PROVSPNO (last one wins, as before)
+    source_results = (df.loc[source_mask & provspno.notna(), ["PROVSPNO", "SpellHRG"]]
+                      .drop_duplicates(subset="PROVSPNO", keep="last")
+                      .set_index("PROVSPNO")["SpellHRG"])
+
+    source_hrg = parts[0].map(source_results)
+    permuted_hrg = df.loc[probe_mask, "SpellHRG"]
+
+    results = pd.DataFrame({
+        "BasePROVSPNO": parts[0],
+        "Probe": parts[1],
+        "ProbeValue": parts[2],
+        "SourceSpellHRG": source_hrg,
+        "PermutedSpellHRG": permuted_hrg,
+        # A missing source or a NaN HRG on either side is never a match
+        "Match": permuted_hrg.eq(source_hrg),
+    }, index=parts.index)
+
+    if narrow:
+        results.insert(0, "PROVSPNO", provspno[probe_mask])
+        return results.reset_index(drop=True)
+
+    # The result columns are built as one frame and added in one go, as
+    # adding them one at a time to the wide grouper output fragments it
+    probe_positions = np.flatnonzero(probe_mask.to_numpy(dtype=bool))
+    wide_results = {}
+    for column in results.columns:
+        values = np.full(len(df), pd.NA, dtype=object)
+        values[probe_positions] = results[column].to_numpy(dtype=object)
+        wide_results[column] = values
+
+    df = df.drop(columns=results.columns, errors='ignore')
+    return pd.concat([df, pd.DataFrame(wide_results, index=df.index, dtype=object)], axis=1)
+
+
+def compare_permuted_lines_to_source(df: pd.DataFrame, max_print: int = 20) -> dict:
     '''
     Compare permuted lines to the source line in the DataFrame.
-    Gets a row from the DataFrame, determines if it's source or permuted,
-    and then compares it to the source row.
-    '''
-    source_results = {}
-    child_results = {}
-    for _, row in df.iterrows():
-        # For every row, create a new row with the permuted column value
-        if is_source_row(row):
-            source_results.update({row["PROVSPNO"]: row["SpellHRG"]})
-        else:
-            child_provspno, enum_class, enum_member = parse_child_spell(row["PROVSPNO"])
-            count = child_results.get((child_provspno, row["SpellHRG"]), 0) + 1
-            child_results.update({(child_provspno, row["SpellHRG"]): count})
-            child_results.update({(child_provspno, enum_class, enum_member): row["SpellHRG"]})
-
-    # Let's count the mismatches and display the details.
-    mismatch_count = 0
-
-    # Iterate over each key, value pair in child_results.
-    for key, child_hrg in child_results.items():
-        # We're interested only in keys with 3 pieces for now
-        if isinstance(key, tuple) and len(key) == 3:
-            child_provspno, enum_class, enum_member = key
-            source_hrg = source_results.get(child_provspno)
-
-            if source_hrg is None:
-                mismatch_count += 1
-                print(f"Mismatch for PROVSPNO {child_provspno} - {enum_class}.{enum_member}: "
-                      f"child HRG '{child_hrg}' <> source HRG 'None'")
-
-            elif child_hrg != source_hrg:
-                mismatch_count += 1
-                print(f"Mismatch for PROVSPNO {child_provspno} - {enum_class}.{enum_member}: "
-                      f"child HRG '{child_hrg}' <> source HRG '{source_hrg}'")
+    Each permuted row is matched to its source row by the base PROVSPNO and
+    the mismatches are summarised rather than printed one per line.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        The grouper output with source and permuted rows.
+    max_print : int
+        The maximum number of individual mismatches to print.
+
+    Returns:
+    --------
+    dict
+        'mismatches': one row per mismatched probe value
+        'by_probe': mismatch counts per probe
+        'by_value': mismatch counts per probe and probe value
+        'transitions': counts of source HRG -> permuted HRG changes
+        'total': the total number of mismatches
+    '''
+    results = compare_multiple_probes(df, narrow=True)
+
+    # A repeated probe value keeps the last result, as the dict did before
+    results = results.drop_duplicates(subset=["BasePROVSPNO", "Probe", "ProbeValue"],
+                                      keep="last")
+    mismatches = results[~results["Match"].astype(bool)].reset_index(drop=True)
+    mismatch_count = len(mismatches)
+
+    by_probe = (mismatches.groupby("Probe").size()
+                .sort_values(ascending=False).rename("Mismatches").reset_index())
+    by_value = (mismatches.groupby(["Probe", "ProbeValue"]).size()
+                .sort_values(ascending=False).rename("Mismatches").reset_index())
+    transitions = (mismatches.groupby(["SourceSpellHRG", "PermutedSpellHRG"], dropna=False)
+                   .size().sort_values(ascending=False).rename("Mismatches").reset_index())
+
+    for row in mismatches.head(max_print).itertuples(index=False):
+        source_hrg = None if pd.isna(row.SourceSpellHRG) else row.SourceSpellHRG
+        print(f"Mismatch for PROVSPNO {row.BasePROVSPNO} - {row.Probe}.{row.ProbeValue}: "
+              f"child HRG '{row.PermutedSpellHRG}' <> source HRG '{source_hrg}'")
+    if mismatch_count > max_print:
+        print(f"... {mismatch_count - max_print} more mismatches not shown")
+
+    if mismatch_count > 0:
+        print("\nMismatches by probe:")
+        for row in by_probe.itertuples(index=False):
+            print(f"  {row.Probe} => {row.Mismatches}")
 
     print(f"Total mismatches: {mismatch_count}")
 
+    return {
+        "mismatches": mismatches,
+        "by_probe": by_probe,
+        "by_value": by_value,
+        "transitions": transitions,
+        "total": mismatch_count,
+    }
+
 
 def parse_child_spell(provspno: str) -> tuple[str, str, str] :
     '''
@@ -345,6 +583,15 @@ def parse_child_spell(provspno: str) -> tuple[str, str, str] :
     return child_provspno, enum_class, enum_member
 
 
+def source_row_mask(provspno: pd.Series) -> pd.Series:
+    '''
+    Vectorized version of is_source_row for a PROVSPNO column.
+    '''
+    # NaN is treated as a source row
+    is_probe = provspno.str.contains(const.DEFAULT_DELIMITER, regex=False, na=False)
+    return ~is_probe.astype(bool)
+
+
 def is_source_row(row: pd.Series) -> bool:
     '''
     Determine if the given row is a source row.
@@ -37,6 +37,7 @@
 
 from Probe_classes.start_age import StartAge
 from . import probe_base as pb
+from . import boundary_search as bs
 
 
 def probe_start_age(no_cache: bool = False):
@@ -57,3 +58,13 @@ def probe_start_age(no_cache: bool = False):
         A new DataFrame containing both the original and the additional rows.
     '''
     pb.run_probe(StartAge, no_cache)
+
+
+def probe_start_age_adaptive(no_cache: bool = False):
+    '''
+    Find the exact ages at which each row's HRG changes, starting from a
+    coarse grid of ages and only bisecting where the HRG changed, rather
+    than grouping every age for every row.
+    See boundary_search.search_probe_boundaries for the output.
+    '''
+    return bs.run_boundary_search(StartAge, no_cache)
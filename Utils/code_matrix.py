@@ -0,0 +1,354 @@
+'''
+    This module provides an integer coded, sparse representation of the
+    DIAG_/OPER_ columns.
+
+    The wide layout (DIAG_01..DIAG_99) is mostly empty and holds each code
+    as a Python string. A CodeMatrix instead keeps each row's codes as int32
+    ids, in column order, in one flat array with an offset per row (the CSR
+    layout), and a CodeDictionary maps the ids back to codes. Dedupe, set
+    operations, counts and one-hot encoding then work on integer arrays.
+'''
+from os import path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from Utils.constants import (DATA_FILE_FOLDER, ALL_USED_DIAG_CODES_FILE, DIAGNOSIS_PREFIX,
+                             ONE_HOT_BLOCK_ROWS)
+
+
+class CodeDictionary:
+    '''
+    Maps codes to int32 ids and back. Ids are given out in the order codes
+    are first seen, starting with any seed codes; unseen codes are added as
+    they're encoded, so the ids of existing codes never change.
+    '''
+    def __init__(self, codes: Optional[list] = None):
+        self.codes = []
+        self._index = None
+        self._lookup = None
+        if codes is not None:
+            self.extend(codes)
+
+    @classmethod
+    def from_file(cls, codes_file: Optional[str] = None) -> 'CodeDictionary':
+        '''
+        Creates a dictionary seeded from a file with one code per line,
+        by default data/all_used_diag_codes.txt.
+        '''
+        if codes_file is None:
+            codes_file = path.join(DATA_FILE_FOLDER, ALL_USED_DIAG_CODES_FILE)
+        with open(codes_file, 'r', encoding='utf-8') as file:
+            codes = [line.strip() for line in file]
+        return cls([code for code in codes if code])
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, code) -> bool:
+        return self.index().get_indexer([code])[0] >= 0
+
+    def index(self) -> pd.Index:
+        '''
+        Returns the codes as an index, for looking up their ids.
+        '''
+        if self._index is None:
+            self._index = pd.Index(self.codes, dtype=object)
+        return self._index
+
+    def extend(self, codes) -> None:
+        '''
+        Adds any codes that aren't already in the dictionary.
+        '''
+        codes = pd.unique(np.asarray(codes, dtype=object))
+        new_codes = codes[self.index().get_indexer(codes) < 0]
+        if len(new_codes):
+            self.codes.extend(new_codes.tolist())
+            self._index = None
+            self._lookup = None
+
+    def encode(self, codes, extend: bool = True) -> np.ndarray:
+        '''
+        Returns the id of each code. If extend isn't set, codes that aren't
+        in the dictionary raise a ValueError.
+        '''
+        codes = np.asarray(codes, dtype=object)
+        ids = self.index().get_indexer(codes)
+        unseen = ids < 0
+        if unseen.any():
+            if not extend:
+                raise ValueError(f"Codes not in the dictionary: {pd.unique(codes[unseen])[:10]}")
+            self.extend(codes[unseen])
+            ids[unseen] = self.index().get_indexer(codes[unseen])
+        return ids.astype(np.int32)
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+        '''
+        Returns the code for each id.
+        '''
+        if self._lookup is None:
+            self._lookup = np.asarray(self.codes, dtype=object)
+        return self._lookup[ids]
+
+
+class CodeMatrix:
+    '''
+    The codes of each row as int32 ids, in CSR layout: the ids of row i are
+    ids[offsets[i]:offsets[i + 1]], in the order of the columns they came
+    from (so for DIAG the primary diagnosis is first).
+    '''
+    def __init__(self, offsets: np.ndarray, ids: np.ndarray, dictionary: CodeDictionary):
+        if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(ids):
+            raise ValueError("offsets must start at 0 and end at the number of ids")
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.dictionary = dictionary
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray, ids: np.ndarray, row_count: int,
+                  dictionary: CodeDictionary) -> 'CodeMatrix':
+        '''
+        Creates a matrix from the row number of each id, which must be in
+        row order.
+        '''
+        lengths = np.bincount(rows, minlength=row_count)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return cls(offsets, ids, dictionary)
+
+    @classmethod
+    def from_wide(cls, df: pd.DataFrame, prefix: str = DIAGNOSIS_PREFIX,
+                  dictionary: Optional[CodeDictionary] = None) -> 'CodeMatrix':
+        '''
+        Creates a matrix from the prefix's columns of a wide frame, in column
+        order. Missing and empty values are skipped.
+        '''
+        if dictionary is None:
+            dictionary = CodeDictionary.from_file()
+        columns = [column for column in df.columns if column.startswith(prefix)]
+
+        values = df[columns].to_numpy(dtype=object)
+        present = pd.notna(values)
+        present[present] = values[present] != ''
+        rows, positions = np.nonzero(present)
+        ids = dictionary.encode(values[rows, positions])
+
+        return cls.from_rows(rows, ids, len(df), dictionary)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def row_lengths(self) -> np.ndarray:
+        '''
+        Returns the number of codes in each row.
+        '''
+        return np.diff(self.offsets)
+
+    def row_numbers(self) -> np.ndarray:
+        '''
+        Returns the row each id belongs to.
+        '''
+        return np.repeat(np.arange(len(self)), self.row_lengths())
+
+    def row_codes(self, row: int) -> list:
+        '''
+        Returns the codes of a single row.
+        '''
+        return self.dictionary.decode(self.ids[self.offsets[row]:self.offsets[row + 1]]).tolist()
+
+    def to_wide(self, prefix: str = DIAGNOSIS_PREFIX, width: Optional[int] = None,
+                index: Optional[pd.Index] = None) -> pd.DataFrame:
+        '''
+        Returns the codes in the wide layout, prefix01..prefix<width>, with
+        NaN for unused columns. width defaults to the longest row; codes past
+        it are dropped, as the grouper has no columns for them.
+        '''
+        lengths = self.row_lengths()
+        if width is None:
+            width = int(lengths.max(initial=0))
+
+        rows = self.row_numbers()
+        positions = np.arange(len(self.ids)) - self.offsets[rows]
+        keep = positions < width
+
+        values = np.full((len(self), width), np.nan, dtype=object)
+        values[rows[keep], positions[keep]] = self.dictionary.decode(self.ids[keep])
+        columns = [f"{prefix}{number:02d}" for number in range(1, width + 1)]
+
+        return pd.DataFrame(values, columns=columns, index=index)
+
+    def take(self, rows: np.ndarray) -> 'CodeMatrix':
+        '''
+        Returns a matrix of the given rows, in the given order.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.row_lengths()[rows]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # The position of each output id in the source ids
+        sources = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return CodeMatrix(offsets, self.ids[sources], self.dictionary)
+
+    def dedupe(self) -> 'CodeMatrix':
+        '''
+        Returns a matrix with repeated codes removed from each row, keeping
+        the first of each.
+        '''
+        rows = self.row_numbers()
+        _, first = np.unique(self._keys(rows, self.ids), return_index=True)
+        first.sort()
+        return CodeMatrix.from_rows(rows[first], self.ids[first], len(self), self.dictionary)
+
+    def union(self, other: 'CodeMatrix') -> 'CodeMatrix':
+        '''
+        Returns each row's codes followed by the other matrix's codes for the
+        same row that it doesn't have, without repeats.
+        '''
+        self._check_compatible(other)
+        rows = np.concatenate((self.row_numbers(), other.row_numbers()))
+        order = np.argsort(rows, kind='stable')
+        ids = np.concatenate((self.ids, other.ids))[order]
+        return CodeMatrix.from_rows(rows[order], ids, len(self), self.dictionary).dedupe()
+
+    def intersection(self, other: 'CodeMatrix') -> 'CodeMatrix':
+        '''
+        Returns each row's codes that the other matrix's row also has.
+        '''
+        return self._filter(other, keep_shared=True)
+
+    def difference(self, other: 'CodeMatrix') -> 'CodeMatrix':
+        '''
+        Returns each row's codes that the other matrix's row doesn't have.
+        '''
+        return self._filter(other, keep_shared=False)
+
+    def contains_any(self, codes) -> np.ndarray:
+        '''
+        Returns a boolean per row, True if the row has any of the codes.
+        '''
+        known = [code for code in codes if code in self.dictionary]
+        hits = np.isin(self.ids, self.dictionary.encode(known, extend=False))
+        return np.bincount(self.row_numbers()[hits], minlength=len(self)) > 0
+
+    def code_counts(self) -> pd.Series:
+        '''
+        Returns the number of times each code appears, most common first.
+        '''
+        counts = np.bincount(self.ids, minlength=len(self.dictionary))
+        used = np.flatnonzero(counts)
+        return (pd.Series(counts[used], index=self.dictionary.decode(used))
+                .sort_values(ascending=False, kind='stable'))
+
+    def used_codes(self) -> np.ndarray:
+        '''
+        Returns the codes that appear, sorted by code.
+        '''
+        codes = self.dictionary.decode(np.unique(self.ids))
+        return codes[np.argsort(codes.astype(str), kind='stable')]
+
+    def one_hot(self, prefix: str = DIAGNOSIS_PREFIX, codes: Optional[list] = None,
+                sparse: bool = True, index: Optional[pd.Index] = None) -> pd.DataFrame:
+        '''
+        Returns a 0/1 column per code, named prefix + code, and a row per row.
+        The columns default to used_codes; codes not in the list are left out.
+
+        The columns are SparseArrays that only store the ones, so the frame
+        takes memory in proportion to the number of codes, not rows x codes.
+        If sparse isn't set they're dense uint8 columns instead, for writing
+        out a block of rows.
+        '''
+        if codes is None:
+            codes = self.used_codes()
+        code_ids = self.dictionary.encode(codes)
+        column_of = np.full(len(self.dictionary), -1, dtype=np.int64)
+        column_of[code_ids] = np.arange(len(codes))
+
+        columns = column_of[self.ids]
+        keep = columns >= 0
+        rows, columns = self.row_numbers()[keep], columns[keep]
+        names = [f"{prefix}{code}" for code in codes]
+
+        if not sparse:
+            values = np.zeros((len(self), len(codes)), dtype=np.uint8)
+            values[rows, columns] = 1
+            return pd.DataFrame(values, columns=names, index=index)
+
+        # Each column's rows, in column order
+        order = np.argsort(columns, kind='stable')
+        rows = rows[order]
+        ends = np.cumsum(np.bincount(columns, minlength=len(codes)))
+
+        column_values = np.zeros(len(self), dtype=np.uint8)
+        sparse_columns = {}
+        start = 0
+        for name, end in zip(names, ends):
+            column_values[rows[start:end]] = 1
+            sparse_columns[name] = pd.arrays.SparseArray(column_values, fill_value=0)
+            column_values[rows[start:end]] = 0
+            start = end
+
+        return pd.DataFrame(sparse_columns, columns=names, index=index)
+
+    def _keys(self, rows: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        '''
+        Returns a single integer per (row, id) pair.
+        '''
+        return rows.astype(np.int64) * (len(self.dictionary) + 1) + ids
+
+    def _filter(self, other: 'CodeMatrix', keep_shared: bool) -> 'CodeMatrix':
+        '''
+        Keeps (or drops) each row's codes that the other row shares.
+        '''
+        self._check_compatible(other)
+        rows = self.row_numbers()
+        shared = np.isin(self._keys(rows, self.ids), self._keys(other.row_numbers(), other.ids))
+        keep = shared if keep_shared else ~shared
+        return CodeMatrix.from_rows(rows[keep], self.ids[keep], len(self), self.dictionary)
+
+    def _check_compatible(self, other: 'CodeMatrix') -> None:
+        '''
+        Set operations need the same rows and the same code ids.
+        '''
+        if len(self) != len(other):
+            raise ValueError("Matrices must have the same number of rows")
+        if self.dictionary is not other.dictionary:
+            raise ValueError("Matrices must share a CodeDictionary")
+
+
+def one_hot_encode_diags(input_file: str, output_file: Optional[str] = None,
+                         delimiter: str = ',', block_rows: int = ONE_HOT_BLOCK_ROWS) -> str:
+    '''
+    Writes the input file with a 0/1 DIAG_<code> column added for every
+    diagnosis code that appears in it, the same output as
+    C_Utils/one_hot_encode_diags.c. By default the output is written next
+    to the input, with _v2 added to its name.
+
+    Like the C tool it makes two passes: the first finds the codes, reading
+    only the DIAG columns, and the second writes the rows out block_rows at
+    a time, so memory doesn't grow with the size of the file.
+    return: the output file name.
+    '''
+    if output_file is None:
+        base_name, extension = path.splitext(input_file)
+        output_file = f"{base_name}_v2{extension}"
+
+    dictionary = CodeDictionary.from_file()
+    used_ids = np.array([], dtype=np.int32)
+    row_count = 0
+    for chunk in pd.read_csv(input_file, delimiter=delimiter, dtype=str, keep_default_na=False,
+                             usecols=lambda column: column.startswith(DIAGNOSIS_PREFIX),
+                             chunksize=block_rows):
+        matrix = CodeMatrix.from_wide(chunk, DIAGNOSIS_PREFIX, dictionary)
+        used_ids = np.union1d(used_ids, matrix.ids)
+        row_count += len(chunk)
+    codes = CodeMatrix(np.array([0, len(used_ids)]), used_ids, dictionary).used_codes()
+    print(f"Found {len(codes)} unique DIAG codes. Processing {row_count} rows.")
+
+    chunks = pd.read_csv(input_file, delimiter=delimiter, dtype=str, keep_default_na=False,
+                         chunksize=block_rows)
+    with open(output_file, 'w', encoding='utf-8', newline='') as file:
+        for number, chunk in enumerate(chunks):
+            matrix = CodeMatrix.from_wide(chunk, DIAGNOSIS_PREFIX, dictionary)
+            encoded_df = pd.concat([chunk, matrix.one_hot(DIAGNOSIS_PREFIX, codes, sparse=False,
+                                                          index=chunk.index)], axis=1)
+            encoded_df.to_csv(file, sep=delimiter, index=False, header=number == 0)
+    print(f"Done. Output written to {output_file}")
+
+    return output_file
@@ -1,8 +1,10 @@
 '''
-    This module contains a function that runs a Windows command line
-    program and waits for its completion.
+    This module contains functions that run a Windows command line
+    program, either waiting for its completion or as an asyncio coroutine.
 '''
+import asyncio
 import subprocess
+from typing import Optional
 
 def run_command_and_wait(command: list[str], silent=False) -> bool:
     '''
@@ -29,3 +31,56 @@ def run_command_and_wait(command: list[str], silent=False) -> bool:
             print(f"Standard Error: {completed_process.stderr}")
 
     return completed_process.returncode == 0
+
+async def run_command_async(command: list[str],
+                            log_file: Optional[str] = None,
+                            timeout: Optional[float] = None) -> bool:
+    '''
+    Runs a Windows command line program as a coroutine, so several can run
+    at once. stdout and stderr are streamed to log_file as the program
+    writes them (or discarded if log_file is None) rather than held in memory.
+
+    If the program runs for longer than timeout seconds, or the coroutine
+    is cancelled, the program is killed.
+
+    :param command: A list containing the command and its arguments.
+    :param log_file: The file to write the program's stdout and stderr to.
+    :param timeout: The number of seconds to wait for the program, None to wait forever.
+    :return: true if command completed successfully, else false.
+    :raises TimeoutError: If the program was killed because it ran past the timeout.
+    '''
+    log = open(log_file, 'wb') if log_file is not None else None
+    try:
+        output = log if log is not None else subprocess.DEVNULL
+        process = await asyncio.create_subprocess_exec(*command, stdout=output,
+                                                       stderr=subprocess.STDOUT)
+        try:
+            return_code = await asyncio.wait_for(process.wait(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            await kill_process(process)
+            if isinstance(error, asyncio.TimeoutError):
+                raise TimeoutError(f"Command timed out after {timeout}s: {' '.join(command)}") \
+                    from error
+            raise
+    finally:
+        if log is not None:
+            log.close()
+
+    return return_code == 0
+
+async def kill_process(process: asyncio.subprocess.Process) -> None:
+    '''
+    Kills a process started by run_command_async, if it's still running,
+    and waits for it to exit.
+    '''
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    try:
+        await process.wait()
+    except asyncio.CancelledError:
+        # Cancelled while waiting on the killed process, finish reaping it first
+        await process.wait()
+        raise
@@ -11,6 +11,14 @@ DIAGNOSIS_PREFIX = "DIAG_"
 PROCEDURE_PREFIX = "OPER_"
 MAX_EPISODE_DURATION = 99999
 MAX_START_AGE = 999
+# CodeDrop combinations are 2^n rows per spell, so these keep it bounded
+CODE_DROP_MAX_COMBO_DIAGS = 20
+CODE_DROP_ROW_BUDGET = 20000000
+CODE_DROP_BLOCK_ROWS = 100000
+# Rows per block when streaming probe rows into the grouper input file
+PROBE_BLOCK_ROWS = 100000
+# Rows per block when writing the one-hot DIAG export, each block is rows x codes bytes
+ONE_HOT_BLOCK_ROWS = 10000
 
 # File structure related
 DATA_FILE_FOLDER="./data"
@@ -19,6 +27,7 @@ CACHE_FILE_FOLDER=f"{DATA_FILE_FOLDER}/cache"
 HRG_INPUT_FILE_FOLDER=f"{DATA_FILE_FOLDER}/hrg_input"
 HRG_OUTPUT_FILE_FOLDER=f"{DATA_FILE_FOLDER}/hrg_output"
 PROCESSED_FILE_FOLDER=f"{DATA_FILE_FOLDER}/processed"
+BENCHMARK_FILE_FOLDER=f"{DATA_FILE_FOLDER}/benchmarks"
 
 # File name related
 DEFAULT_FILE_EXTENSION = ".csv"
@@ -27,6 +36,10 @@ SAMPLE_DATA_FILE = f"APC_Sample_Test_Data{DEFAULT_FILE_EXTENSION}"
 DEFAULT_RDF_FILE="Max_OPCS_and_ICD10.rdf"
 BASE_RDF_FILE="HRG4+_default_APC.rdf"
 TARIFF_KV_STORE_FILE_NO_TAG = "kv_tariff_"
+GROUPER_RESULT_CACHE_FILE = "grouper_result_cache.parquet"
+SCHEMA_FILE = "Schema.csv"
+ALL_USED_DIAG_CODES_FILE = "all_used_diag_codes.txt"
+BENCHMARK_HISTORY_FILE = "benchmark_history.json"
 
 # File processing related
 FCE_HRG_FILE_SUFFIX = "FCE"
@@ -42,3 +55,4 @@ UB_HRG_FILE_SUFFIX = "ub_rel"
 TARIFF_APC_SHEET_NAME_NO_TAG = "r APC Spell Tariff"
 VERSION_PREFIX = "_v"
 HRG_COLUMN_NAME = "SpellHRG"
+GROUPER_RESULT_CACHE_MAX_ENTRIES = 500000
@@ -0,0 +1,197 @@
+'''
+    This module provides an opt-in typed load: converting the all-string
+    frames read_data and import_zl_data produce to compact dtypes, using
+    the types in data/Schema.csv.
+
+    Where pandas' str dtype is already Arrow backed, string code columns
+    save little; categorical code columns are where most of the saving is.
+
+    Code and other string columns become Arrow backed strings (or, for the
+    code columns, categoricals) and integer columns the nullable integer
+    type given by the schema's specifier. Most DIAG/OPER fields are empty,
+    which Arrow stores as a null bit rather than a Python NaN object each.
+'''
+import importlib.util
+from os import path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from Utils.constants import (DATA_FILE_FOLDER, SCHEMA_FILE,
+                             DIAGNOSIS_PREFIX, PROCEDURE_PREFIX)
+
+# Without pyarrow the strings are still pandas strings, just Python backed
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') else 'string'
+CODE_DTYPES = ['string', 'category']
+
+# Schema specifiers for integer columns; a bare width is a signed integer
+INTEGER_DTYPES = {'8': 'Int8', '16': 'Int16', '32': 'Int32', '64': 'Int64',
+                  'UInt8': 'UInt8', 'UInt16': 'UInt16', 'UInt32': 'UInt32', 'UInt64': 'UInt64'}
+
+
+def load_schema(schema_file: Optional[str] = None, code_dtype: str = 'string') -> dict:
+    '''
+    Reads the schema file and returns the pandas dtype for each column.
+
+    Parameters:
+    -----------
+    schema_file : The schema csv (Column Name, Type, Specifier), defaults to
+        data/Schema.csv.
+    code_dtype : 'string' or 'category', the dtype for DIAG/OPER columns.
+
+    Returns:
+    --------
+    dict
+        Column name to dtype, e.g. {'EPIORDER': 'UInt8', 'DIAG_01': 'string[pyarrow]'}
+    '''
+    if code_dtype not in CODE_DTYPES:
+        raise ValueError(f"code_dtype must be one of {CODE_DTYPES}")
+    if schema_file is None:
+        schema_file = path.join(DATA_FILE_FOLDER, SCHEMA_FILE)
+
+    schema_df = pd.read_csv(schema_file, dtype=str, keep_default_na=False)
+
+    schema = {}
+    for column, type_name, specifier in schema_df.itertuples(index=False, name=None):
+        if type_name == 'Integer':
+            if specifier not in INTEGER_DTYPES:
+                raise ValueError(f"Unknown integer specifier '{specifier}' for {column}")
+            schema[column] = INTEGER_DTYPES[specifier]
+        elif type_name == 'Bool':
+            schema[column] = 'boolean'
+        elif is_code_column(column) and code_dtype == 'category':
+            schema[column] = 'category'
+        else:
+            schema[column] = STRING_DTYPE
+
+    return schema
+
+
+def is_code_column(column: str) -> bool:
+    '''
+    Returns True for DIAG_ and OPER_ columns.
+    '''
+    return column.startswith(DIAGNOSIS_PREFIX) or column.startswith(PROCEDURE_PREFIX)
+
+
+def apply_schema(df: pd.DataFrame, schema: Optional[dict] = None,
+                 code_dtype: str = 'string', report: bool = True) -> pd.DataFrame:
+    '''
+    Converts the columns of df to the schema's dtypes. Code columns that
+    aren't in the schema (e.g. after ColumnExtender) are treated like the
+    ones that are, other columns the schema doesn't know are left as is.
+    If report is set, prints the memory used before and after.
+    '''
+    if schema is None:
+        schema = load_schema(code_dtype=code_dtype)
+    memory_before = frame_memory(df) if report else 0
+
+    code_type = 'category' if code_dtype == 'category' else STRING_DTYPE
+    converted = {}
+    for column in df.columns:
+        dtype = schema.get(column, code_type if is_code_column(column) else None)
+        if dtype is not None:
+            converted[column] = convert_column(df[column], dtype)
+
+    df = df.assign(**converted) if converted else df
+
+    if report:
+        print_memory_report(memory_before, frame_memory(df))
+
+    return df
+
+
+def convert_column(series: pd.Series, dtype: str) -> pd.Series:
+    '''
+    Converts a column to the given dtype. Values that aren't valid for an
+    integer or boolean type become missing, and integer values too big
+    for the schema's width move to a wider type rather than overflow.
+    '''
+    # Dtypes can be given by name or as a dtype (e.g. from df.dtypes)
+    name = getattr(dtype, 'name', dtype)
+    # Each column has its own categories, so only the kind is kept
+    if name == 'category':
+        dtype = 'category'
+    if series.dtype == dtype:
+        return series
+
+    if name in INTEGER_DTYPES.values():
+        numbers = pd.to_numeric(series, errors='coerce')
+        if not numbers.dropna().mod(1).eq(0).all():
+            return numbers
+        return numbers.astype(fit_integer_dtype(numbers, name))
+
+    if name == 'boolean':
+        flags = series.astype(str).str.strip().str.lower().map({'true': True, 'false': False})
+        return flags.astype('boolean')
+
+    return series.astype(dtype)
+
+
+def fit_integer_dtype(numbers: pd.Series, dtype: str) -> str:
+    '''
+    Returns dtype, or the narrowest wider integer type of the same sign
+    that holds every value.
+    '''
+    if numbers.isna().all():
+        return dtype
+
+    low, high = numbers.min(), numbers.max()
+    widths = ['8', '16', '32', '64']
+    unsigned = dtype.startswith('UInt')
+    prefix = 'UInt' if unsigned and low >= 0 else 'Int'
+    start = widths.index(dtype[len('UInt'):] if unsigned else dtype[len('Int'):])
+    for width in widths[start:]:
+        info = np.iinfo(f"{prefix.lower()}{width}")
+        if info.min <= low and high <= info.max:
+            return f"{prefix}{width}"
+
+    return 'Float64'
+
+
+def restore_dtypes(df: pd.DataFrame, dtypes: pd.Series) -> pd.DataFrame:
+    '''
+    Converts the columns of a frame rebuilt from Python values (e.g. from
+    row dicts) back to the compact dtypes they had. Only the extension
+    dtypes apply_schema uses are restored, so an untyped frame is left as
+    it is.
+    '''
+    converted = {column: convert_column(df[column], dtype)
+                 for column, dtype in dtypes.items()
+                 if column in df.columns
+                 and isinstance(dtype, pd.api.extensions.ExtensionDtype)
+                 and df[column].dtype != dtype}
+    return df.assign(**converted) if converted else df
+
+
+def transform_strings(series: pd.Series, transform) -> pd.Series:
+    '''
+    Applies a vectorised string transform (a function taking and returning
+    a Series) to a column of any string dtype, keeping the dtype.
+    For categoricals only the categories are transformed, so each distinct
+    code is done once rather than once per row.
+    '''
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return transform(series)
+
+    categories = transform(pd.Series(series.cat.categories, dtype=object)).to_numpy(dtype=object)
+    # Missing values have code -1, which picks the NaN on the end
+    lookup = np.append(categories, np.nan)
+    values = lookup[series.cat.codes.to_numpy()]
+    return pd.Series(values, index=series.index, name=series.name).astype('category')
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    '''
+    Returns the memory used by df in bytes, counting the Python strings
+    held by object columns.
+    '''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def print_memory_report(memory_before: int, memory_after: int) -> None:
+    '''
+    Prints the memory used before and after a typed conversion.
+    '''
+    saving = 1 - memory_after / memory_before if memory_before else 0.0
+    print(f"Typed load: {memory_before / 2**20:.1f} MB -> {memory_after / 2**20:.1f} MB "
+          f"({saving:.0%} less)")
@@ -0,0 +1,113 @@
+'''
+    This module provides a Parquet cache for parsed data files, so repeat
+    reads of the same CSV (the probe base file, grouper outputs, ...) load
+    the parsed frame rather than parsing the CSV again.
+
+    The cache is stored next to the source file, with a small JSON file
+    recording the source's size and modification time and the columns it
+    was read with. If any of those change the source is read again.
+    pyarrow is optional, without it the source is always read.
+'''
+import hashlib
+import importlib.util
+import pathlib as p
+from os import path, replace, stat
+import numpy as np
+import pandas as pd
+from Utils.grouper_data_import import read_data
+from Utils.kv_store import save_kv_store, load_kv_store
+
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+FRAME_CACHE_EXTENSION = ".parquet"
+FRAME_CACHE_INFO_EXTENSION = ".parquet.json"
+
+
+def read_data_cached(data_file: p.Path, column_definitions: list,
+                     delimiter: str = ',') -> pd.DataFrame:
+    '''
+    The same as read_data, but loads the frame from the Parquet cache if
+    it's up to date, and writes the cache if it isn't.
+    '''
+    if not PARQUET_AVAILABLE:
+        return read_data(data_file, column_definitions, delimiter)
+
+    cache_file, info_file = get_frame_cache_files(data_file)
+    source_info = get_source_info(data_file, column_definitions, delimiter)
+
+    if path.exists(cache_file) and path.exists(info_file):
+        if load_kv_store(info_file) == source_info:
+            return load_frame_cache(cache_file)
+
+    df = read_data(data_file, column_definitions, delimiter)
+    write_frame_cache(df, cache_file, info_file, source_info)
+    return df
+
+
+def get_frame_cache_files(data_file: p.Path) -> tuple[str, str]:
+    '''
+    Returns the cache and cache info file names for a data file.
+    '''
+    base_name, _ = path.splitext(str(data_file))
+    return f"{base_name}{FRAME_CACHE_EXTENSION}", f"{base_name}{FRAME_CACHE_INFO_EXTENSION}"
+
+
+def get_source_info(data_file: p.Path, column_definitions: list, delimiter: str) -> dict:
+    '''
+    Returns what a cached frame depends on: the source file's size and
+    modification time and the columns and delimiter it was read with.
+    '''
+    file_stat = stat(data_file)
+    display_names = [column[0] for column in column_definitions]
+    columns_key = hashlib.sha1(repr((display_names, delimiter)).encode('utf-8')).hexdigest()
+
+    return {'size': file_stat.st_size,
+            'mtime_ns': file_stat.st_mtime_ns,
+            'columns': columns_key,
+            }
+
+
+def write_frame_cache(df: pd.DataFrame, cache_file: str, info_file: str,
+                      source_info: dict) -> None:
+    '''
+    Writes the frame and its info file. The frame is written to a temporary
+    file first, so a failed write never leaves a partial cache behind.
+    '''
+    temp_file = f"{cache_file}.tmp"
+    df.to_parquet(temp_file, index=False)
+    replace(temp_file, cache_file)
+    save_kv_store(source_info, info_file)
+
+
+def load_frame_cache(cache_file: str) -> pd.DataFrame:
+    '''
+    Loads a cached frame.
+    Parquet gives back missing strings as None where read_data has NaN.
+    They differ for e.g. astype(str), so the NaNs are put back, using
+    Arrow's null masks as checking each value is slow.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(cache_file)
+    df = table.to_pandas()
+
+    object_columns = [name for name in df.columns if df[name].dtype == object]
+    if not object_columns:
+        return df
+
+    # Built as one block so pandas doesn't infer a dtype for every column
+    values = np.full((len(df), len(object_columns)), np.nan, dtype=object)
+    for number, name in enumerate(object_columns):
+        column = table.column(name)
+        if pa.types.is_null(column.type):
+            continue
+        column_values = df[name].to_numpy(dtype=object)
+        present = ~column.is_null().to_numpy(zero_copy_only=False)
+        values[present, number] = column_values[present]
+
+    restored_df = pd.DataFrame(values, columns=object_columns, index=df.index, dtype=object)
+    if len(object_columns) == len(df.columns):
+        return restored_df
+    other_columns = [name for name in df.columns if name not in set(object_columns)]
+    return pd.concat([restored_df, df[other_columns]], axis=1)[list(df.columns)]
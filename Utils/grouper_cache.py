@@ -0,0 +1,280 @@
+'''
+    This module provides a persistent cache of grouper results keyed by a
+    fingerprint of the grouping relevant input columns, so rows that have
+    already been grouped don't need to be sent to the grouper again.
+'''
+import importlib.util
+from os import path, getenv, replace
+from typing import Optional
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from Probe_classes.grouper_file_type import GrouperFileType
+from Utils.grouper_data_import import read_data, get_grouper_output_file_by_type, STR_DTYPE
+from Utils.grouper_df_utils import write_output
+from Utils.sharded_grouper import run_grouper_sharded
+import Utils.constants as const
+
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# Columns that don't change the grouping of a (single episode) row
+FINGERPRINT_EXCLUDED_COLUMNS = ['PROVSPNO']
+
+# The result cache file's key and recency columns and the metadata key of its tag
+KEY_COLUMN = 'Key'
+LAST_USED_COLUMN = 'LastUsed'
+CACHE_TAG_METADATA_KEY = b'grouper_result_cache_tag'
+
+
+def row_fingerprints(df: pd.DataFrame) -> pd.Series:
+    '''
+    Returns a 64 bit fingerprint per row of the grouping relevant columns.
+    The values are hashed as the strings the grouper would be given (see
+    fingerprint_values), so equal inputs get the same fingerprint whatever
+    the dtypes, e.g. a probe row's int64 3 and a base row's '3' or 3.0.
+    '''
+    columns = [column for column in df.columns if column not in FINGERPRINT_EXCLUDED_COLUMNS]
+    values = pd.DataFrame({column: fingerprint_values(df[column]) for column in columns},
+                          index=df.index)
+    return pd.util.hash_pandas_object(values, index=False)
+
+
+def fingerprint_values(column: pd.Series) -> pd.Series:
+    '''
+    Returns the column's values as strings written the same way for every
+    dtype, with whole numbers written without a decimal point. Missing
+    values are left missing, they all hash the same and unlike any string.
+    str columns are returned as they are, they hash the same as object
+    columns of the same strings.
+    '''
+    if isinstance(column.dtype, pd.StringDtype):
+        return column
+
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        numbers = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        whole = np.isfinite(numbers) & (numbers % 1 == 0)
+        strings = np.where(whole, np.where(whole, numbers, 0).astype(np.int64).astype(str),
+                           numbers.astype(str)).astype(object)
+        strings[np.isnan(numbers)] = np.nan
+        return pd.Series(strings, index=column.index, dtype=object)
+
+    return column.astype(object).where(column.isna(), column.astype(str))
+
+
+def get_result_cache_tag(grouper_exe: Optional[str] = None,
+                         definitions_file: Optional[str] = None) -> str:
+    '''
+    Returns the tag that ties cached results to a grouper and definitions file.
+    '''
+    if grouper_exe is None:
+        load_dotenv()
+        grouper_exe = getenv('GROUPER_EXE')
+    if definitions_file is None:
+        definitions_file = const.DEFAULT_RDF_FILE
+
+    return f"{grouper_exe}|{path.basename(definitions_file)}"
+
+
+class GrouperResultCache:
+    '''
+    A size bounded, least recently used cache mapping row fingerprints to the
+    FCE and spell fields the grouper produced for that row.
+
+    The entries are a frame indexed by fingerprint, with the output columns
+    and a LastUsed column recording when each entry was last stored or
+    looked up, so lookups are index joins rather than a key at a time.
+    They're stored as a columnar Parquet file; pyarrow is optional, without
+    it the cache only lasts for the session.
+
+    The cache is tied to a tag (the grouper executable and definitions file);
+    if the tag changes the stored results are discarded.
+
+    Note: rows are fingerprinted on their own, so this is only valid for
+    single episode spells, which is what the probes send to the grouper.
+    '''
+    def __init__(self,
+                 cache_file: str = path.join(const.CACHE_FILE_FOLDER,
+                                             const.GROUPER_RESULT_CACHE_FILE),
+                 max_entries: int = const.GROUPER_RESULT_CACHE_MAX_ENTRIES,
+                 tag: str = ''):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.tag = tag
+        self.hits = 0
+        self.misses = 0
+        self.reset([])
+
+        if PARQUET_AVAILABLE and path.exists(cache_file):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def columns(self) -> list[str]:
+        '''
+        The output columns the cache stores.
+        '''
+        return [column for column in self.entries.columns if column != LAST_USED_COLUMN]
+
+    def reset(self, columns: list[str]) -> None:
+        '''
+        Empties the cache and sets the output columns it stores.
+        '''
+        self.entries = pd.DataFrame({column: pd.Series(dtype=STR_DTYPE) for column in columns},
+                                    index=pd.Index([], dtype=np.uint64, name=KEY_COLUMN))
+        self.entries[LAST_USED_COLUMN] = pd.Series(dtype=np.int64)
+        self.clock = 0
+
+    def contains(self, keys: pd.Series) -> np.ndarray:
+        '''
+        Returns a boolean mask of the keys that are in the cache.
+        '''
+        return keys.isin(self.entries.index).to_numpy()
+
+    def lookup(self, keys: pd.Series) -> pd.DataFrame:
+        '''
+        Returns the cached output columns for the given keys (which must all
+        be present) and marks them as recently used.
+        '''
+        self._touch(keys)
+        self.hits += len(keys)
+
+        return self.entries.loc[keys.to_numpy(), self.columns].set_index(keys.index)
+
+    def update(self, keys: pd.Series, output_df: pd.DataFrame) -> None:
+        '''
+        Adds the output columns for newly grouped rows, evicting the least
+        recently used entries if the cache is full.
+        '''
+        new_entries = (output_df[self.columns].astype(STR_DTYPE)
+                       .set_index(pd.Index(keys.to_numpy(), dtype=np.uint64, name=KEY_COLUMN)))
+        new_entries = new_entries[~new_entries.index.duplicated(keep='last')]
+        new_entries[LAST_USED_COLUMN] = np.int64(0)
+
+        self.entries = pd.concat([self.entries.drop(index=new_entries.index, errors='ignore'),
+                                  new_entries])
+        self._touch(keys)
+        self.misses += len(keys)
+
+        if len(self.entries) > self.max_entries:
+            self.entries = self.entries.sort_values(LAST_USED_COLUMN, kind='stable',
+                                                    ascending=False).iloc[:self.max_entries]
+
+    def _touch(self, keys: pd.Series) -> None:
+        '''
+        Marks the keys as used now, in order, the last use of a repeated key
+        counting.
+        '''
+        used = pd.Index(keys.to_numpy(), dtype=np.uint64).drop_duplicates(keep='last')
+        self.entries.loc[used, LAST_USED_COLUMN] = self.clock + np.arange(len(used))
+        self.clock += len(used)
+
+    def _load(self) -> None:
+        '''
+        Loads the entries from the Parquet file if it was saved with the same tag.
+        '''
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(self.cache_file)
+        metadata = table.schema.metadata or {}
+        if metadata.get(CACHE_TAG_METADATA_KEY, b'').decode('utf-8') != self.tag:
+            return
+
+        entries = table.to_pandas().set_index(KEY_COLUMN)
+        columns = [column for column in entries.columns if column != LAST_USED_COLUMN]
+        self.entries = entries.astype({column: STR_DTYPE for column in columns})
+        self.clock = int(self.entries[LAST_USED_COLUMN].to_numpy().max(initial=-1)) + 1
+
+    def save(self) -> None:
+        '''
+        Writes the cache out to its Parquet file. It's written to a temporary
+        file first, so a failed write never leaves a partial cache behind.
+        '''
+        if not PARQUET_AVAILABLE:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(self.entries.reset_index(), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               CACHE_TAG_METADATA_KEY: self.tag.encode('utf-8')})
+        temp_file = f"{self.cache_file}.tmp"
+        pq.write_table(table, temp_file)
+        replace(temp_file, self.cache_file)
+
+    def stats(self) -> dict:
+        '''
+        Returns the hit and miss counters and the current size of the cache.
+        '''
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self.entries),
+                }
+
+
+def run_grouper_cached(df: pd.DataFrame,
+                       delimiter: str,
+                       input_file: str,
+                       output_file: str,
+                       column_mappings: list,
+                       output_delimiter: str,
+                       cache: GrouperResultCache,
+                       definitions_file: Optional[str] = None,
+                       grouper_exe: Optional[str] = None,
+                       jobs: int = 1,
+                       ) -> pd.DataFrame:
+    '''
+    Groups the rows of df, only sending rows the cache hasn't seen before to
+    the grouper. The cached results are fanned back out to their rows and
+    the combined FCE output is written to the FCE file, in the same row
+    order as df, so it can be read back like a normal grouper run.
+
+    Note: the cache keeps a single UnbundledHRGs value per row.
+    '''
+    fce_file = get_grouper_output_file_by_type(output_file, GrouperFileType.FCE)
+    display_names = [column[0] for column in column_mappings]
+    input_columns = list(df.columns)
+    output_columns = [column for column in display_names
+                      if column not in input_columns and column != 'RowNo']
+
+    # Results stored for a different output layout can't be reused
+    if cache.columns != output_columns:
+        cache.reset(output_columns)
+
+    df = df.reset_index(drop=True)
+    keys = row_fingerprints(df)
+    hit_mask = cache.contains(keys)
+
+    output_parts = []
+    if hit_mask.any():
+        output_parts.append(cache.lookup(keys[hit_mask]))
+
+    if not hit_mask.all():
+        miss_df = df[~hit_mask]
+        write_output(miss_df, input_file, delimiter)
+        run_grouper_sharded(input_file, definitions_file, output_file, grouper_exe,
+                            jobs=jobs, delimiter=delimiter)
+        miss_output = read_data(fce_file, column_mappings, output_delimiter)
+
+        # RowNo is the position of the row in the file we sent
+        miss_positions = miss_df.index[pd.to_numeric(miss_output['RowNo']).to_numpy() - 1]
+        miss_output = miss_output[output_columns].set_index(miss_positions)
+
+        cache.update(keys[miss_positions], miss_output)
+        output_parts.append(miss_output)
+
+    grouped_df = pd.concat([df, pd.concat(output_parts).reindex(df.index)], axis=1)
+    grouped_df['RowNo'] = (grouped_df.index + 1).astype(str)
+    grouped_df = grouped_df.reindex(columns=display_names)
+
+    write_output(grouped_df, fce_file, output_delimiter)
+    cache.save()
+
+    stats = cache.stats()
+    print(f"Grouper result cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['entries']} entries)")
+
+    return grouped_df
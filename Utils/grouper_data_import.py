@@ -2,29 +2,92 @@
     This module provides functions for reading and processing the
     grouper's input and output data files.
 '''
+import csv
+import importlib.util
 from os import path
+from typing import Optional
 import pathlib as p
+import numpy as np
 import pandas as pd
 from Probe_classes.grouper_file_type import GrouperFileType
 from Utils.constants import DEFAULT_FILE_EXTENSION, DEFAULT_RDF_FILE
 from Utils.file_utils import file_extension_replace
 from Utils.grouper_file_columns import parse_definition_file
+from Utils.data_types import apply_schema
+
+# The grouper reads and writes Windows-1252
+GROUPER_FILE_ENCODING = 'cp1252'
+UNBUNDLED_HRG_COLUMN = 'UnbundledHRGs'
+# pandas' str dtype is Arrow backed when pyarrow is installed, so its CSV
+# reader can build the columns directly
+STR_DTYPE = pd.Series(dtype=str).dtype
+ARROW_CSV_AVAILABLE = (importlib.util.find_spec('pyarrow') is not None
+                       and getattr(STR_DTYPE, 'storage', None) == 'pyarrow')
+# The fields read_csv reads as NaN by default
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+                 '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+                 'n/a', 'nan', 'null']
+
+
+def read_data(data_file: p.Path, column_definitions: list, delimiter: str = ',',
+              typed: bool = False, code_dtype: str = 'string') -> pd.DataFrame:
+    '''
+    Reads the data file and creates a df using the columns specified.
+    If typed is set the columns are converted to the compact dtypes in
+    data/Schema.csv (see Utils.data_types), with code_dtype ('string' or
+    'category') for the DIAG/OPER columns.
+
+    Note: columns in the file that are not in column_definitions will be dropped,
+    as will any extra fields of a ragged UnbundledHRGs tail (see
+    read_grouper_output to keep them).
+    '''
+    df, _ = read_grouper_output(data_file, column_definitions, delimiter,
+                                include_unbundled=False, typed=typed,
+                                code_dtype=code_dtype)
+    return df
 
 
-def read_data(data_file: p.Path, column_definitions: list, delimiter: str = ',') -> pd.DataFrame:
+def read_grouper_output(data_file: p.Path, column_definitions: list, delimiter: str = ',',
+                        include_unbundled: bool = True, typed: bool = False,
+                        code_dtype: str = 'string'
+                        ) -> tuple[pd.DataFrame, Optional[pd.DataFrame]]:
     '''
-    Reads the data file and creates a df using the columns specified.
+    Reads a grouper output (or any other delimited) file with pyarrow, or
+    the C parser without it (see read_fields_arrow and read_fields_c).
+
+    The grouper writes every unbundled HRG after the first into its own
+    unnamed field, so rows are ragged. Reading the fields by position lets
+    the extra fields be dropped, rather than needing the python parser and
+    an on_bad_lines callable.
+
+    If include_unbundled is set, the whole UnbundledHRGs tail is also
+    returned as a long table in the ub_rel layout (RowNo, Iteration,
+    UnbundledHRGs), one row per unbundled HRG.
 
-    Note: columns in the file that are not in column_definitions will be dropped.
+    If typed is set the df's columns are converted to the compact dtypes in
+    data/Schema.csv, with code_dtype for the DIAG/OPER columns.
+
+    return: the df in column_definitions order, and the unbundled HRGs (or
+    None if not included or the file has no UnbundledHRGs column).
     '''
     # Extract the expected display column names in the correct order
     display_names = [column[0] for column in column_definitions]
+    header = pd.read_csv(data_file, delimiter=delimiter, nrows=0,
+                         encoding=GROUPER_FILE_ENCODING).columns.tolist()
+    include_unbundled = include_unbundled and UNBUNDLED_HRG_COLUMN in header
 
-    drop_extraneous_columns = get_drop_extraneous_columns_function(len(display_names))
+    read_fields = read_fields_arrow if ARROW_CSV_AVAILABLE else read_fields_c
+    df = read_fields(data_file, delimiter, len(header), keep_extra_fields=include_unbundled)
 
-    df = pd.read_csv(data_file, delimiter=delimiter, dtype=str,
-                     engine='python', on_bad_lines=drop_extraneous_columns,
-                     encoding='cp1252')
+    unbundled_df = None
+    if include_unbundled:
+        tail = df.iloc[:, header.index(UNBUNDLED_HRG_COLUMN):]
+        row_numbers = (df.iloc[:, header.index('RowNo')] if 'RowNo' in header
+                       else pd.Series(np.arange(1, len(df) + 1)).astype(str))
+        unbundled_df = unbundled_hrgs_long(tail, row_numbers)
+        df = df.iloc[:, :len(header)]
+
+    df.columns = header
 
     # Convert columns to the order specified in the definition file
     df = df.reindex(columns=display_names)
@@ -35,9 +98,119 @@ def read_data(data_file: p.Path, column_definitions: list, delimiter: str = ',')
         if column in df.columns:
             df[column] = pd.to_numeric(df[column], downcast='integer', errors='coerce')
 
+    if typed:
+        df = apply_schema(df, code_dtype=code_dtype)
+
+    return df, unbundled_df
+
+
+def read_fields_arrow(data_file: p.Path, delimiter: str, field_count: int,
+                      keep_extra_fields: bool = False) -> pd.DataFrame:
+    '''
+    Reads the rows after the header into str columns named by position,
+    with pyarrow's CSV reader, which builds the Arrow strings directly.
+
+    pyarrow can't read rows with more or fewer than field_count fields, so
+    it skips them. They're parsed separately and put back in place, padded
+    with NaN, and the extra fields are kept if keep_extra_fields is set.
+    '''
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    ragged_rows = []
+    def keep_ragged_row(row):
+        ragged_rows.append((row.number, row.text))
+        return 'skip'
+
+    names = [str(number) for number in range(field_count)]
+    # Row numbers are only known without threads, it's not much slower
+    table = pa_csv.read_csv(
+        data_file,
+        read_options=pa_csv.ReadOptions(skip_rows=1, column_names=names,
+                                        encoding=GROUPER_FILE_ENCODING, use_threads=False),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter,
+                                          invalid_row_handler=keep_ragged_row),
+        convert_options=pa_csv.ConvertOptions(column_types=dict.fromkeys(names, pa.string()),
+                                              null_values=CSV_NA_VALUES,
+                                              strings_can_be_null=True))
+
+    if ragged_rows:
+        line_numbers, lines = zip(*ragged_rows)
+        na_values = set(CSV_NA_VALUES)
+        rows = [[None if field in na_values else field for field in fields]
+                for fields in csv.reader(lines, delimiter=delimiter)]
+        width = max(field_count, *map(len, rows)) if keep_extra_fields else field_count
+        rows = [row[:width] + [None] * (width - len(row)) for row in rows]
+
+        names = [str(number) for number in range(width)]
+        for name in names[field_count:]:
+            table = table.append_column(name, pa.nulls(table.num_rows, pa.string()))
+        ragged_table = pa.table([pa.array(column, pa.string()) for column in zip(*rows)],
+                                names=names)
+
+        # Line numbers count from the header, on line 1
+        ragged_positions = np.asarray(line_numbers) - 2
+        order = np.empty(table.num_rows + len(rows), dtype=np.int64)
+        is_ragged = np.zeros(len(order), dtype=bool)
+        is_ragged[ragged_positions] = True
+        order[~is_ragged] = np.arange(table.num_rows)
+        order[ragged_positions] = table.num_rows + np.arange(len(rows))
+        table = pa.concat_tables([table, ragged_table]).take(order)
+
+    df = table.to_pandas(types_mapper={pa.string(): STR_DTYPE}.get)
+    df.columns = range(df.shape[1])
     return df
 
 
+def read_fields_c(data_file: p.Path, delimiter: str, field_count: int,
+                  keep_extra_fields: bool = False) -> pd.DataFrame:
+    '''
+    Reads the rows after the header into str columns named by position,
+    with the C parser. Short rows are padded with NaN, and the fields past
+    field_count are dropped unless keep_extra_fields is set.
+    '''
+    # With the extra fields there's a name for every field of the widest
+    # row. Without them usecols drops the extra fields; it can't be used with
+    # every field named, as the C parser checks each low_memory chunk against
+    # the widest row and fails on chunks that don't have one.
+    # index_col=False stops a long first row being read as an index column
+    if keep_extra_fields:
+        names = list(range(max(field_count, count_max_fields(data_file, delimiter))))
+        usecols = None
+    else:
+        names = list(range(field_count))
+        usecols = names
+    return pd.read_csv(data_file, delimiter=delimiter, header=None, skiprows=1,
+                       names=names, usecols=usecols, dtype=str, index_col=False,
+                       encoding=GROUPER_FILE_ENCODING)
+
+
+def count_max_fields(data_file: p.Path, delimiter: str = ',') -> int:
+    '''
+    Returns the most fields on any line of the file.
+    Quoted delimiters are counted too, so this can over count, which only
+    adds empty columns.
+    '''
+    separator = delimiter.encode(GROUPER_FILE_ENCODING)
+    with open(data_file, 'rb') as file:
+        return max((line.count(separator) + 1 for line in file), default=0)
+
+
+def unbundled_hrgs_long(tail: pd.DataFrame, row_numbers: pd.Series) -> pd.DataFrame:
+    '''
+    Turns the UnbundledHRGs tail (the named column and any extra fields)
+    into one row per unbundled HRG, numbered from 1 within each row like
+    the ub_rel file.
+    '''
+    values = tail.to_numpy(dtype=object)
+    rows, iterations = np.nonzero(pd.notna(values))
+    return pd.DataFrame({
+        'RowNo': row_numbers.to_numpy(dtype=object)[rows],
+        'Iteration': iterations + 1,
+        UNBUNDLED_HRG_COLUMN: values[rows, iterations],
+    })
+
+
 def drop_columns(df: pd.DataFrame, columns: list) -> None:
     '''
     Drops the specified columns from the DataFrame if they are present.
@@ -115,13 +288,74 @@ def get_grouper_output_file_by_type(output_file_base: str, gf_type: GrouperFileT
 
 def import_zl_data(input_file: str,
                    input_delim: str = ',',
-                   def_file = '.\\data\\' + DEFAULT_RDF_FILE) -> pd.DataFrame:
+                   def_file = '.\\data\\' + DEFAULT_RDF_FILE,
+                   typed: bool = False, code_dtype: str = 'string') -> pd.DataFrame:
     '''
     Returns a dataframe from the input zl data file that matches the
     definition file provided.
 
     Due to the size of these files, we need a more optimized input method
-    than read_data
+    than read_data. If typed is set the columns are converted to the
+    compact dtypes in data/Schema.csv, with code_dtype ('string' or
+    'category') for the DIAG/OPER columns.
+    '''
+    definition_delim, display_names, mapping = zl_column_mapping(input_file, input_delim,
+                                                                 def_file)
+
+    columns_to_load = list(mapping.keys())
+    df = pd.read_csv(input_file, usecols=columns_to_load,
+                     delimiter=input_delim, dtype=str,
+                     encoding='cp1252')
+
+    return definition_delim, prepare_zl_data(df, mapping, display_names, typed,
+                                             code_dtype=code_dtype)
+
+def import_zl_data_chunks(input_file: str,
+                          input_delim: str = ',',
+                          def_file = '.\\data\\' + DEFAULT_RDF_FILE,
+                          typed: bool = False,
+                          chunk_size: int = 100000,
+                          code_dtype: str = 'string'):
+    '''
+    As import_zl_data, but returns a generator of dataframes of about
+    chunk_size rows each rather than one dataframe, so the whole file is
+    never in memory.
+
+    Chunks end on a PROVSPNO boundary: the rows of the last spell in a
+    chunk are held back and start the next one. This relies on each
+    spell's episodes being next to each other in the file, as they are in
+    the extracts.
+    '''
+    definition_delim, display_names, mapping = zl_column_mapping(input_file, input_delim,
+                                                                 def_file)
+
+    def chunks():
+        reader = pd.read_csv(input_file, usecols=list(mapping.keys()),
+                             delimiter=input_delim, dtype=str,
+                             encoding='cp1252', chunksize=chunk_size)
+        held_back = None
+        with reader:
+            for chunk in reader:
+                chunk = chunk.rename(columns=mapping)
+                if held_back is not None:
+                    chunk = pd.concat([held_back, chunk], ignore_index=True)
+
+                boundary = last_spell_start(chunk['PROVSPNO'])
+                held_back = chunk.iloc[boundary:]
+                if boundary > 0:
+                    yield prepare_zl_data(chunk.iloc[:boundary], {}, display_names, typed,
+                                          report=False, code_dtype=code_dtype)
+
+        if held_back is not None and len(held_back) > 0:
+            yield prepare_zl_data(held_back, {}, display_names, typed, report=False,
+                                  code_dtype=code_dtype)
+
+    return definition_delim, chunks()
+
+def zl_column_mapping(input_file: str, input_delim: str, def_file) -> tuple:
+    '''
+    Returns the definition file's delimiter and column names, and a
+    mapping from the input file's columns to them.
     '''
     # Parse the grouper definitions file to get the column names
     definition_delim, column_definitions = parse_definition_file(def_file)
@@ -141,20 +375,25 @@ def import_zl_data(input_file: str,
         if matched:
             mapping[matched[0]] = column
 
-    columns_to_load = list(mapping.keys())
-    df = pd.read_csv(input_file, usecols=columns_to_load,
-                     delimiter=input_delim, dtype=str,
-                     encoding='cp1252')
-
-    # Rename columns to match the definition.
-    df.rename(columns=mapping, inplace=True)
-
     for column in display_names:
-        if column not in df.columns:
+        if column not in mapping.values():
             raise ValueError(f"Missing column: {column} in input file.")
             # Alternatively, perhaps just add these and fill them with NaN
             #df[column] = np.nan
 
+    return definition_delim, display_names, mapping
+
+def prepare_zl_data(df: pd.DataFrame, mapping: dict, display_names: list,
+                    typed: bool, report: bool = True,
+                    code_dtype: str = 'string') -> pd.DataFrame:
+    '''
+    Renames the columns read from a zl data file to the definition's names
+    and puts them in its order, then converts them to their types. report
+    and code_dtype are passed on to apply_schema.
+    '''
+    # Rename columns to match the definition.
+    df = df.rename(columns=mapping)
+
     # Convert columns to the order specified in the definition file
     df = df.reindex(columns=display_names)
 
@@ -164,7 +403,20 @@ def import_zl_data(input_file: str,
         if column in df.columns:
             df[column] = pd.to_numeric(df[column], downcast='integer', errors='coerce')
 
-    return definition_delim, df
+    if typed:
+        df = apply_schema(df, code_dtype=code_dtype, report=report)
+
+    return df
+
+def last_spell_start(spells: pd.Series) -> int:
+    '''
+    Returns the position of the first of the rows at the end of spells that
+    have the same PROVSPNO as the last row, or 0 if they all do.
+    '''
+    last = spells.iloc[-1]
+    same = spells.isna() if pd.isna(last) else spells.eq(last).fillna(False)
+    different = np.flatnonzero(~same.to_numpy(dtype=bool))
+    return int(different[-1]) + 1 if len(different) else 0
 
 def has_match(definition_column: str, input_column: str) -> bool:
     """
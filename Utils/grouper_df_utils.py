@@ -2,25 +2,131 @@
 This module contains utility functions for working with DataFrames housing
 NHS Grouper data.
 '''
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
 import pandas as pd
 from Plugins.column_extender import ColumnExtenderPlugin
+from Plugins.combination_row import COMBINATION_SUFFIX
+from Utils.data_types import restore_dtypes
+from Utils.plugin_profile import PluginProfile
 from Utils.constants import (MAX_DIAG_COLS, MAX_OPER_COLS,
                              DIAGNOSIS_PREFIX, PROCEDURE_PREFIX)
 
-def apply_plugins(df: pd.DataFrame, plugins: list):
+def apply_plugins(df: pd.DataFrame, plugins: list, profile: Optional[PluginProfile] = None):
     '''
     Applies each plugin in sequence to the DataFrame.
+    If a profile is given, each plugin's time, rows and memory are recorded in it.
     '''
     for plugin in plugins:
-        df = plugin.transform(df)
+        df = profile.run(plugin, df) if profile is not None else plugin.transform(df)
     return df
 
-def write_output(df: pd.DataFrame, output_file_path: str, delimiter: str):
+def apply_plugins_parallel(df: pd.DataFrame, plugins: list, jobs: int = 2,
+                           profile: Optional[PluginProfile] = None):
     '''
-    Writes out the final DataFrame to a file
+    Applies each plugin in sequence to the DataFrame, like apply_plugins,
+    but runs the plugins across jobs processes.
+
+    Rows are hash partitioned by PROVSPNO, so each spell is in one
+    partition, and each run of partition safe plugins (see BasePlugin) is
+    applied to the partitions in a process pool. Other plugins run on the
+    whole DataFrame in between. Plugins that gather state (DataStatsPlugin)
+    merge it from the partitions.
+
+    The results are put back in order of each spell's first row in df,
+    with rows a plugin adds (combination rows) staying after the row they
+    were made from. This is the order apply_plugins gives when each spell's
+    rows are together, as they are in the extracts.
+
+    If a profile is given, the plugins run on partitions get one record
+    each, combining the partitions (see PluginProfile.add_combined_records).
+    '''
+    if jobs < 2 or len(df) == 0:
+        return apply_plugins(df, plugins, profile)
+
+    # Runs of consecutive plugins that can all be run on partitions
+    position = 0
+    while position < len(plugins):
+        if not plugins[position].partition_safe:
+            df = apply_plugins(df, plugins[position:position + 1], profile)
+            position += 1
+            continue
+
+        end = position
+        while end < len(plugins) and plugins[end].partition_safe:
+            end += 1
+        df = apply_plugins_to_partitions(df, plugins[position:end], jobs, profile)
+        position = end
+
+    return df
+
+def apply_plugins_to_partitions(df: pd.DataFrame, plugins: list, jobs: int,
+                                profile: Optional[PluginProfile] = None) -> pd.DataFrame:
+    '''
+    Hash partitions df by PROVSPNO, applies the (partition safe) plugins to
+    each partition in a process pool and puts the results back together.
+    '''
+    spell_order, spells = pd.factorize(df['PROVSPNO'], use_na_sentinel=False)
+    partition_ids = pd.util.hash_array(np.asarray(spells, dtype=object))[spell_order] % jobs
+    partitions = [df.iloc[np.flatnonzero(partition_ids == partition)] for partition in range(jobs)]
+    partitions = [partition for partition in partitions if len(partition) > 0]
+
+    with ProcessPoolExecutor(max_workers=len(partitions)) as executor:
+        futures = [executor.submit(apply_partition_plugins, partition,
+                                   [plugin.for_partition() for plugin in plugins],
+                                   None if profile is None else PluginProfile(profile.trace_memory))
+                   for partition in partitions]
+        results = [future.result() for future in futures]
+
+    for number, plugin in enumerate(plugins):
+        plugin.merge_partitions([partition_plugins[number] for _, partition_plugins, _ in results])
+
+    if profile is not None:
+        profile.add_combined_records([partition_profile.records
+                                      for _, _, partition_profile in results], concurrent=True)
+
+    frames = [partition_df for partition_df, _, _ in results]
+    keys = [spell_order_keys(partition_df['PROVSPNO'], pd.Index(spells)) for partition_df in frames]
+
+    result = pd.concat(frames, ignore_index=True)
+    result = result.iloc[np.argsort(np.concatenate(keys), kind='stable')].reset_index(drop=True)
+
+    # Categoricals from different partitions have different categories
+    return restore_dtypes(result, frames[0].dtypes)
+
+def spell_order_keys(provspno: pd.Series, spells: pd.Index) -> np.ndarray:
+    '''
+    Returns the position in spells of each row's spell. Combination rows
+    take their original spell's position and rows of any other new spell
+    take the position of the row before them.
+    '''
+    keys = spells.get_indexer(provspno)
+    unmatched = keys < 0
+    if unmatched.any():
+        original = provspno[unmatched].astype(str).str.removesuffix(COMBINATION_SUFFIX)
+        keys[unmatched] = spells.get_indexer(original)
+
+    keys = pd.Series(keys, dtype=float)
+    return keys.where(keys >= 0).ffill().fillna(-1).to_numpy()
+
+def apply_partition_plugins(df: pd.DataFrame, plugins: list,
+                            profile: Optional[PluginProfile] = None) -> tuple:
+    '''
+    Applies the plugins to one partition in a worker process. Returns the
+    result, the plugins and the profile, so the parent can merge their state.
+    '''
+    return apply_plugins(df, plugins, profile), plugins, profile
+
+def write_output(df: pd.DataFrame, output_file_path: str, delimiter: str,
+                 append: bool = False):
+    '''
+    Writes out the final DataFrame to a file. If append is set the rows are
+    added to the end of the file, without a header row.
     '''
     # Output the CSV with header row, no index
-    df.to_csv(output_file_path, sep=delimiter, index=False)
+    df.to_csv(output_file_path, sep=delimiter, index=False,
+              mode='a' if append else 'w', header=not append)
 
 def expand_code_columns(df: pd.DataFrame):
     '''
@@ -0,0 +1,80 @@
+'''
+    This module provides a writer that streams blocks of rows into a grouper
+    input file, so the full set of rows never has to be held in memory.
+'''
+import numpy as np
+import pandas as pd
+from Utils.grouper_cache import row_fingerprints
+
+
+class GrouperInputWriter:
+    '''
+    Appends blocks of rows to a grouper input file.
+
+    With dedupe set, only the first row of each set of rows with identical
+    grouping inputs is written (across all blocks), and the position of
+    each row's representative in the file is kept so the output can be
+    expanded with row_dedupe.expand_deduped_rows. Only the fingerprints,
+    PROVSPNOs and positions are kept, not the rows.
+    '''
+    def __init__(self, input_file: str, delimiter: str, dedupe: bool = False):
+        self.input_file = input_file
+        self.delimiter = delimiter
+        self.dedupe = dedupe
+        self.rows_in = 0
+        self.rows_written = 0
+        self.seen_keys = {}
+        self.position_blocks = []
+        self.provspno_blocks = []
+
+    def write(self, block: pd.DataFrame) -> None:
+        '''
+        Append a block of rows to the input file.
+        '''
+        self.rows_in += len(block)
+        if self.dedupe:
+            block = self._dedupe_block(block)
+
+        block.to_csv(self.input_file, sep=self.delimiter, index=False,
+                     mode='a' if self.rows_written else 'w',
+                     header=not self.rows_written)
+        self.rows_written += len(block)
+
+    def _dedupe_block(self, block: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Drop the rows whose grouping inputs have already been written,
+        recording the position of each row's representative.
+        '''
+        codes, keys = pd.factorize(row_fingerprints(block))
+
+        # Positions of the keys already written, -1 for new ones
+        key_positions = np.fromiter((self.seen_keys.get(key, -1) for key in keys),
+                                    dtype=np.int64, count=len(keys))
+        new_keys = np.flatnonzero(key_positions < 0)
+        key_positions[new_keys] = self.rows_written + np.arange(len(new_keys))
+        self.seen_keys.update(zip(keys[new_keys], key_positions[new_keys]))
+
+        self.position_blocks.append(key_positions[codes])
+        self.provspno_blocks.append(block['PROVSPNO'].to_numpy(dtype=object))
+
+        # factorize numbers the keys in order of first appearance
+        first_rows = np.unique(codes, return_index=True)[1]
+        return block.iloc[first_rows[new_keys]]
+
+    @property
+    def positions(self) -> np.ndarray:
+        '''
+        The position in the input file of each row's representative.
+        '''
+        if not self.position_blocks:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(self.position_blocks)
+
+    @property
+    def provspno(self) -> np.ndarray:
+        '''
+        The PROVSPNO of every row passed to write.
+        '''
+        if not self.provspno_blocks:
+            return np.array([], dtype=object)
+        return np.concatenate(self.provspno_blocks)
@@ -0,0 +1,164 @@
+'''
+    This module provides a profile of a plugin chain: for each plugin run
+    by apply_plugins, the wall and CPU time, rows and columns in and out,
+    and memory used, so the plugins that dominate a run can be found.
+'''
+import importlib.util
+import time
+import tracemalloc
+from json import dump
+from os import path
+from typing import Optional
+import pandas as pd
+
+# psutil gives the process's resident memory, without it that's left out
+if importlib.util.find_spec('psutil'):
+    import psutil
+else:
+    psutil = None
+
+PROFILE_FILE_SUFFIX = '_plugin_profile.json'
+
+
+class PluginProfile:
+    '''
+    Records one entry per plugin run. Pass an instance to apply_plugins
+    (or apply_plugins_parallel) and read the entries back from records,
+    report() or write_json().
+
+    Memory is measured with tracemalloc (the peak of Python and numpy
+    allocations while the plugin ran, over what was allocated before) and,
+    if psutil is installed, the change in resident memory. tracemalloc
+    slows the plugins down, so it can be turned off with trace_memory.
+    '''
+
+    def __init__(self, trace_memory: bool = True):
+        '''
+        :param trace_memory: Measure the peak memory of each plugin with tracemalloc.
+        '''
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def run(self, plugin, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Runs the plugin on df, recording the measurements, and returns the result.
+        '''
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = resident_memory()
+        rows_in, columns_in = df.shape
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = plugin.transform(df)
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+
+        peak_memory = None
+        if self.trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] - traced_before
+            if started_tracing:
+                tracemalloc.stop()
+        rss_after = resident_memory()
+
+        self.records.append({
+            'plugin': type(plugin).__name__,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            'rows_in': rows_in,
+            'rows_out': len(result),
+            'columns_in': columns_in,
+            'columns_out': result.shape[1],
+            'peak_memory_bytes': peak_memory,
+            'rss_delta_bytes': (rss_after - rss_before
+                                if rss_before is not None else None),
+        })
+
+        return result
+
+    def add_combined_records(self, runs: list, concurrent: bool) -> None:
+        '''
+        Adds the records of several runs of the same plugins (on the
+        partitions in apply_plugins_parallel, or on the chunks of a file)
+        as one record per plugin. Wall time is the longest of the runs if
+        they ran at the same time, or the total if not. Peak memory is the
+        highest of any run, everything else is the total.
+        '''
+        for records in zip(*runs):
+            wall_times = [record['wall_seconds'] for record in records]
+            self.records.append({
+                'plugin': records[0]['plugin'],
+                'wall_seconds': max(wall_times) if concurrent else sum(wall_times),
+                'cpu_seconds': sum(record['cpu_seconds'] for record in records),
+                'rows_in': sum(record['rows_in'] for record in records),
+                'rows_out': sum(record['rows_out'] for record in records),
+                'columns_in': records[0]['columns_in'],
+                'columns_out': records[0]['columns_out'],
+                'peak_memory_bytes': max_or_none(record['peak_memory_bytes']
+                                                 for record in records),
+                'rss_delta_bytes': sum_or_none(record['rss_delta_bytes'] for record in records),
+                'runs': len(records),
+            })
+
+    def to_dataframe(self) -> pd.DataFrame:
+        '''
+        Returns the records as a DataFrame, one row per plugin run.
+        '''
+        return pd.DataFrame(self.records)
+
+    def report(self) -> None:
+        '''
+        Prints the time, rows and memory of each plugin run.
+        '''
+        print("\n--- Plugin Profile ---")
+        for record in self.records:
+            memory = record['peak_memory_bytes']
+            memory = f"{memory / 1024 ** 2:.1f} MB peak" if memory is not None else "-"
+            print(f"  {record['plugin']}: {record['wall_seconds']:.2f}s wall, "
+                  f"{record['cpu_seconds']:.2f}s CPU, "
+                  f"{record['rows_in']} -> {record['rows_out']} rows, {memory}")
+
+    def write_json(self, output_file: str) -> None:
+        '''
+        Writes the records to a JSON file.
+        '''
+        with open(output_file, 'w', encoding='utf-8') as f:
+            dump({'plugins': self.records}, f, indent=4)
+
+
+def get_profile_file(output_file: str) -> str:
+    '''
+    Returns the name of the profile file to write next to an output file,
+    e.g. /path/name_v2.csv -> /path/name_v2_plugin_profile.json.
+    '''
+    base_name, _ = path.splitext(output_file)
+    return f"{base_name}{PROFILE_FILE_SUFFIX}"
+
+
+def resident_memory() -> Optional[int]:
+    '''
+    Returns the resident memory of this process in bytes, or None without psutil.
+    '''
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def max_or_none(values) -> Optional[int]:
+    '''
+    Returns the largest of the values, or None if any of them are None.
+    '''
+    values = list(values)
+    return None if None in values else max(values)
+
+
+def sum_or_none(values) -> Optional[int]:
+    '''
+    Returns the sum of the values, or None if any of them are None.
+    '''
+    values = list(values)
+    return None if None in values else sum(values)
@@ -4,18 +4,19 @@ applies a series of data transformation plugins to the data, and outputs the
 resulting DataFrame to a new CSV file.
 '''
 import argparse
+from typing import Optional
 from Plugins.only_inpatient_baseclass import OnlyInpatientPlugin
 from Plugins.procodet_null_filler import ProcodetNullFillerPlugin
-from Plugins.period_strip import PeriodStripPlugin
-from Plugins.nc_strip import NcStripPlugin
-from Plugins.append_x import AppendXPlugin
+from Plugins.code_normalization import CodeNormalizationPlugin
 from Plugins.column_extender import ColumnExtenderPlugin
 from Plugins.combination_row import CombinationRowPlugin
 from Plugins.only_single_episode_spells import OnlySingleEpisodeSpellsPlugin
 from Plugins.data_stats import DataStatsPlugin
 from Utils.file_utils import get_default_output_file
-from Utils.grouper_data_import import import_zl_data
-from Utils.grouper_df_utils import apply_plugins, write_output
+from Utils.grouper_data_import import import_zl_data, import_zl_data_chunks
+from Utils.grouper_df_utils import apply_plugins_parallel, write_output
+from Utils.plugin_profile import PluginProfile, get_profile_file
+from Utils.data_types import CODE_DTYPES
 from Utils.time_to_run import ttr
 from Utils.constants import (MAX_DIAG_COLS, MAX_OPER_COLS,
                              DIAGNOSIS_PREFIX, PROCEDURE_PREFIX,
@@ -31,51 +32,138 @@ def main():
     )
     parser.add_argument("data_file", help="Data file.")
     parser.add_argument("definition_file", help="Definition file.", default=DEFAULT_RDF_FILE)
+    parser.add_argument("--typed", nargs="?", const="string", default=None, choices=CODE_DTYPES,
+                        help="Load the data with the compact dtypes in data/Schema.csv, "
+                        "with the DIAG/OPER columns as strings (the default) or categoricals, "
+                        "which use much less memory.")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Process the file this many rows at a time to bound memory use.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of processes to run the plugins across.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record each plugin's time and memory and write them as JSON.")
     args = parser.parse_args()
 
     definition_file_path = args.definition_file
     data_file_path = args.data_file
     time = ttr()
-    output_file_path = process_zl_data_file(data_file_path, definition_file_path)
+    output_file_path = process_zl_data_file(data_file_path, definition_file_path,
+                                            typed=args.typed is not None,
+                                            code_dtype=args.typed or 'string',
+                                            chunk_size=args.chunk_size,
+                                            jobs=args.jobs, profile=args.profile)
 
     print(f"The data has been processed and saved to {output_file_path}")
     _ = ttr(time)
 
-if __name__ == "__main__":
-    main()
-
 def process_zl_data_file(data_file_path: str,
-                         definition_file_path = '.\\data\\' + DEFAULT_RDF_FILE
+                         definition_file_path = '.\\data\\' + DEFAULT_RDF_FILE,
+                         typed: bool = False,
+                         chunk_size: Optional[int] = None,
+                         jobs: int = 1,
+                         profile: bool = False,
+                         code_dtype: str = 'string'
                          ) -> str:
     '''
     This function runs the plugins on the data file and writes the output to a new CSV file.
+    If typed is set the data is loaded with the compact dtypes in data/Schema.csv,
+    with code_dtype ('string' or 'category') for the DIAG/OPER columns.
+    If chunk_size is set the file is read, processed and written about that
+    many rows at a time (never splitting a spell), so memory use depends on
+    the chunk size rather than the file size.
+    If jobs is more than 1 the plugins are run across that many processes.
+    If profile is set each plugin's time, rows and memory are printed and
+    written to a JSON file next to the output file.
     Note: DataStatsPlugin prints output to the console.
     '''
+    # Get output file path
+    output_file_path = get_default_output_file(data_file_path)
+
+    if chunk_size is not None:
+        plugin_profile = process_zl_data_file_chunks(data_file_path, definition_file_path,
+                                                     output_file_path, typed, chunk_size,
+                                                     jobs, profile, code_dtype)
+    else:
+        plugin_profile = process_zl_data_file_whole(data_file_path, definition_file_path,
+                                                    output_file_path, typed, jobs, profile,
+                                                    code_dtype)
+
+    if plugin_profile is not None:
+        plugin_profile.report()
+        plugin_profile.write_json(get_profile_file(output_file_path))
+
+    return output_file_path
+
+def process_zl_data_file_whole(data_file_path: str, definition_file_path: str,
+                               output_file_path: str, typed: bool, jobs: int = 1,
+                               profile: bool = False,
+                               code_dtype: str = 'string') -> Optional[PluginProfile]:
+    '''
+    Runs the plugins on the whole data file at once and writes the output.
+    Returns the plugin profile if profile is set.
+    '''
 
     # Read in the data
-    definition_delim, df = import_zl_data(data_file_path, '|', definition_file_path)
+    definition_delim, df = import_zl_data(data_file_path, '|', definition_file_path,
+                                          typed=typed, code_dtype=code_dtype)
+
+    # Apply the plugins in sequence
+    plugin_profile = PluginProfile() if profile else None
+    df_transformed = apply_plugins_parallel(df, zl_data_plugins(DataStatsPlugin()), jobs,
+                                            plugin_profile)
+
+    # Write out the final CSV
+    write_output(df_transformed, output_file_path, definition_delim)
+
+    return plugin_profile
+
+def process_zl_data_file_chunks(data_file_path: str, definition_file_path: str,
+                                output_file_path: str, typed: bool, chunk_size: int,
+                                jobs: int = 1,
+                                profile: bool = False,
+                                code_dtype: str = 'string') -> Optional[PluginProfile]:
+    '''
+    Runs the plugins on the data file a chunk at a time, appending each
+    chunk's output to the output file. The data stats cover the whole file.
+    Returns the plugin profile, totalled over the chunks, if profile is set.
+    '''
+    definition_delim, chunks = import_zl_data_chunks(data_file_path, '|', definition_file_path,
+                                                     typed=typed, chunk_size=chunk_size,
+                                                     code_dtype=code_dtype)
+
+    data_stats = DataStatsPlugin(accumulate=True)
+    plugins = zl_data_plugins(data_stats)
+
+    chunk_profiles = []
+    for number, df in enumerate(chunks):
+        chunk_profile = PluginProfile() if profile else None
+        df_transformed = apply_plugins_parallel(df, plugins, jobs, chunk_profile)
+        write_output(df_transformed, output_file_path, definition_delim, append=number > 0)
+        chunk_profiles.append(chunk_profile)
+
+    data_stats.report()
 
-    # Create a list of plugins
-    plugins = [
+    if not profile:
+        return None
+    plugin_profile = PluginProfile()
+    plugin_profile.add_combined_records([chunk_profile.records for chunk_profile in chunk_profiles],
+                                        concurrent=False)
+    return plugin_profile
+
+def zl_data_plugins(data_stats: DataStatsPlugin) -> list:
+    '''
+    The plugins to run on a zl data file, in order, ending with data_stats.
+    '''
+    return [
         OnlyInpatientPlugin(),
         ProcodetNullFillerPlugin(),
-        PeriodStripPlugin(),
-        NcStripPlugin(),
-        AppendXPlugin(),
+        CodeNormalizationPlugin(),
         ColumnExtenderPlugin(prefix=DIAGNOSIS_PREFIX, maximum=MAX_DIAG_COLS),
         ColumnExtenderPlugin(prefix=PROCEDURE_PREFIX, maximum=MAX_OPER_COLS),
         CombinationRowPlugin(replace_rows=True),
         OnlySingleEpisodeSpellsPlugin(),
-        DataStatsPlugin(),
+        data_stats,
     ]
 
-    # Apply the plugins in sequence
-    df_transformed = apply_plugins(df, plugins)
-
-    # Get output file path
-    output_file_path = get_default_output_file(data_file_path)
-
-    # Write out the final CSV
-    write_output(df_transformed, output_file_path, definition_delim)
-
-    return output_file_path
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+'''
+    This module provides functions to collapse rows with identical grouping
+    inputs before they're sent to the grouper and to fan the grouper output
+    back out to every original row afterwards.
+'''
+import numpy as np
+import pandas as pd
+from Utils.grouper_cache import row_fingerprints
+
+
+def dedupe_grouper_rows(df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray]:
+    '''
+    Collapses rows whose grouping inputs are identical (everything except
+    PROVSPNO) to the first one of them, e.g. a probe row whose value is the
+    same as its source row's, or two probes that produce the same row.
+
+    Note: this is only valid for single episode spells, as each row is
+    grouped on its own.
+
+    return: the representative rows, in their original order, and for each
+    row of df the position of its representative in the returned frame.
+    '''
+    keys = row_fingerprints(df)
+    codes, _ = pd.factorize(keys)
+    representatives = np.unique(codes, return_index=True)[1]
+
+    # factorize numbers the keys in order of first appearance, so the
+    # codes are also the positions of the representatives
+    unique_df = df.iloc[representatives].reset_index(drop=True)
+    print(f"Deduplicated {len(df)} grouper rows to {len(unique_df)}")
+
+    return unique_df, codes
+
+
+def expand_deduped_rows(grouped_df: pd.DataFrame, provspno,
+                        positions: np.ndarray) -> pd.DataFrame:
+    '''
+    Fans the grouper output for the representative rows back out to one row
+    per original row, restoring each row's own PROVSPNO and RowNo so the
+    result matches grouping the original rows directly.
+
+    provspno : The PROVSPNO of each original row.
+    positions : The position of each original row's representative.
+    '''
+    row_numbers = pd.Index(pd.to_numeric(grouped_df['RowNo']) - 1)
+    take = row_numbers.get_indexer(positions)
+    if (take < 0).any() or len(grouped_df) != positions.max(initial=-1) + 1:
+        raise ValueError("Grouper output doesn't match the deduplicated input, "
+                         "rerun the grouper with no_cache set")
+
+    expanded_df = grouped_df.iloc[take].reset_index(drop=True)
+    expanded_df['PROVSPNO'] = np.asarray(provspno, dtype=object)
+    expanded_df['RowNo'] = np.arange(1, len(expanded_df) + 1).astype(str)
+
+    return expanded_df
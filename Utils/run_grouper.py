@@ -1,13 +1,18 @@
 '''
-    This module provides a function that generates a new grouper output file
+    This module provides functions that generate a new grouper output file,
+    and a pool that runs several groupings at once
 '''
+import asyncio
+import weakref
 from os import getenv, path
 from typing import Optional
 from datetime import datetime
 from dotenv import load_dotenv
-from Utils.command_runner import run_command_and_wait
+from Utils.command_runner import run_command_and_wait, run_command_async
 import Utils.constants as const
 
+GROUPER_LOG_SUFFIX = '_grouper.log'
+
 
 def run_grouper(input_file: str,
                definitions_file: Optional[str] = None,
@@ -23,7 +28,56 @@ def run_grouper(input_file: str,
     :param grouper_exe: The path to the grouper executable.
     :return: The path to the output file.
     '''
+    command, output_file = get_grouper_command(input_file, definitions_file,
+                                               output_file, grouper_exe)
+    success = run_command_and_wait(command, silent=True)
+    if success:
+        return output_file
+
+    raise RuntimeError("Grouper execution failed")
+
+async def run_grouper_async(input_file: str,
+                            definitions_file: Optional[str] = None,
+                            output_file: Optional[str] = None,
+                            grouper_exe: Optional[str] = None,
+                            timeout: Optional[float] = None,
+                            log_file: Optional[str] = None,
+                            ) -> str:
+    '''
+    Runs the grouper executable as a coroutine, so several groupings can be
+    run at once (see GrouperPool). The grouper's verbose output is streamed
+    to log_file rather than kept in memory. If the grouper runs past the
+    timeout, or the coroutine is cancelled, the grouper process is killed.
 
+    :param data_file: The path to the data file to be processed.
+    :param definitions_file: The path to the definitions file to be used.
+    :param output_file: The path to the output file to be created.
+    :param grouper_exe: The path to the grouper executable.
+    :param timeout: The number of seconds to allow the grouper, None for no limit.
+    :param log_file: The file to write the grouper's output to, None to discard it.
+    :return: The path to the output file.
+    :raises TimeoutError: If the grouper was killed because it ran past the timeout.
+    '''
+    command, output_file = get_grouper_command(input_file, definitions_file,
+                                               output_file, grouper_exe)
+    success = await run_command_async(command, log_file, timeout)
+    if success:
+        return output_file
+
+    log_message = f", see {log_file}" if log_file is not None else ""
+    raise RuntimeError(f"Grouper execution failed for {input_file}{log_message}")
+
+def get_grouper_command(input_file: str,
+                        definitions_file: Optional[str] = None,
+                        output_file: Optional[str] = None,
+                        grouper_exe: Optional[str] = None,
+                        ) -> tuple[list[str], str]:
+    '''
+    Builds the grouper command line, filling in the default executable,
+    definitions file and output file, and the default folders for file
+    names given without one.
+    return: the command and the path to the output file.
+    '''
     if grouper_exe is None:
         load_dotenv()
         grouper_exe = getenv('GROUPER_EXE')
@@ -60,8 +114,90 @@ def run_grouper(input_file: str,
         "-h",  # indicates that the input file has a header row
         "-v"   # Verbose mode
     ]
-    success = run_command_and_wait(command, silent=True)
-    if success:
-        return output_file
+    return command, output_file
 
-    raise RuntimeError("Grouper execution failed")
+def get_grouper_log_file(output_file: str) -> str:
+    '''
+    Returns the name of the log file for a grouping, next to its output,
+    e.g. /path/name_output.csv -> /path/name_output_grouper.log.
+    '''
+    base_name, _ = path.splitext(output_file)
+    return f"{base_name}{GROUPER_LOG_SUFFIX}"
+
+
+class GrouperPool:
+    '''
+    Runs many grouper invocations concurrently, at most max_concurrent at
+    a time. Each run is killed if it takes longer than timeout seconds and
+    its output is written to a log file next to its output file.
+
+    Use run() from a coroutine, or run_all() to group several files from
+    ordinary code and wait for them all:
+
+        pool = GrouperPool(max_concurrent=4, timeout=3600)
+        outputs = pool.run_all([(input_file, None, output_file), ...])
+    '''
+
+    def __init__(self, max_concurrent: int = 2,
+                 timeout: Optional[float] = None,
+                 grouper_exe: Optional[str] = None,
+                 log_output: bool = True):
+        '''
+        :param max_concurrent: The most grouper processes to run at once.
+        :param timeout: The number of seconds to allow each grouping, None for no limit.
+        :param grouper_exe: The path to the grouper executable, by default from GROUPER_EXE.
+        :param log_output: Write each grouper's output to a log file, else discard it.
+        '''
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.grouper_exe = grouper_exe
+        self.log_output = log_output
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def run(self, input_file: str,
+                  definitions_file: Optional[str] = None,
+                  output_file: Optional[str] = None) -> str:
+        '''
+        Runs one grouping once a slot in the pool is free.
+        Takes the same files as run_grouper and returns the path to the output file.
+        '''
+        async with self._semaphore():
+            _, output_file = get_grouper_command(input_file, definitions_file,
+                                                 output_file, self.grouper_exe)
+            log_file = get_grouper_log_file(output_file) if self.log_output else None
+            return await run_grouper_async(input_file, definitions_file, output_file,
+                                           self.grouper_exe, self.timeout, log_file)
+
+    async def run_many(self, groupings: list[tuple]) -> list[str]:
+        '''
+        Runs each grouping, a tuple of run()'s arguments, through the pool.
+        If any of them fails the rest are cancelled (killing their grouper
+        processes) and the error is raised.
+        return: the output file of each grouping, in order.
+        '''
+        tasks = [asyncio.ensure_future(self.run(*grouping)) for grouping in groupings]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def run_all(self, groupings: list[tuple]) -> list[str]:
+        '''
+        Runs run_many() to completion from ordinary (not async) code.
+        '''
+        return asyncio.run(self.run_many(groupings))
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        '''
+        The semaphore limiting the pool, one per event loop as a semaphore
+        can't be shared between loops (run_all starts a new loop each time).
+        '''
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphores[loop]
@@ -0,0 +1,202 @@
+'''
+    This module provides a function that runs the grouper over several
+    shards of an input file in parallel and merges the outputs back together.
+'''
+import csv
+import heapq
+from contextlib import ExitStack
+from os import path, remove
+from typing import Iterator, Optional
+import numpy as np
+import pandas as pd
+from Probe_classes.grouper_file_type import GrouperFileType
+from Utils.grouper_data_import import get_grouper_output_file_by_type
+from Utils.run_grouper import run_grouper, GrouperPool, get_grouper_log_file
+import Utils.constants as const
+
+# The grouper writes cp1252, latin-1 round trips every byte unchanged
+SHARD_ENCODING = 'latin-1'
+SHARD_CHUNK_SIZE = 100000
+
+
+def run_grouper_sharded(input_file: str,
+                        definitions_file: Optional[str] = None,
+                        output_file: Optional[str] = None,
+                        grouper_exe: Optional[str] = None,
+                        jobs: int = 2,
+                        delimiter: str = ',',
+                        keep_shards: bool = False,
+                        timeout: Optional[float] = None,
+                        ) -> str:
+    '''
+    Splits the input file into shards, runs one grouper process per shard
+    concurrently and merges the FCE outputs back into input row order.
+
+    Rows are assigned to shards by their base PROVSPNO (the part before the
+    first probe delimiter), so a source row and all of its probe rows are
+    always grouped by the same process.
+
+    Only the FCE file is merged, as that's the file the probes read back.
+    Each shard's grouper output is logged next to its output file.
+
+    :param input_file: The path to the combined grouper input file.
+    :param definitions_file: The path to the definitions file to be used.
+    :param output_file: The path to the merged output file base name.
+    :param grouper_exe: The path to the grouper executable.
+    :param jobs: The number of shards and concurrent grouper processes.
+    :param delimiter: The delimiter of the input file.
+    :param keep_shards: Keep the shard input and output files after merging.
+    :param timeout: The number of seconds to allow each shard's grouper, None for no limit.
+    :return: The path to the output file.
+    '''
+    if output_file is None:
+        raise ValueError("output_file not set")
+
+    if jobs < 2 and timeout is None:
+        return run_grouper(input_file, definitions_file, output_file, grouper_exe)
+    if jobs < 2:
+        pool = GrouperPool(max_concurrent=1, timeout=timeout, grouper_exe=grouper_exe)
+        return pool.run_all([(input_file, definitions_file, output_file)])[0]
+
+    shard_inputs, shard_positions = split_input_file(input_file, jobs, delimiter)
+    shard_outputs = [get_shard_file_name(output_file, shard) for shard in range(jobs)]
+
+    # Empty shards would just make the grouper fail, so skip them
+    shards = [shard for shard in range(jobs) if len(shard_positions[shard]) > 0]
+
+    pool = GrouperPool(max_concurrent=len(shards) or 1, timeout=timeout,
+                       grouper_exe=grouper_exe)
+    pool.run_all([(shard_inputs[shard], definitions_file, shard_outputs[shard])
+                  for shard in shards])
+
+    merge_fce_files(
+        [get_grouper_output_file_by_type(shard_outputs[shard], GrouperFileType.FCE)
+         for shard in shards],
+        [shard_positions[shard] for shard in shards],
+        get_grouper_output_file_by_type(output_file, GrouperFileType.FCE),
+        delimiter
+        )
+
+    if not keep_shards:
+        remove_shard_files(shard_inputs, shard_outputs)
+
+    return output_file
+
+
+def get_shard_file_name(file_name: str, shard: int) -> str:
+    '''
+    Given a file name, return the name of the given shard of that file.
+    '''
+    base_name, extension = path.splitext(file_name)
+    return f"{base_name}_shard{shard}{extension}"
+
+
+def split_input_file(input_file: str, jobs: int,
+                     delimiter: str) -> tuple[list[str], list[np.ndarray]]:
+    '''
+    Streams the input file into one file per shard.
+    Only the PROVSPNO column is parsed, the lines themselves are copied
+    across unchanged (the input is written by write_output, so there are no
+    quoted line breaks).
+    return: the shard file names and, for each shard, the position in the
+    input file of each of its rows.
+    '''
+    shard_inputs = [get_shard_file_name(input_file, shard) for shard in range(jobs)]
+    positions = [[] for _ in range(jobs)]
+
+    spell_chunks = pd.read_csv(input_file, sep=delimiter, dtype=str, na_filter=False,
+                               usecols=['PROVSPNO'], chunksize=SHARD_CHUNK_SIZE,
+                               encoding=SHARD_ENCODING)
+
+    shard_files = [open(shard_input, 'wb') for shard_input in shard_inputs]
+    try:
+        with open(input_file, 'rb') as file:
+            header = file.readline()
+            for shard_file in shard_files:
+                shard_file.write(header)
+
+            offset = 0
+            for chunk in spell_chunks:
+                family = chunk['PROVSPNO'].str.split(const.DEFAULT_DELIMITER, n=1,
+                                                     regex=False).str[0]
+                shard_ids = pd.util.hash_array(family.to_numpy(dtype=object)) % jobs
+
+                for shard_id in shard_ids:
+                    shard_files[shard_id].write(file.readline())
+
+                chunk_positions = np.arange(offset, offset + len(chunk))
+                for shard in range(jobs):
+                    positions[shard].append(chunk_positions[shard_ids == shard])
+                offset += len(chunk)
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    shard_positions = [np.concatenate(shard) if shard else np.array([], dtype=np.int64)
+                       for shard in positions]
+
+    return shard_inputs, shard_positions
+
+
+def merge_fce_files(fce_files: list[str], shard_positions: list[np.ndarray],
+                    output_file: str, delimiter: str) -> None:
+    '''
+    Merges the shard FCE files into a single file in the original input
+    order and renumbers RowNo to match the combined input file.
+    Rows are copied as-is, including any variable length UnbundledHRGs tail.
+    The shard files are read a row at a time, so only one row per shard is
+    held in memory.
+    '''
+    header = None
+    with ExitStack() as stack:
+        shard_rows = []
+        for fce_file, positions in zip(fce_files, shard_positions):
+            file = stack.enter_context(open(fce_file, encoding=SHARD_ENCODING, newline=''))
+            reader = csv.reader(file, delimiter=delimiter)
+            header = next(reader)
+            shard_rows.append(iter_shard_rows(reader, header.index('RowNo'), positions,
+                                              fce_file))
+
+        with open(output_file, 'w', encoding=SHARD_ENCODING, newline='') as file:
+            writer = csv.writer(file, delimiter=delimiter, lineterminator='\n')
+            if header is not None:
+                writer.writerow(header)
+            for _, row in heapq.merge(*shard_rows, key=lambda keyed_row: keyed_row[0]):
+                writer.writerow(row)
+
+
+def iter_shard_rows(reader: Iterator[list[str]], row_number_index: int,
+                    positions: np.ndarray, fce_file: str) -> Iterator[tuple[int, list[str]]]:
+    '''
+    Yields each row of a shard FCE file with its position in the combined
+    input file, its RowNo renumbered to match.
+    The grouper writes rows in input order, so the positions must increase,
+    which is what lets heapq.merge interleave the shards lazily.
+    '''
+    previous_position = -1
+    for row in reader:
+        if not row:
+            continue
+        global_position = int(positions[int(row[row_number_index]) - 1])
+        if global_position <= previous_position:
+            raise ValueError(f"Rows of {fce_file} are out of RowNo order at "
+                             f"RowNo {row[row_number_index]}")
+        previous_position = global_position
+        row[row_number_index] = str(global_position + 1)
+        yield global_position, row
+
+
+def remove_shard_files(shard_inputs: list[str], shard_outputs: list[str]) -> None:
+    '''
+    Removes the shard input files and every grouper output and log file for each shard.
+    '''
+    shard_files = list(shard_inputs) + list(shard_outputs)
+    shard_files.extend(get_grouper_log_file(shard_output) for shard_output in shard_outputs)
+    for shard_output in shard_outputs:
+        shard_files.extend(get_grouper_output_file_by_type(shard_output, gf_type)
+                           for gf_type in GrouperFileType
+                           if gf_type not in (GrouperFileType.INPUT, GrouperFileType.OUTPUT))
+
+    for shard_file in shard_files:
+        if path.exists(shard_file):
+            remove(shard_file)
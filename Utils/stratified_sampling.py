@@ -0,0 +1,83 @@
+'''
+    This module provides stratified sampling of grouped rows, so a probe
+    run can cover every HRG stratum with a fraction of the rows.
+
+    A stratum is the SpellHRG chapter (e.g. 'F'), subchapter (e.g. 'FZ')
+    or full HRG, plus the GroupingMethodFlag. Up to a fixed number of rows
+    is kept from each stratum, and each kept row's weight is the number of
+    rows in its stratum over the number kept, so counts over the sample
+    can be scaled back up to the whole extract.
+'''
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# The number of characters of the HRG code that make up each strata level,
+# None being the whole code
+STRATA_LEVELS = {
+    'chapter': 1,
+    'subchapter': 2,
+    'hrg': None,
+}
+STRATUM_SEPARATOR = ":"
+
+
+def hrg_strata(spell_hrg: pd.Series, grouping_method: pd.Series,
+               level: str = 'subchapter') -> pd.Series:
+    '''
+    Returns the stratum of each row, e.g. 'FZ:P' for a subchapter FZ HRG
+    grouped by procedure. Rows that didn't group have an empty HRG part.
+
+    :param level: One of STRATA_LEVELS.
+    '''
+    if level not in STRATA_LEVELS:
+        raise ValueError(f"Unknown strata level '{level}', expected one of "
+                         f"{', '.join(STRATA_LEVELS)}")
+    hrg = spell_hrg.fillna('').astype(str).str.strip()
+    length = STRATA_LEVELS[level]
+    if length is not None:
+        hrg = hrg.str[:length]
+    method = grouping_method.fillna('').astype(str).str.strip()
+    return hrg + STRATUM_SEPARATOR + method
+
+
+def stratified_sample(df: pd.DataFrame, strata: pd.Series, per_stratum: int,
+                      seed: Optional[int] = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Keeps up to per_stratum rows of each stratum, picked at random. The same
+    seed picks the same rows.
+
+    :param strata: The stratum of each row of df, in the same order.
+    :return: The kept rows, in their original order, and one row per stratum:
+             Stratum, Rows, Sampled and Weight (Rows / Sampled).
+    '''
+    if per_stratum < 1:
+        raise ValueError("per_stratum must be at least 1")
+
+    codes, uniques = pd.factorize(np.asarray(strata, dtype=object))
+    keys = np.random.default_rng(seed).random(len(codes))
+
+    # Sort by stratum and then the random key, so each row's rank within
+    # its stratum is its distance from the start of the stratum
+    order = np.lexsort((keys, codes))
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.arange(len(order)) - starts[codes[order]]
+    keep = np.sort(order[rank < per_stratum])
+
+    sampled = np.minimum(counts, per_stratum)
+    weights = pd.DataFrame({
+        'Stratum': uniques,
+        'Rows': counts,
+        'Sampled': sampled,
+        'Weight': counts / sampled,
+    }).sort_values('Stratum', ignore_index=True)
+
+    return df.iloc[keep].reset_index(drop=True), weights
+
+
+def row_weights(strata: pd.Series, weights: pd.DataFrame) -> pd.Series:
+    '''
+    Returns the weight of each row from its stratum, see stratified_sample.
+    '''
+    return strata.map(weights.set_index('Stratum')['Weight'])
@@ -0,0 +1,343 @@
+'''
+    This module generates synthetic APC extracts of any size, for testing
+    and benchmarking the pipeline beyond the sample data file.
+
+    The columns come from a definition file and their types from
+    data/Schema.csv. Coded fields take the values of the enums in
+    Probe_classes and diagnoses come from data/all_used_diag_codes.txt.
+    The file is written a block of rows at a time, so its size isn't
+    limited by memory.
+
+    Two formats are written:
+      - raw: comma delimited with the definition's column names, like
+        data/raw/APC_Sample_Test_Data.csv
+      - zl: pipe delimited with zl style column names (DIAG01, HAR AGE),
+        dotted codes and bare 3 character diagnoses, for process_zl_data_file
+'''
+import argparse
+from os import path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from Probe_classes.admit_method import AdmitMethod
+from Probe_classes.admit_source import AdmitSource
+from Probe_classes.discharge_destination import DischargeDestination
+from Probe_classes.discharge_method import DischargeMethod
+from Probe_classes.main_specialty import MainSpecialty
+from Probe_classes.patient_classification import PatientClassification
+from Probe_classes.sex import Sex
+from Probe_classes.treatment_function_code import TreatmentFunctionCode
+from Utils.data_types import load_schema
+from Utils.grouper_file_columns import parse_definition_file
+from Utils.time_to_run import ttr
+from Utils.constants import (DATA_FILE_FOLDER, ALL_USED_DIAG_CODES_FILE,
+                             BASE_RDF_FILE, DEFAULT_RDF_FILE,
+                             DIAGNOSIS_PREFIX, PROCEDURE_PREFIX)
+
+FILE_FORMATS = {'raw': ',', 'zl': '|'}
+SYNTHETIC_FILE_ENCODING = 'cp1252'
+SYNTHETIC_BLOCK_ROWS = 100000
+
+CODED_COLUMNS = [AdmitMethod, AdmitSource, DischargeDestination, DischargeMethod,
+                 MainSpecialty, PatientClassification, Sex, TreatmentFunctionCode]
+# The values most episodes have, the rest of each enum shares what's left
+COMMON_VALUES = {
+    'SEX': ['1', '2'],
+    'CLASSPAT': ['1', '2'],
+    'ADMISORC': ['19'],
+    'ADMIMETH': ['11', '12', '21', '22'],
+    'DISDEST': ['19', '98'],
+    'DISMETH': ['1', '8'],
+}
+COMMON_VALUE_SHARE = 0.9
+# Columns that are the same for every episode of a spell, unless it's inconsistent
+SPELL_COLUMNS = ['STARTAGE', 'SEX', 'CLASSPAT', 'ADMISORC', 'ADMIMETH',
+                 'DISDEST', 'DISMETH', 'MAINSPEF', 'TRETSPEF']
+# Columns that vary between the episodes of an inconsistent spell
+INCONSISTENT_COLUMNS = ['MAINSPEF', 'TRETSPEF']
+DEFAULT_SPELL_EPISODE_WEIGHTS = {1: 0.8, 2: 0.12, 3: 0.05, 4: 0.02, 5: 0.01}
+FIRST_PROVSPNO = 1000000000
+OPER_CODE_COUNT = 5000
+
+
+def main():
+    '''
+        This function is the main entry point for the script.
+    '''
+    parser = argparse.ArgumentParser(description="Generate a synthetic APC data file.")
+    parser.add_argument("output_file", help="File to write.")
+    parser.add_argument("episodes", type=int, help="Number of episodes (rows) to write.")
+    parser.add_argument("--format", choices=list(FILE_FORMATS), default='raw',
+                        help="raw (comma delimited) or zl (pipe delimited zl extract).")
+    parser.add_argument("--definition-file", default=None,
+                        help="Definition file for the columns, by default the APC one for "
+                             "raw files and the max codes one for zl files.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+    parser.add_argument("--diag-count-mean", type=float, default=4.0,
+                        help="Average number of diagnoses per episode.")
+    parser.add_argument("--oper-count-mean", type=float, default=1.0,
+                        help="Average number of procedures per episode.")
+    parser.add_argument("--spell-episode-weights", default=None,
+                        help="Weights for the number of episodes per spell, e.g. 1:0.8,2:0.2")
+    args = parser.parse_args()
+
+    spell_episode_weights = None
+    if args.spell_episode_weights is not None:
+        spell_episode_weights = {int(count): float(weight) for count, weight in
+                                 (pair.split(':') for pair in args.spell_episode_weights.split(','))}
+
+    time = ttr()
+    generate_apc_data(args.output_file, args.episodes, args.format, args.definition_file,
+                      seed=args.seed, spell_episode_weights=spell_episode_weights,
+                      diag_count_mean=args.diag_count_mean,
+                      oper_count_mean=args.oper_count_mean)
+    print(f"{args.episodes} episodes written to {args.output_file}")
+    _ = ttr(time)
+
+def generate_apc_data(output_file: str,
+                      episodes: int,
+                      file_format: str = 'raw',
+                      definition_file: Optional[str] = None,
+                      seed: Optional[int] = None,
+                      spell_episode_weights: Optional[dict] = None,
+                      diag_count_mean: float = 4.0,
+                      oper_count_mean: float = 1.0,
+                      inconsistent_spell_fraction: float = 0.1,
+                      block_rows: int = SYNTHETIC_BLOCK_ROWS) -> str:
+    '''
+    Writes a synthetic APC data file of the given number of episodes,
+    block_rows at a time.
+
+    :param output_file: The file to write.
+    :param episodes: The number of episodes (rows) to write.
+    :param file_format: 'raw' (comma delimited) or 'zl' (pipe delimited zl extract).
+    :param definition_file: The definition file with the columns to write, by default
+        BASE_RDF_FILE for raw files and DEFAULT_RDF_FILE for zl files.
+    :param seed: The random seed, the same seed and settings give the same file.
+    :param spell_episode_weights: The relative frequency of each number of episodes per spell.
+    :param diag_count_mean: The average number of diagnoses per episode (at least 1).
+    :param oper_count_mean: The average number of procedures per episode.
+    :param inconsistent_spell_fraction: The fraction of multi-episode spells whose
+        episodes have different specialties, so they can't be combined.
+    :param block_rows: The number of rows generated and written at a time.
+    :return: The path to the output file.
+    '''
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"file_format must be one of {list(FILE_FORMATS)}")
+    if definition_file is None:
+        definition_file = path.join(DATA_FILE_FOLDER,
+                                    BASE_RDF_FILE if file_format == 'raw' else DEFAULT_RDF_FILE)
+
+    _, column_definitions = parse_definition_file(definition_file)
+    columns = [column[0] for column in column_definitions]
+    generator = SyntheticApcGenerator(columns, seed, spell_episode_weights, diag_count_mean,
+                                      oper_count_mean, inconsistent_spell_fraction)
+
+    delimiter = FILE_FORMATS[file_format]
+    with open(output_file, 'w', encoding=SYNTHETIC_FILE_ENCODING, newline='') as file:
+        # Always one block, so an empty file still gets its header
+        for start in range(0, max(episodes, 1), block_rows):
+            df = generator.generate_block(min(block_rows, episodes - start))
+            if file_format == 'zl':
+                df = to_zl_format(df)
+            df.to_csv(file, sep=delimiter, index=False, header=start == 0,
+                      lineterminator='\n')
+
+    return output_file
+
+
+class SyntheticApcGenerator:
+    '''
+    Generates blocks of synthetic episodes, spell by spell. Spells never
+    span blocks, the last spell of each block is cut short to fit it.
+    '''
+
+    def __init__(self, columns: list[str],
+                 seed: Optional[int] = None,
+                 spell_episode_weights: Optional[dict] = None,
+                 diag_count_mean: float = 4.0,
+                 oper_count_mean: float = 1.0,
+                 inconsistent_spell_fraction: float = 0.1):
+        '''
+        :param columns: The columns to generate, in order.
+        See generate_apc_data for the other parameters.
+        '''
+        self.columns = columns
+        self.rng = np.random.default_rng(seed)
+        self.diag_count_mean = max(diag_count_mean, 1.0)
+        self.oper_count_mean = max(oper_count_mean, 0.0)
+        self.inconsistent_spell_fraction = inconsistent_spell_fraction
+        self.next_provspno = FIRST_PROVSPNO
+
+        weights = spell_episode_weights or DEFAULT_SPELL_EPISODE_WEIGHTS
+        self.spell_sizes = np.array(list(weights), dtype=np.int64)
+        self.spell_size_weights = normalise(np.array(list(weights.values()), dtype=float))
+
+        self.diag_columns = [column for column in columns if column.startswith(DIAGNOSIS_PREFIX)]
+        self.oper_columns = [column for column in columns if column.startswith(PROCEDURE_PREFIX)]
+        self.integer_columns = {column for column, dtype in load_schema().items()
+                                if dtype.startswith(('Int', 'UInt'))}
+        self.coded_values = {enum.column_name(): coded_value_weights(enum)
+                             for enum in CODED_COLUMNS if enum.column_name() in columns}
+
+        # A few codes are far more common than the rest
+        self.diag_codes = load_diag_codes()
+        self.diag_weights = zipf_weights(len(self.diag_codes), self.rng)
+        self.oper_codes = make_oper_codes(OPER_CODE_COUNT, self.rng)
+        self.oper_weights = zipf_weights(len(self.oper_codes), self.rng)
+
+    def generate_block(self, rows: int) -> pd.DataFrame:
+        '''
+        Generates whole spells up to rows episodes, the last one cut short
+        if it doesn't fit.
+        '''
+        # Every spell has at least one episode, so rows spells is always enough
+        sizes = self.rng.choice(self.spell_sizes, size=max(rows, 1), p=self.spell_size_weights)
+        ends = np.cumsum(sizes)
+        spells = int(np.searchsorted(ends, rows)) + 1 if rows > 0 else 0
+        sizes = sizes[:spells]
+        if spells:
+            sizes[-1] -= ends[spells - 1] - rows
+
+        spell_of_row = np.repeat(np.arange(spells), sizes)
+        first_row = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        row_count = len(spell_of_row)
+
+        data = {column: np.zeros(row_count, dtype=np.int64) if column in self.integer_columns
+                else np.full(row_count, '', dtype=object)
+                for column in self.columns}
+        data['PROCODET'] = np.full(row_count, 'ZZZ', dtype=object)
+        data['PROVSPNO'] = (self.next_provspno + spell_of_row).astype(str).astype(object)
+        data['EPIORDER'] = np.arange(row_count) - first_row + 1
+        self.next_provspno += spells
+
+        # Spell level values, with the specialties of inconsistent spells per episode
+        for column in SPELL_COLUMNS:
+            if column in data:
+                data[column] = self._spell_values(column, spells)[spell_of_row]
+        inconsistent = (self.rng.random(spells) < self.inconsistent_spell_fraction)[spell_of_row]
+        for column in INCONSISTENT_COLUMNS:
+            if column in data and inconsistent.any():
+                data[column] = np.where(inconsistent, self._values(column, row_count),
+                                        data[column])
+
+        day_case = data['CLASSPAT'].astype(str) == '2' if 'CLASSPAT' in data else False
+        data['EPIDUR'] = np.where(day_case, 0, self.rng.geometric(0.2, size=row_count) - 1)
+        if 'NEOCARE' in data:
+            data['NEOCARE'] = np.full(row_count, 8)
+
+        diag_counts = 1 + self.rng.poisson(self.diag_count_mean - 1, size=row_count)
+        data.update(self._codes(self.diag_columns, diag_counts, self.diag_codes,
+                                self.diag_weights))
+        oper_counts = self.rng.poisson(self.oper_count_mean, size=row_count)
+        data.update(self._codes(self.oper_columns, oper_counts, self.oper_codes,
+                                self.oper_weights))
+
+        return pd.DataFrame({column: data[column] for column in self.columns})
+
+    def _spell_values(self, column: str, spells: int) -> np.ndarray:
+        '''
+        Returns a value per spell for one of the SPELL_COLUMNS.
+        '''
+        if column == 'STARTAGE':
+            # Skewed to older patients, averaging about 55
+            return (self.rng.beta(2.0, 1.6, size=spells) * 101).astype(np.int64)
+        return self._values(column, spells)
+
+    def _values(self, column: str, count: int) -> np.ndarray:
+        '''
+        Returns count values of a coded column, or empty values for a
+        column without an enum.
+        '''
+        if column not in self.coded_values:
+            return np.full(count, '', dtype=object)
+        values, weights = self.coded_values[column]
+        values = self.rng.choice(values, size=count, p=weights)
+        return values.astype(np.int64) if column in self.integer_columns else values
+
+    def _codes(self, columns: list[str], counts: np.ndarray, codes: np.ndarray,
+               weights: np.ndarray) -> dict:
+        '''
+        Returns code columns with the first count of them filled in for each row.
+        '''
+        counts = np.minimum(counts, len(columns))
+        filled = int(counts.max()) if len(counts) else 0
+        values = {column: np.full(len(counts), '', dtype=object) for column in columns}
+        for position, column in enumerate(columns[:filled]):
+            rows = np.flatnonzero(counts > position)
+            values[column][rows] = self.rng.choice(codes, size=len(rows), p=weights)
+        return values
+
+
+def to_zl_format(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Converts a block of raw format rows to the zl extract's layout: DIAG
+    and OPER columns without the underscore, STARTAGE as HAR AGE, and
+    codes with a period after the third character, diagnoses padded with
+    an X written without it (e.g. R13X -> R13, A009 -> A00.9).
+    '''
+    df = df.copy()
+    for column in df.columns:
+        if column.startswith(DIAGNOSIS_PREFIX) or column.startswith(PROCEDURE_PREFIX):
+            codes = df[column]
+            # Most code columns are empty
+            if not codes.astype(bool).any():
+                continue
+            if column.startswith(DIAGNOSIS_PREFIX):
+                codes = codes.mask((codes.str.len() == 4) & codes.str.endswith('X'),
+                                   codes.str[:3])
+            df[column] = codes.mask(codes.str.len() > 3, codes.str[:3] + '.' + codes.str[3:])
+
+    renames = {column: column.replace('_', '') for column in df.columns
+               if column.startswith(DIAGNOSIS_PREFIX) or column.startswith(PROCEDURE_PREFIX)}
+    renames['STARTAGE'] = 'HAR AGE'
+    return df.rename(columns=renames)
+
+def coded_value_weights(enum) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the values of a Probe_classes enum as strings and how often
+    each should occur: the column's COMMON_VALUES share COMMON_VALUE_SHARE
+    of the episodes, the rest share what's left.
+    '''
+    values = np.array([str(member.value) for member in enum], dtype=object)
+    common = np.isin(values, COMMON_VALUES.get(enum.column_name(), []))
+    if not common.any() or common.all():
+        return values, np.full(len(values), 1 / len(values))
+    weights = np.where(common, COMMON_VALUE_SHARE / common.sum(),
+                       (1 - COMMON_VALUE_SHARE) / (~common).sum())
+    return values, normalise(weights)
+
+def load_diag_codes() -> np.ndarray:
+    '''
+    Returns the diagnosis codes in data/all_used_diag_codes.txt.
+    '''
+    codes_file = path.join(DATA_FILE_FOLDER, ALL_USED_DIAG_CODES_FILE)
+    with open(codes_file, encoding='utf-8') as file:
+        codes = [line.strip() for line in file if line.strip()]
+    return np.array(codes, dtype=object)
+
+def make_oper_codes(count: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Returns count distinct OPCS style procedure codes (a chapter letter
+    and three digits). There's no list of the codes in use to draw from.
+    '''
+    chapters = np.array(list('ABCDEFGHJKLMNOPQRSTUVWXYZ'), dtype=object)
+    numbers = rng.choice(len(chapters) * 1000, size=count, replace=False)
+    return chapters[numbers // 1000] + np.char.zfill((numbers % 1000).astype(str), 3).astype(object)
+
+def zipf_weights(count: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Returns weights for count items that fall off with rank, in a random order.
+    '''
+    weights = 1 / np.arange(1, count + 1)
+    return normalise(rng.permutation(weights))
+
+def normalise(weights: np.ndarray) -> np.ndarray:
+    '''
+    Scales the weights to sum to 1.
+    '''
+    return weights / weights.sum()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+'''
+A stand-in for the HRG grouper (HRGGrouperc.exe) so the pipeline can be run
+and benchmarked where the real grouper isn't available, e.g. on Linux.
+
+It takes the same arguments run_grouper passes (-i -o -d -l -h -v), reads
+the input with the RDF's column layout and writes the _FCE, _spell,
+_quality and _ub_rel files in the layouts in Utils/grouper_file_columns.
+The HRGs are NOT real HRGs, they come from simple deterministic rules:
+  - Procedure driven if there's an OPER_01, else diagnosis driven, else
+    an error (UZ01Z) with a quality file entry
+  - The HRG's chapter and number come from the driving code
+  - The split letter comes from the count of secondary diagnoses (the CC
+    count), moved up one for patients aged 70 and over, and is Z for
+    procedure driven day cases
+  - Each spell's HRG is that of its dominant episode (procedure driven
+    first, then the most CCs, then the first)
+  - Each U (imaging) and X code after OPER_01 unbundles an HRG
+
+To use it set GROUPER_EXE to this file (it needs to be executable). To
+slow it down to a realistic grouping rate set FAKE_GROUPER_ROWS_PER_SECOND.
+'''
+import argparse
+import sys
+import time
+from os import getenv
+from typing import Optional
+import numpy as np
+import pandas as pd
+from Probe_classes.grouper_file_type import GrouperFileType
+from Utils.grouper_data_import import get_grouper_output_file_by_type, GROUPER_FILE_ENCODING
+from Utils.grouper_file_columns import (parse_definition_file, fce_file_additional_cols,
+                                        spell_file_additional_cols,
+                                        quality_file_additional_cols,
+                                        ub_rel_file_additional_cols)
+from Utils.constants import APC_GROUPER_ALGORITHM, DIAGNOSIS_PREFIX, PROCEDURE_PREFIX
+
+ROWS_PER_SECOND_VARIABLE = 'FAKE_GROUPER_ROWS_PER_SECOND'
+# Subchapters the driving codes are spread over
+HRG_SUBCHAPTERS = ['AA', 'BZ', 'CA', 'CB', 'DZ', 'EB', 'EC', 'EY', 'FD', 'FE', 'FF',
+                   'GA', 'GB', 'GC', 'HD', 'HE', 'HN', 'HT', 'JA', 'JD', 'KA', 'KB',
+                   'KC', 'LA', 'LB', 'MA', 'MB', 'NZ', 'PB', 'PC', 'SA', 'VC', 'WH']
+# Split letters by CC band, fewest CCs first
+CC_SPLITS = 'EDCBA'
+ERROR_HRG = 'UZ01Z'
+UNBUNDLED_PREFIXES = {'U': 'RD', 'X': 'XD'}
+
+
+def main():
+    '''
+        This function is the main entry point for the script.
+    '''
+    parser = argparse.ArgumentParser(description="Stand-in for the HRG grouper.",
+                                     add_help=False)
+    parser.add_argument("-i", dest="input_file", required=True, help="Input file.")
+    parser.add_argument("-o", dest="output_file", required=True, help="Output file.")
+    parser.add_argument("-d", dest="definitions_file", required=True, help="RDF file.")
+    parser.add_argument("-l", dest="logic", default=APC_GROUPER_ALGORITHM,
+                        help="Grouping logic, only APC is supported.")
+    parser.add_argument("-h", dest="header", action="store_true",
+                        help="The input file has a header row.")
+    parser.add_argument("-v", dest="verbose", action="store_true", help="Verbose output.")
+    parser.add_argument("--rows-per-second", type=float,
+                        default=float(getenv(ROWS_PER_SECOND_VARIABLE, '0')),
+                        help="Throttle grouping to this many rows a second (0 for no limit).")
+    parser.add_argument("--help", action="help", help="Show this help message and exit.")
+    args = parser.parse_args()
+
+    if args.logic != APC_GROUPER_ALGORITHM:
+        print(f"Unsupported grouping logic: {args.logic}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        group_file(args.input_file, args.output_file, args.definitions_file,
+                   args.header, args.verbose, args.rows_per_second)
+    except (OSError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        sys.exit(1)
+
+def group_file(input_file: str, output_file: str, definitions_file: str,
+               header: bool = True, verbose: bool = False,
+               rows_per_second: Optional[float] = None) -> None:
+    '''
+    Groups the input file and writes the grouper output files.
+    If rows_per_second is set the output isn't written until the time the
+    grouping would have taken at that rate has passed.
+    '''
+    start = time.perf_counter()
+    delimiter, column_mappings = parse_definition_file(definitions_file)
+    display_names = [column[0] for column in column_mappings]
+
+    # Columns are taken by position, as the grouper does, any extra are ignored
+    df = pd.read_csv(input_file, sep=delimiter, header=None, skiprows=1 if header else 0,
+                     dtype=str, na_filter=False, encoding=GROUPER_FILE_ENCODING)
+    df = df.iloc[:, :len(display_names)]
+    df.columns = display_names[:df.shape[1]]
+    if verbose:
+        print(f"Read {len(df)} rows from {input_file}", flush=True)
+
+    fce_df = group_episodes(df)
+    spell_df = group_spells(df, fce_df)
+    if verbose:
+        print(f"Grouped {len(fce_df)} FCEs into {len(spell_df)} spells", flush=True)
+
+    if rows_per_second:
+        remaining = len(df) / rows_per_second - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    write_outputs(df, fce_df, spell_df, output_file, delimiter, column_mappings)
+    if verbose:
+        print(f"Wrote the grouper output files for {output_file}", flush=True)
+
+def group_episodes(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Groups each row (episode) of the input.
+    return: a df of the episode level results, with a list of unbundled
+    HRGs per episode and the CC band and error of each episode.
+    '''
+    diag_columns = [column for column in df.columns if column.startswith(DIAGNOSIS_PREFIX)]
+    oper_columns = [column for column in df.columns if column.startswith(PROCEDURE_PREFIX)]
+    empty = pd.Series('', index=df.index)
+    primary_diag = df[diag_columns[0]] if diag_columns else empty
+    primary_oper = df[oper_columns[0]] if oper_columns else empty
+
+    age = pd.to_numeric(df.get('STARTAGE', empty), errors='coerce')
+    epidur = pd.to_numeric(df.get('EPIDUR', empty), errors='coerce').fillna(0).astype(int)
+    cc_count = (df[diag_columns[1:]] != '').sum(axis=1) if len(diag_columns) > 1 else 0
+
+    method = np.select([primary_oper != '', primary_diag != ''], ['P', 'D'], 'U')
+    driving_code = primary_oper.where(method == 'P', primary_diag)
+
+    band = np.minimum(cc_count // 2 + (age >= 70).astype(int), len(CC_SPLITS) - 1)
+    split = pd.Series(np.asarray(list(CC_SPLITS))[band], index=df.index)
+    split = split.mask((method == 'P') & (epidur == 0), 'Z')
+
+    hrg = (driving_code_hrg_stem(driving_code) + split).where(method != 'U', ERROR_HRG)
+    trimpoint = hrg_trimpoint(hrg)
+
+    return pd.DataFrame({
+        'RowNo': np.arange(1, len(df) + 1),
+        'FCE_HRG': hrg,
+        'GroupingMethodFlag': method,
+        'DominantProcedure': primary_oper.where(method == 'P', ''),
+        'FCE_PBC': np.where(method == 'U', 'N', 'Y'),
+        'CalcEpidur': epidur,
+        'ReportingEPIDUR': epidur,
+        'FCETrimpoint': trimpoint,
+        'FCEExcessBeddays': np.maximum(epidur - trimpoint, 0),
+        'Band': np.where(method == 'U', -1, band),
+        'Error': np.where(method == 'U', f"{diag_columns[0] if diag_columns else ''}||"
+                                         "Primary diagnosis is missing", ''),
+        'UnbundledHRGs': unbundled_hrgs(df[oper_columns[1:]]),
+    }, index=df.index)
+
+def group_spells(df: pd.DataFrame, fce_df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Groups the episodes into spells by PROCODET and PROVSPNO.
+    return: a df with one row per spell in the spell file layout (plus the
+    position of the spell's dominant episode), in order of first episode.
+    '''
+    diag_columns = [column for column in df.columns if column.startswith(DIAGNOSIS_PREFIX)]
+    spell_ids = get_spell_ids(df)
+    positions = np.arange(len(df))
+
+    # Dominant episode: procedure driven, then most CCs, then first
+    priority = (fce_df['GroupingMethodFlag'].to_numpy() == 'P') * 10 + fce_df['Band'].to_numpy()
+    order = np.lexsort((positions, -priority, spell_ids))
+    first_of_spell = np.r_[True, spell_ids[order][1:] != spell_ids[order][:-1]]
+    dominant = order[first_of_spell]
+    first = pd.Series(positions).groupby(spell_ids).min().to_numpy()
+
+    los = fce_df['CalcEpidur'].groupby(spell_ids).sum().to_numpy()
+    cc_days = (pd.to_numeric(df['CRITICALCAREDAYS'], errors='coerce').fillna(0).astype(int)
+               .groupby(spell_ids).sum().to_numpy()
+               if 'CRITICALCAREDAYS' in df.columns else 0)
+    unbundled = fce_df['UnbundledHRGs'].groupby(spell_ids).agg(
+        lambda hrgs: [hrg for episode in hrgs for hrg in episode]).to_list()
+
+    spell_hrg = fce_df['FCE_HRG'].to_numpy()[dominant]
+    trimpoint = hrg_trimpoint(pd.Series(spell_hrg)).to_numpy()
+    secondary = (df[diag_columns[1]].to_numpy()[dominant] if len(diag_columns) > 1
+                 else np.full(len(dominant), ''))
+
+    spell_df = pd.DataFrame({
+        'RowNo': first + 1,
+        'PROCODET': df['PROCODET'].to_numpy()[first],
+        'PROVSPNO': df['PROVSPNO'].to_numpy()[first],
+        'SpellHRG': spell_hrg,
+        'SpellGroupingMethodFlag': fce_df['GroupingMethodFlag'].to_numpy()[dominant],
+        'SpellDominantProcedure': fce_df['DominantProcedure'].to_numpy()[dominant],
+        'SpellPDiag': (df[diag_columns[0]].to_numpy()[first] if diag_columns
+                       else np.full(len(first), '')),
+        'SpellSDiag': secondary,
+        'SpellEpisodeCount': np.bincount(spell_ids),
+        'SpellLOS': los,
+        'ReportingSpellLOS': los,
+        'SpellTrimpoint': trimpoint,
+        'SpellExcessBeddays': np.maximum(los - trimpoint, 0),
+        'SpellCCDays': cc_days,
+        'SpellPBC': fce_df['FCE_PBC'].to_numpy()[dominant],
+        'SpellSSC_Ct': 0,
+        **{f'SpellSSCs{number}': '' for number in range(1, 8)},
+        'SpellBP_Ct': 0,
+        **{f'SpellBP{number}': '' for number in range(1, 8)},
+        'SpellFlag_Ct': 0,
+        **{f'SpellFlag{number}': '' for number in range(1, 8)},
+        'UnbundledHRGs': unbundled,
+        'Dominant': dominant,
+    })
+    return spell_df
+
+def get_spell_ids(df: pd.DataFrame) -> np.ndarray:
+    '''
+    Numbers the spells (PROCODET and PROVSPNO) in order of their first episode.
+    '''
+    spell_ids, _ = pd.factorize(pd.MultiIndex.from_arrays([df['PROCODET'], df['PROVSPNO']]))
+    return spell_ids
+
+def driving_code_hrg_stem(codes: pd.Series) -> pd.Series:
+    '''
+    Returns the first four characters of the HRG for each driving code:
+    its subchapter and a number. Each distinct code is only worked out once.
+    '''
+    positions, distinct = pd.factorize(codes)
+    stems = [f"{HRG_SUBCHAPTERS[ord(code[0]) % len(HRG_SUBCHAPTERS)]}"
+             f"{sum(map(ord, code[:3])) % 90 + 10:02d}" if code else ''
+             for code in distinct]
+    return pd.Series(np.asarray(stems, dtype=object)[positions], index=codes.index)
+
+def hrg_trimpoint(hrgs: pd.Series) -> pd.Series:
+    '''
+    Returns a trimpoint (days) for each HRG, from its number and split.
+    '''
+    number = pd.to_numeric(hrgs.str[2:4], errors='coerce').fillna(0).astype(int)
+    split = hrgs.str[4:5].map(lambda letter: 'ZEDCBA'.find(letter) if letter else 0)
+    return number % 10 + split.fillna(0).astype(int) * 3 + 2
+
+def unbundled_hrgs(oper_df: pd.DataFrame) -> list[list[str]]:
+    '''
+    Returns the unbundled HRGs of each row, one for each procedure with a
+    prefix in UNBUNDLED_PREFIXES.
+    '''
+    unbundled = [[] for _ in range(len(oper_df))]
+    for column in oper_df.columns:
+        codes = oper_df[column]
+        prefix = codes.str[:1].map(UNBUNDLED_PREFIXES)
+        rows = np.flatnonzero(prefix.notna().to_numpy())
+        if not len(rows):
+            continue
+        hrgs = prefix.iloc[rows] + codes.iloc[rows].map(
+            lambda code: f"{sum(map(ord, code)) % 50 + 20:02d}Z")
+        for row, hrg in zip(rows, hrgs):
+            unbundled[row].append(hrg)
+    return unbundled
+
+def write_outputs(df: pd.DataFrame, fce_df: pd.DataFrame, spell_df: pd.DataFrame,
+                  output_file: str, delimiter: str, column_mappings: list) -> None:
+    '''
+    Writes the _FCE, _spell, _quality and _ub_rel files for output_file.
+    '''
+    input_columns = [column[0] for column in column_mappings]
+
+    # Every episode carries its spell's results
+    spell_is_reported = np.zeros(len(df), dtype=int)
+    spell_is_reported[spell_df['Dominant'].to_numpy()] = 1
+
+    fce_columns = [column[0] for column in fce_file_additional_cols(list(column_mappings))]
+    fce_output = pd.concat([df.reset_index(drop=True),
+                            fce_df.drop(columns=['Band', 'Error']).reset_index(drop=True)],
+                           axis=1)
+    fce_output['SpellReportFlag'] = spell_is_reported
+    spell_results = spell_df.iloc[get_spell_ids(df)].reset_index(drop=True)
+    for column in fce_columns:
+        if column not in fce_output.columns:
+            fce_output[column] = spell_results[column] if column in spell_results else ''
+    fce_output['FCESSC_Ct'] = 0
+    write_grouper_file(fce_output[fce_columns], fce_df['UnbundledHRGs'].to_list(),
+                       get_grouper_output_file_by_type(output_file, GrouperFileType.FCE),
+                       delimiter)
+
+    spell_columns = [column[0] for column in spell_file_additional_cols()]
+    write_grouper_file(spell_df[spell_columns], spell_df['UnbundledHRGs'].to_list(),
+                       get_grouper_output_file_by_type(output_file, GrouperFileType.SPELL),
+                       delimiter)
+
+    quality_columns = [column[0] for column in quality_file_additional_cols(list(column_mappings))]
+    errors = (fce_df['Error'] != '').to_numpy()
+    quality_output = df[errors].reset_index(drop=True)
+    quality_output['RowNo'] = fce_df['RowNo'].to_numpy()[errors]
+    quality_output['Error Message1'] = fce_df['Error'].to_numpy()[errors]
+    quality_output = quality_output.reindex(columns=quality_columns, fill_value='')
+    write_grouper_file(quality_output, None,
+                       get_grouper_output_file_by_type(output_file, GrouperFileType.QUALITY),
+                       delimiter)
+
+    ub_columns = [column[0] for column in ub_rel_file_additional_cols()]
+    ub_rows = [(row_number, iteration, hrg)
+               for row_number, hrgs in zip(fce_df['RowNo'], fce_df['UnbundledHRGs'])
+               for iteration, hrg in enumerate(hrgs, start=1)]
+    write_grouper_file(pd.DataFrame(ub_rows, columns=ub_columns), None,
+                       get_grouper_output_file_by_type(output_file, GrouperFileType.UB),
+                       delimiter)
+
+def write_grouper_file(df: pd.DataFrame, unbundled: Optional[list[list[str]]],
+                       output_file: str, delimiter: str) -> None:
+    '''
+    Writes a grouper output file. If unbundled is given, df's last column
+    is UnbundledHRGs and, as the grouper does, the first unbundled HRG of
+    each row goes in it and the rest follow as extra fields.
+    '''
+    if unbundled is not None:
+        df = df.copy()
+        df[df.columns[-1]] = [hrgs[0] if hrgs else '' for hrgs in unbundled]
+
+    text = df.to_csv(sep=delimiter, index=False, lineterminator='\n')
+    if unbundled is not None and any(len(hrgs) > 1 for hrgs in unbundled):
+        lines = text.split('\n')
+        for row, hrgs in enumerate(unbundled, start=1):
+            if len(hrgs) > 1:
+                lines[row] += delimiter + delimiter.join(hrgs[1:])
+        text = '\n'.join(lines)
+
+    with open(output_file, 'w', encoding=GROUPER_FILE_ENCODING, newline='') as file:
+        file.write(text)
+
+
+if __name__ == "__main__":
+    main()
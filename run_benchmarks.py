@@ -0,0 +1,64 @@
+'''
+Runs the benchmark suite over synthetic data of several sizes, records the
+results in the benchmark history and flags regressions against the median
+of the recent runs on this machine.
+'''
+import argparse
+import sys
+from os import makedirs, path
+from Benchmarks.cases import BENCHMARK_CASES
+from Benchmarks.harness import (run_benchmarks, machine_info, load_history, baseline_results,
+                                confirm_regressions, record_run, print_report,
+                                MIN_REGRESSION_REPEAT)
+from Utils.time_to_run import ttr
+from Utils.constants import BENCHMARK_FILE_FOLDER, BENCHMARK_HISTORY_FILE
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+FULL_SIZES = DEFAULT_SIZES + [1000000]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline's hot paths.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=None,
+                        help=f"Numbers of rows to benchmark at (default {DEFAULT_SIZES}).")
+    parser.add_argument("--full", action="store_true",
+                        help=f"Benchmark at {FULL_SIZES} rows.")
+    parser.add_argument("--only", nargs='+', default=None,
+                        choices=[case.name for case in BENCHMARK_CASES],
+                        help="Only run these benchmarks.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Times to run each benchmark, the fastest is kept. "
+                             f"Times of fewer than {MIN_REGRESSION_REPEAT} aren't checked "
+                             "for regressions.")
+    parser.add_argument("--time-threshold", type=float, default=0.2,
+                        help="Fraction slower than recent runs that counts as a regression.")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="Fraction more peak memory than recent runs that "
+                             "counts as a regression.")
+    parser.add_argument("--no-record", action="store_true",
+                        help="Don't add this run to the benchmark history.")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with an error if there are any regressions.")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (FULL_SIZES if args.full else DEFAULT_SIZES)
+    cases = [case for case in BENCHMARK_CASES if args.only is None or case.name in args.only]
+    history_file = path.join(BENCHMARK_FILE_FOLDER, BENCHMARK_HISTORY_FILE)
+    makedirs(BENCHMARK_FILE_FOLDER, exist_ok=True)
+
+    time = ttr()
+    results = run_benchmarks(cases, sizes, args.repeat)
+
+    machine = machine_info()
+    history = load_history(history_file)
+    baseline = baseline_results(history, machine['machine'])
+    regressions = confirm_regressions(cases, results, baseline, args.time_threshold,
+                                      args.memory_threshold)
+    print_report(results, regressions, baseline)
+
+    if not args.no_record:
+        record_run(history_file, history, results, regressions, machine)
+        print(f"\nResults added to {history_file}")
+    _ = ttr(time)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
@@ -1,6 +1,7 @@
 '''
 Simple file to run all of the probes and save the results to a file.
 '''
+import argparse
 
 from Probes.admit_method import AdmitMethod
 from Probes.admit_source import AdmitSource
@@ -15,8 +16,27 @@ from Probes.start_age import StartAge
 from Probes.treatment_function_code import TreatmentFunctionCode
 from Probes.probe_base import run_multiple_probes
 from Utils.time_to_run import ttr
+from Utils.stratified_sampling import STRATA_LEVELS
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run all of the probes in a single grouper run.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of grouper processes to split the combined input across.")
+    parser.add_argument("--grouper-exe", default=None,
+                        help="Grouper executable to use instead of the GROUPER_EXE setting.")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Reuse cached grouper results for rows that have been grouped before.")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Only group one of each set of rows with identical grouping inputs.")
+    parser.add_argument("--sample-per-stratum", type=int, default=None,
+                        help="Only probe this many base rows of each SpellHRG stratum "
+                        "and GroupingMethodFlag.")
+    parser.add_argument("--sample-seed", type=int, default=None,
+                        help="Seed for picking the sampled base rows.")
+    parser.add_argument("--sample-level", choices=STRATA_LEVELS, default='subchapter',
+                        help="Strata of SpellHRG to sample from.")
+    args = parser.parse_args()
+
     NO_CACHE = True
     DATA_FILE = "./data/raw/APC_Sample_Test_Data.csv"
     RDF_FILE = "./data/HRG4+_default_APC.rdf"
@@ -38,5 +58,9 @@ if __name__ == '__main__':
     ]
 
     # Run all probes together
-    run_multiple_probes(probe_classes, no_cache=NO_CACHE, data_file=DATA_FILE, rdf_file=RDF_FILE, output_rdf=RDF_FILE)
+    run_multiple_probes(probe_classes, no_cache=NO_CACHE, data_file=DATA_FILE, rdf_file=RDF_FILE,
+                        output_rdf=RDF_FILE, jobs=args.jobs, grouper_exe=args.grouper_exe,
+                        use_result_cache=args.result_cache, dedupe=args.dedupe,
+                        sample_per_stratum=args.sample_per_stratum,
+                        sample_seed=args.sample_seed, sample_level=args.sample_level)
     _ = ttr(time)
@@ -6,8 +6,8 @@ from Utils.preprocess_raw_data_file import process_zl_data_file
 from Utils.time_to_run import ttr
 from Utils.run_grouper import run_grouper
 from Utils.grouper_file_columns import fce_file_additional_cols, parse_definition_file
-from Utils.grouper_data_import import (read_data,
-                                       get_grouper_output_file_by_type)
+from Utils.grouper_data_import import get_grouper_output_file_by_type
+from Utils.frame_cache import read_data_cached
 from Utils.grouper_df_utils import write_output
 from Utils.constants import (DATA_FILE_FOLDER,
                               DEFAULT_RDF_FILE,
@@ -43,7 +43,7 @@ if __name__ == '__main__':
     definition_file_path = path.join(DATA_FILE_FOLDER, RDF)
     delimiter, column_mappings = parse_definition_file(definition_file_path)
     column_mappings = fce_file_additional_cols(column_mappings)
-    df_grouper_output = read_data(grouper_output_fce, column_mappings, delimiter)
+    df_grouper_output = read_data_cached(grouper_output_fce, column_mappings, delimiter)
     df_processed = add_tariff_columns(df_grouper_output)
     processed_file = path.join(PROCESSED_FILE_FOLDER, f"processed_data_{FILE_NAME}.csv")
     write_output(df_processed, processed_file,",")
@@ -0,0 +1,67 @@
+'''
+    Tests for reading ragged grouper output files.
+'''
+import pytest
+import Utils.grouper_data_import as gdi
+
+FIXED_COLUMNS = [f"C{number}" for number in range(30)]
+COLUMNS = FIXED_COLUMNS + [gdi.UNBUNDLED_HRG_COLUMN]
+COLUMN_DEFINITIONS = [(column, column, 0) for column in COLUMNS]
+# More than one low_memory chunk of the C parser
+ROW_COUNT = 100000
+WIDEST_ROW = 5
+WIDEST_TAIL = 20
+
+
+def tail_length(row: int) -> int:
+    '''
+    The number of unbundled HRGs on each row, only one row is the widest.
+    '''
+    return WIDEST_TAIL if row == WIDEST_ROW else row % 3
+
+
+@pytest.fixture(name="ragged_file", scope="module")
+def fixture_ragged_file(tmp_path_factory):
+    '''
+    A grouper output file whose rows have 0 to WIDEST_TAIL unbundled HRGs.
+    '''
+    data_file = tmp_path_factory.mktemp("grouper_output") / "ragged_FCE.csv"
+    with open(data_file, 'w', encoding=gdi.GROUPER_FILE_ENCODING) as file:
+        file.write(",".join(COLUMNS) + "\n")
+        for row in range(ROW_COUNT):
+            tail = [f"U{iteration}" for iteration in range(tail_length(row))] or [""]
+            file.write(",".join([str(row)] * len(FIXED_COLUMNS) + tail) + "\n")
+    return data_file
+
+
+@pytest.fixture(name="arrow_csv", params=[True, False], ids=["pyarrow", "c_parser"])
+def fixture_arrow_csv(request, monkeypatch):
+    '''
+    Runs a test with pyarrow's CSV reader and with the C parser.
+    '''
+    if request.param and not gdi.ARROW_CSV_AVAILABLE:
+        pytest.skip("pyarrow isn't installed")
+    monkeypatch.setattr(gdi, 'ARROW_CSV_AVAILABLE', request.param)
+    return request.param
+
+
+def test_read_grouper_output_keeps_the_unbundled_tail(ragged_file, arrow_csv):
+    df, unbundled_df = gdi.read_grouper_output(ragged_file, COLUMN_DEFINITIONS)
+
+    assert df.shape == (ROW_COUNT, len(COLUMNS))
+    assert len(unbundled_df) == sum(tail_length(row) for row in range(ROW_COUNT))
+    # Without a RowNo column the rows are numbered from 1
+    widest = unbundled_df[unbundled_df['RowNo'] == str(WIDEST_ROW + 1)]
+    assert widest['Iteration'].tolist() == list(range(1, WIDEST_TAIL + 1))
+    assert widest[gdi.UNBUNDLED_HRG_COLUMN].tolist() == [f"U{iteration}"
+                                                         for iteration in range(WIDEST_TAIL)]
+
+
+def test_read_data_drops_the_extra_fields(ragged_file, arrow_csv):
+    df = gdi.read_data(ragged_file, COLUMN_DEFINITIONS)
+    with_tail, _ = gdi.read_grouper_output(ragged_file, COLUMN_DEFINITIONS)
+
+    assert df.equals(with_tail)
+    assert df.loc[WIDEST_ROW, gdi.UNBUNDLED_HRG_COLUMN] == "U0"
+    assert df[gdi.UNBUNDLED_HRG_COLUMN].isna().sum() == ROW_COUNT // 3 + 1
+    assert (df.dtypes == gdi.STR_DTYPE).all()